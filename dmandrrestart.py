@@ -21,17 +21,32 @@
 # will run (w f x) (w f x)
 # # dmandrrestart.py -t1 -n2 -ww -f -x -v
 # Will run ((w x f) w w f x) ((w x f) w w f x)
+# # dmandrrestart.py -t1 --ci 5 --minreps 3 --maxreps 10
+# will repeat (w x f), dropping each type once its mean is within +/- 5s
+# # dmandrrestart.py --resume
+# will finish the last campaign in dmandrrestart.journal
+# # dmandrrestart.py -w --nodes
+# will also show when each node's PDE and vprocs came up
 ################################################################################
 
+import os
+import glob
 import time
 import datetime
 import sys
 import re
 import collections
+import json
 from subprocess import Popen, PIPE, STDOUT, call
 from optparse import OptionParser
+import math
 import abc
 
+from findrestarts import RestartTimeline, print_phase_header, print_phases, \
+                         print_phase_averages
+import savesysteminfo
+from dothilldmandr import seconds, percentile
+
 
 #patterns:
 rdt = re.compile("""(?P<time>
@@ -56,6 +71,20 @@ months = {
 
 debug = False
 verbose = False
+log = "/var/log/messages"
+waittimeout = 3600  #seconds to wait for a restart to come up or go down
+probemin = 2        #first pdestate probe interval, seconds
+probemax = 30       #pdestate probe interval backs off to this, seconds
+logpoll = 0.5       #seconds between reads of new log lines
+nodeslack = 60      #seconds after Logons are enabled to keep node lines
+#Lines that can be restart milestones, for grep -E on each node
+nodegrep = ("Force a TPA restart|TPA START|RESET START|Restart reason is"
+            "|PDE state|[Vv]proc|Logons are enabled")
+
+#Two-sided 95% Student t critical values for 1-30 degrees of freedom
+t95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+       2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+       2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
 localtime = datetime.datetime.now()
 year = int(localtime.strftime("%Y"))
 
@@ -68,9 +97,12 @@ class Restart():
         self.name = ""
         self.cmd = []
         self.kickofftime = 0 
+        self.checkpoint = None  #system log (inode, size) at kickoff
         self.starttime = 0
         self.endtime = 0
         self.elapsedtime = 0
+        self.probes = 0  #pdestate probes made while waiting
+        self.timeline = None  #RestartTimeline of the restart's milestones
         Restart.testid += 1
 
     @abc.abstractmethod
@@ -83,19 +115,26 @@ class Restart():
     def do_restart(self):
         """Perform the restart test"""
         self.kickofftime =  datetime.datetime.now().replace(microsecond=0)
+        self.checkpoint = log_checkpoint()
         if verbose:
             print "Test id:", self.testid
         if debug: 
             print "restart cmd=", self.cmd
         if verbose: print "Executing command: ", " ".join(self.cmd)
         call(self.cmd)
-        wait_til_up()
+        self.probes = wait_til_up()
         #time.sleep(2)  #In case there is a delay from pdestate up to writing to log
         try:
-            (starttime, endtime, elapsedtime) = get_restart_times(self.kickofftime)
-        except RunTimeError:  # try one more time
+            self.timeline = RestartTimeline(self.name)
+            (starttime, endtime, elapsedtime) = \
+                get_restart_times(self.kickofftime, self.checkpoint,
+                                  self.timeline)
+        except RuntimeError:  # try one more time
             print "Re-trying get_restart_times()"
-            (starttime, endtime, elapsedtime) = get_restart_times(self.kickofftime)
+            self.timeline = RestartTimeline(self.name)
+            (starttime, endtime, elapsedtime) = \
+                get_restart_times(self.kickofftime, self.checkpoint,
+                                  self.timeline)
         self.update_total(elapsedtime)
 
         return (starttime, endtime, elapsedtime)
@@ -104,6 +143,7 @@ class Restart():
 class Warmrestart(Restart):
     count = 0  # Number of warm restart tests
     total_et = datetime.timedelta(0)
+    times = []  # Elapsed time of each completed test
 
     def __init__(self):
         Restart.__init__(self)
@@ -115,11 +155,13 @@ class Warmrestart(Restart):
     def update_total(self, elapsedtime):
         """ update total elapsed time """
         Warmrestart.total_et += elapsedtime
+        Warmrestart.times.append(elapsedtime)
 
 
 class Forcerestart(Restart):
     count = 0  # Number of warm restart tests
     total_et = datetime.timedelta(0)
+    times = []  # Elapsed time of each completed test
 
     def __init__(self):
         Restart.__init__(self)
@@ -131,11 +173,13 @@ class Forcerestart(Restart):
     def update_total(self, elapsedtime):
         """ update total elapsed time """
         Forcerestart.total_et += elapsedtime
+        Forcerestart.times.append(elapsedtime)
 
 
 class Coldrestart(Restart):
     count = 0  # Number of cold restart tests
     total_et = datetime.timedelta(0)
+    times = []  # Elapsed time of each completed test
 
     def __init__(self):
         Restart.__init__(self)
@@ -147,11 +191,13 @@ class Coldrestart(Restart):
     def update_total(self, elapsedtime):
         """ update total elapsed time """
         Coldrestart.total_et += elapsedtime
+        Coldrestart.times.append(elapsedtime)
 
 
 class Downrestart(Restart):
     count = 0  # Number of down restart tests
     total_et = datetime.timedelta(0)
+    times = []  # Elapsed time of each completed test
 
     def __init__(self):
         Restart.__init__(self)
@@ -163,49 +209,149 @@ class Downrestart(Restart):
     def update_total(self, elapsedtime):
         """ update total elapsed time """
         Downrestart.total_et += elapsedtime
+        Downrestart.times.append(elapsedtime)
 
     def do_restart(self):
         """Perform the down restart test"""
         force_down()
-        wait_til_down()
+        self.probes = wait_til_down()
 
         self.kickofftime = datetime.datetime.now().replace(microsecond=0)
+        self.checkpoint = log_checkpoint()
         if verbose: print "Executing command: ", " ".join(self.cmd)
         call(self.cmd)
-        wait_til_up()
-        (starttime, endtime, elapsedtime) = get_restart_times(self.kickofftime)
+        self.probes += wait_til_up()
+        self.timeline = RestartTimeline(self.name)
+        (starttime, endtime, elapsedtime) = \
+            get_restart_times(self.kickofftime, self.checkpoint, self.timeline)
         self.update_total(elapsedtime)
 
         return (starttime, endtime, elapsedtime)
 
 
-def wait_til_up():
-    """Wait for PDE/DBS up"""
+class LogFollower():
+    """Return the lines added to a log file, following it across rotation"""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'r')
+        self.f.seek(0, 2)  #only lines written from now on
+        self.inode = os.fstat(self.f.fileno()).st_ino
+        self.partial = ""
+
+    def readlines(self):
+        """Return the complete lines written since the last call"""
+        lines = []
+        while True:
+            line = self.f.readline()
+            if not line:
+                if self.rotated():
+                    continue
+                return lines
+            self.partial += line
+            if self.partial.endswith('\n'):
+                lines.append(self.partial)
+                self.partial = ""
+
+    def rotated(self):
+        """Switch to the new file if the log has been rotated"""
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:  #renamed but not yet re-created
+            return False
+        if inode == self.inode:
+            return False
+        if debug: print "Log rotated:", self.path
+        self.f.close()
+        self.f = open(self.path, 'r')
+        self.inode = inode
+        self.partial = ""
+        return True
+
+    def close(self):
+        self.f.close()
+
+
+def pdestate():
+    """Return the output of pdestate -a"""
+    cmd = "pdestate -a"
+    if debug: print "Executing command: ", cmd
+    p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
+    stdout, stderr = p.communicate()
+    return stdout
+
+
+def pde_up(output):
+    """True if pdestate shows PDE and DBS up"""
     #PDE state is RUN/STARTED.
     #DBS state is 4: Logons are enabled - Users are logged on
 
     #PDE state is RUN/STARTED.
     #DBS state is 5: Logons are enabled - The system is quiescent
-    if verbose: print "Waiting for:  Logons are enabled"
-    cmd = "pdestate -a"
-    if debug: print "Executing command: ", cmd
-    while True:
-        dbsup = False
-        pdeup = False
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        stdout, stderr = p.communicate()
-
-        for line in stdout.splitlines():
-            mrs = rrs.match(line)   #PDE state is RUN/STARTED.
-            if mrs:
-                pdeup = True
-            mup = rup.search(line)     # Logons are enabled
-            if mup:
-                if verbose: print "Found:  Logons are enabled"
-                dbsup = True
-            if pdeup and dbsup:
-                if verbose: print "PDE and DBS up"
-                return
+    pdeup = False
+    dbsup = False
+    for line in output.splitlines():
+        if rrs.match(line):     #PDE state is RUN/STARTED.
+            pdeup = True
+        if rup.search(line):    # Logons are enabled
+            dbsup = True
+    return pdeup and dbsup
+
+
+def pde_down(output):
+    """True if pdestate shows PDE down"""
+    #PDE state: DOWN/HARDSTOP
+    for line in output.splitlines():
+        if rdn.match(line):
+            return True
+    return False
+
+
+def wait_for_pdestate(name, logpattern, confirm):
+    """Wait until confirm(pdestate output) is true
+
+    Follows the system log for logpattern and runs pdestate as soon as it
+    shows up.  Otherwise pdestate is only run every probemin seconds,
+    doubling up to probemax, so the waiting doesn't load the node whose
+    restart is being timed.  Returns the number of pdestate probes.
+    """
+    if verbose: print "Waiting for: ", name
+    follower = LogFollower(log)
+    probes = 0
+    interval = probemin
+    start = time.time()
+    nextprobe = start + interval
+    try:
+        while True:
+            now = time.time()
+            seen = False
+            for line in follower.readlines():
+                if logpattern.search(line):
+                    if verbose: print "Found in log: ", line.rstrip()
+                    seen = True
+            if seen:  #confirm now, and soon again if it isn't there yet
+                interval = probemin
+            if seen or now >= nextprobe:
+                probes += 1
+                if confirm(pdestate()):
+                    if verbose:
+                        print "Found: {0} ({1} pdestate probes)"\
+                              .format(name, probes)
+                    return probes
+                nextprobe = time.time() + interval
+                interval = min(interval * 2, probemax)
+            if now - start > waittimeout:
+                raise RuntimeError("Timed out after {0}s waiting for {1} "
+                                   "({2} pdestate probes)"
+                                   .format(waittimeout, name, probes))
+            time.sleep(logpoll)
+    finally:
+        follower.close()
+
+
+def wait_til_up():
+    """Wait for PDE/DBS up, return the number of pdestate probes"""
+    return wait_for_pdestate("Logons are enabled", rup, pde_up)
 
 
 def force_down():
@@ -216,100 +362,338 @@ def force_down():
 
 
 def wait_til_down():
-    """Wait for PDE/DBS down"""
-    #PDE state: DOWN/HARDSTOP
+    """Wait for PDE/DBS down, return the number of pdestate probes"""
+    return wait_for_pdestate("PDE state is DOWN/HARDSTOP", rdn, pde_down)
+
+
+def log_checkpoint():
+    """Return the system log's (inode, size), to read from there later"""
+    st = os.stat(log)
+    return (st.st_ino, st.st_size)
+
+
+def log_lines(checkpoint=None):
+    """Yield the system log lines written since checkpoint
+
+    With no checkpoint the whole log is read.  If the log was rotated since
+    the checkpoint (its inode changed), the rest of the old file is read
+    first, if it can still be found, then the new log from the start.
+    """
+    if checkpoint is None:
+        (inode, offset) = (os.stat(log).st_ino, 0)
+    else:
+        (inode, offset) = checkpoint
+
+    st = os.stat(log)
+    if st.st_ino != inode:
+        if debug: print "Log rotated since checkpoint:", log
+        rotated = None
+        for path in glob.glob(log + "*"):  #messages-20160616, messages.1
+            try:
+                if os.stat(path).st_ino == inode:
+                    rotated = path
+                    break
+            except OSError:
+                pass
+        if rotated:
+            with open(rotated, 'r') as f:
+                f.seek(offset)
+                for line in f:
+                    yield line
+        else:
+            print "Rotated log not found, reading {0} from the start"\
+                  .format(log)
+        offset = 0
+    elif st.st_size < offset:  #truncated in place
+        offset = 0
 
-    if verbose: print "Waiting for:  PDE state is DOWN/HARDSTOP"
-    cmd = "pdestate -a"
-    if debug: print "Executing command: ", cmd
-    while True:
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        stdout, stderr = p.communicate()
+    with open(log, 'r') as f:
+        f.seek(offset)
+        for line in f:
+            yield line
 
-        for line in stdout.splitlines():
-            mdn = rdn.match(line)   #PDE state: DOWN/HARDSTOP
-            if mdn:
-                if verbose: print "Found:  PDE state is DOWN/HARDSTOP"
-                return
 
+def line_time(line):
+    """Return the datetime a log line was written, or None"""
+    mt = rdt.match(line)  #search date/time
+    if not mt:
+        return None
+    return datetime.datetime(year, months[mt.group('Mon')], int(mt.group('dd')),
+                             int(mt.group('hour')), int(mt.group('minute')),
+                             int(mt.group('second')))
 
-def get_restart_times(kickofftime):
-    """Determine the restart times from the system log"""
+
+def get_restart_times(kickofftime, checkpoint=None, timeline=None):
+    """Determine the restart times from the system log
+
+    checkpoint is log_checkpoint() from just before the restart was kicked
+    off, so only the lines written since then are read.  The milestones
+    from the start to the end of the restart are added to timeline.
+    """
     global year  #need this since year isn't in system log
                  #alternatively just ignore the year
 
-    log = "/var/log/messages"
     if verbose: print "Kickofftime:", kickofftime
-    with open(log, 'r') as f:
-        line = f.readline()
-        while line:  # read to the time the test started
-            mt = rdt.match(line)  #search date/time
-            if mt:
-                mon =  mt.group('Mon')
-                day = mt.group('dd')
-                hour = mt.group('hour')
-                min = mt.group('minute')
-                sec = mt.group('second')
-                logtime = datetime.datetime(year, months[mon], int(day),
-                                        int(hour), int(min), int(sec))
-                if logtime >= kickofftime:
-                    if debug: print "Found kickofftime time:", line
-                    break
-            line = f.readline()
-
-        if debug: print "Look for start of test"
-        while line: # find the start of the test
+    kickedoff = False
+    starttime = None
+    endtime = None
+    for line in log_lines(checkpoint):
+        if not kickedoff:  # read to the time the test started
+            logtime = line_time(line)
+            if logtime is None or logtime < kickofftime:
+                continue
+            if debug: print "Found kickofftime time:", line
+            if debug: print "Look for start of test"
+            kickedoff = True
+
+        if starttime is None:  # find the start of the test
             if debug: print line
             mr = rr.search(line)   # warm start
             mx = rx.search(line)   # down start
             if mr or mx:
                 if debug: print "Found start of test:", line
                 if verbose: print line
-                mt = rdt.match(line)  #search date/time
-                if mt:
-                    mon =  mt.group('Mon')
-                    day = mt.group('dd')
-                    hour = mt.group('hour')
-                    min = mt.group('minute')
-                    sec = mt.group('second')
-                    starttime = datetime.datetime(year, months[mon], int(day),
-                                            int(hour), int(min), int(sec))
-                    break
-                else:
+                starttime = line_time(line)
+                if starttime is None:
                     raise RuntimeError("Couldn't find the time")
-            line = f.readline()
- 
-        if debug: print "Look for end of test"
-        while line: # find the end of the test
-            mup = rup.search(line)  
-            if mup:
+                if timeline is not None: timeline.add(line)
+                if debug: print "Look for end of test"
+        else:  # find the end of the test
+            if timeline is not None: timeline.add(line)
+            if rup.search(line):
                 if debug: print "Found end of test:", line
                 if verbose: print line
-                mt = rdt.match(line)  #search date/time
-                if mt:
-                    mon =  mt.group('Mon')
-                    day = mt.group('dd')
-                    hour = mt.group('hour')
-                    min = mt.group('minute')
-                    sec = mt.group('second')
-                    endtime = datetime.datetime(year, months[mon], int(day),
-                                            int(hour), int(min), int(sec))
-                    break
-                else:
+                endtime = line_time(line)
+                if endtime is None:
                     raise RuntimeError("Couldn't find the time")
-            line = f.readline()
+                break
+
+    if endtime is None:
+        raise RuntimeError("Couldn't find test")
 
-        if not line:
-            raise RuntimeError("Couldn't find test")
-            
-        elapsedtime = endtime - starttime
-        return(starttime, endtime, elapsedtime)
+    elapsedtime = endtime - starttime
+    return(starttime, endtime, elapsedtime)
+
+
+def restart_stats(times):
+    """Return the statistics of a list of elapsed times, in seconds
+
+    ci is the half-width of the 95% confidence interval of the mean, None
+    with fewer than 2 times.
+    """
+    secs = [seconds(t) for t in times]
+    n = len(secs)
+    mean = sum(secs) / float(n)
+    if n > 1:
+        stddev = math.sqrt(sum([(s - mean) ** 2 for s in secs]) / (n - 1))
+        if n - 1 <= len(t95):
+            t = t95[n - 2]
+        else:
+            t = 1.960
+        ci = t * stddev / math.sqrt(n)
+    else:
+        stddev = None
+        ci = None
+    return {'n': n, 'mean': mean, 'stddev': stddev, 'ci': ci,
+            'p50': percentile(secs, 50), 'p95': percentile(secs, 95),
+            'min': min(secs), 'max': max(secs)}
+
+
+def is_stable(restartclass, ci, minreps, maxreps):
+    """True when restartclass needs no more repetitions"""
+    n = len(restartclass.times)
+    if n >= maxreps:
+        return True
+    if n < minreps:
+        return False
+    return restart_stats(restartclass.times)['ci'] <= ci
+
+
+def print_restart_stats(restartclasses, ci=None, maxreps=None):
+    """Print the elapsed time statistics of each restart type"""
+    def sec(value):
+        if value is None:
+            return "-"
+        return "{0:.1f}".format(value)
+
+    print "\n{0:16}{1:>4}{2:>9}{3:>9}{4:>9}{5:>9}{6:>9}{7:>9}{8:>11}"\
+          .format("Restart", "N", "min s", "mean s", "stddev", "p50 s",
+                  "p95 s", "max s", "95% CI +/-"),
+    if ci is not None:
+        print "  Stopped",
+    print
+    for (name, restartclass) in restartclasses:
+        if not restartclass.times:
+            continue
+        st = restart_stats(restartclass.times)
+        print "{0:16}{1:>4}{2:>9}{3:>9}{4:>9}{5:>9}{6:>9}{7:>9}{8:>11}"\
+              .format(name, st['n'], sec(st['min']), sec(st['mean']),
+                      sec(st['stddev']), sec(st['p50']), sec(st['p95']),
+                      sec(st['max']), sec(st['ci'])),
+        if ci is not None:
+            if st['ci'] is not None and st['ci'] <= ci:
+                print "  CI reached",
+            elif st['n'] >= maxreps:
+                print "  max reps",
+        print
+
+
+def discover_nodes():
+    """Return the TPA nodes, control node first, as savesysteminfo finds them"""
+    savesysteminfo.outdir = os.getcwd()
+    savesysteminfo.debug = debug
+    savesysteminfo.verbose = False
+    savesysteminfo.quiet = not verbose
+    savesysteminfo.psh_hostname(copy=False)
+    savesysteminfo.psh_i_s(copy=False)
+    return [savesysteminfo.cn] + savesysteminfo.cliqreplist + \
+           savesysteminfo.nodelist
+
+
+def node_log_cmd(starttime, endtime):
+    """Return the shell command that prints a node's milestone lines logged
+    from starttime to endtime"""
+    #The window is applied on the node, comparing "MM DD HH:MM:SS" made
+    #from the syslog time (a window over New Year wraps around). If the log
+    #starts after the window does, it was rotated during the restart and
+    #<log>.1 is read first.
+    stamp = "t = sprintf(\"%02d %02d %s\", " \
+            "(index(\"JanFebMarAprMayJunJulAugSepOctNovDec\", $1) + 2) / 3, " \
+            "$2, $3)"
+    window = "-v s='{0}' -v e='{1}'".format(starttime.strftime("%m %d %H:%M:%S"),
+                                           endtime.strftime("%m %d %H:%M:%S"))
+    return ("if head -n 1 {log} | awk {window} '{{{stamp}; exit (t <= s)}}'; "
+            "then files='{log}.1 {log}'; else files={log}; fi; "
+            "grep -hE '{grep}' $files | awk {window} "
+            "'{{{stamp}; if (s <= e ? t >= s && t <= e : t >= s || t <= e) "
+            "print}}'").format(log=log, window=window, stamp=stamp,
+                               grep=nodegrep)
+
+
+def fetch_node_lines(nodes, starttime, endtime):
+    """Return {node: milestone lines from starttime to endtime} from each
+    node's system log
+
+    The nodes are read in parallel with psh.
+    """
+    cmd = node_log_cmd(starttime, endtime)
+    if debug: print "Executing command on the nodes: {0}".format(cmd)
+    nodelines = savesysteminfo.psh_lines(cmd)
+    for node in nodes:
+        if node not in nodelines:
+            print "Couldn't read the log on {0}".format(node)
+    return nodelines
+
+
+def node_timelines(nodes, starttime, endtime):
+    """Return {node: RestartTimeline} for a restart from starttime to endtime"""
+    windowend = endtime + datetime.timedelta(seconds=nodeslack)
+    timelines = {}
+    nodelines = fetch_node_lines(nodes, starttime, windowend)
+    for node in nodes:
+        if node not in nodelines:
+            continue
+        timeline = RestartTimeline(node)
+        for line in nodelines[node]:
+            entrytime = line_time(line)
+            if entrytime is None or entrytime < starttime \
+               or entrytime > windowend:
+                continue
+            timeline.add(line)
+        timelines[node] = timeline
+    return timelines
+
+
+def print_node_timelines(nodes, timelines, starttime):
+    """Print each node's milestones and the node its vprocs came up last on
+
+    Times are seconds from the restart's start on this node; node clocks
+    are assumed to be in step.
+    """
+    def offset(entrytime):
+        if entrytime is None:
+            return "-"
+        return "{0:+.0f}s".format(seconds(entrytime - starttime))
+
+    print "{0:16}{1:>9}{2:>11}{3:>12}{4:>12}{5:>9}{6:>9}"\
+          .format("Node", "Start", "PDE start", "First vproc", "Last vproc",
+                  "PDE run", "Logons")
+    critical = None
+    for node in nodes:
+        if node not in timelines:
+            print "{0:16}{1:>9}".format(node, "no log")
+            continue
+        timeline = timelines[node]
+        bounds = timeline.bounds
+        lastvproc = timeline.last("vproc")
+        print "{0:16}{1:>9}{2:>11}{3:>12}{4:>12}{5:>9}{6:>9}"\
+              .format(node, offset(bounds[0]), offset(bounds[1]),
+                      offset(bounds[2]), offset(lastvproc), offset(bounds[3]),
+                      offset(bounds[4]))
+        ready = lastvproc or bounds[3]
+        if ready is not None and (critical is None or ready > critical[1]):
+            critical = (node, ready)
+    if critical:
+        print "Critical path node: {0} (vprocs up at {1})"\
+              .format(critical[0], offset(critical[1]))
+
+
+def journal_write(journalname, record):
+    """Append a record to the campaign journal and flush it to disk"""
+    with open(journalname, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_journal(journalname):
+    """Return the plan and results of the last campaign in a journal"""
+    plan = None
+    results = []
+    with open(journalname, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:  #partly written when the harness died
+                continue
+            if record['record'] == 'plan':  #a new campaign
+                plan = record
+                results = []
+            elif record['record'] == 'result':
+                results.append(record)
+    return (plan, results)
+
+
+def run_test(t, journalname, nodes=None):
+    """Run one restart test, print its times and journal them
+
+    With a list of nodes, also print each node's milestones for the restart.
+    """
+    print "Test {0} - {1}:".format(t.testid, t.name)
+    (starttime, endtime, elapsedtime) =  t.do_restart()
+    journal_write(journalname,
+                  {'record': 'result', 'test': t.testid,
+                   'type': t.__class__.__name__, 'start': str(starttime),
+                   'end': str(endtime), 'et': seconds(elapsedtime),
+                   'probes': t.probes})
+    print "Start: {0}, End: {1}, ET: {2}, pdestate probes: {3}"\
+          .format(starttime, endtime, elapsedtime, t.probes)
+    print_phase_header()
+    print_phases(t.timeline)
+    if verbose: t.timeline.print_milestones()
+    if nodes:
+        print
+        print_node_timelines(nodes, node_timelines(nodes, starttime, endtime),
+                             starttime)
+    print
 
 
 ############################################################################
 def main():
     global debug
     global verbose
+    global waittimeout
+    global probemax
 
     usage="%prog [-h] [-d] [-v] [-t] [-n] [-w] [-f] [-x] [-c]"
     parser = OptionParser(usage, version="%prog 0.7")
@@ -335,6 +719,33 @@ def main():
     parser.add_option("-c", "--coldrestart", 
                       action="count", dest="addedcolds", default=0,
                       help="add a cold restart")
+    parser.add_option("--timeout", type="int", dest="timeout",
+                      default=waittimeout,
+                      help="seconds to wait for a restart, default=%default")
+    parser.add_option("--maxprobe", type="int", dest="maxprobe",
+                      default=probemax,
+                      help="longest interval between pdestate probes in "
+                           "seconds, default=%default")
+    parser.add_option("--ci", type="float", dest="ci",
+                      help="repeat each restart type until the 95% "
+                           "confidence interval of its mean is within "
+                           "+/- this many seconds (-n is ignored)")
+    parser.add_option("--minreps", type="int", dest="minreps", default=3,
+                      help="fewest repetitions with --ci, default=%default")
+    parser.add_option("--maxreps", type="int", dest="maxreps", default=10,
+                      help="most repetitions with --ci, default=%default")
+    parser.add_option("--journal", dest="journalname",
+                      default="dmandrrestart.journal",
+                      help="append the campaign plan and each result to "
+                           "this file, default=%default")
+    parser.add_option("--resume", action="store_true", dest="resume",
+                      default=False,
+                      help="resume the last campaign in the journal, "
+                           "skipping its completed tests")
+    parser.add_option("--nodes", action="store_true", dest="nodes",
+                      default=False,
+                      help="after each restart, show the milestones in "
+                           "every node's system log")
     (options, args) = parser.parse_args()
 
     debug = options.debug
@@ -345,6 +756,12 @@ def main():
     addedforces = options.addedforces
     addeddowns = options.addeddowns
     addedcolds = options.addedcolds
+    waittimeout = options.timeout
+    probemax = max(options.maxprobe, probemin)
+    ci = options.ci
+    minreps = max(options.minreps, 2)
+    maxreps = max(options.maxreps, minreps)
+    journalname = options.journalname
 
     if verbose: 
         print "Restart Test"
@@ -352,42 +769,83 @@ def main():
               .format(localtime.strftime("%Y-%m-%d %H:%M:%S"))
 
 
-    #Make a list of tests to run
-    testlist = []
-
-    for n in range (0,testreps):
-        if test == 0:
-            pass
-        elif test == 1:
-            testlist.append(Warmrestart())
-            testlist.append(Downrestart())
-            testlist.append(Forcerestart())
-        elif test == 2:
-            testlist.append(Warmrestart())
-            testlist.append(Downrestart())
-        else:
-            print "No test", test
-
-        if addedwarms > 0:
-            for m in range (0,addedwarms):
-                testlist.append(Warmrestart())
-        if addedforces > 0:
-            for m in range (0,addedforces):
-                testlist.append(Forcerestart())
-        if addeddowns > 0:
-            for m in range (0,addeddowns):
-                testlist.append(Downrestart())
-        if addedcolds > 0:
-            for m in range (0,addedcolds):
-                testlist.append(Coldrestart())
-
+    #Make a list of the tests in one repetition
+    replist = []
+    if test == 0:
+        pass
+    elif test == 1:
+        replist.extend([Warmrestart, Downrestart, Forcerestart])
+    elif test == 2:
+        replist.extend([Warmrestart, Downrestart])
+    else:
+        print "No test", test
+    replist.extend([Warmrestart] * addedwarms)
+    replist.extend([Forcerestart] * addedforces)
+    replist.extend([Downrestart] * addeddowns)
+    replist.extend([Coldrestart] * addedcolds)
+
+    #Start a new campaign in the journal, or pick up the last one
+    restartclasses = {}
+    for restartclass in [Warmrestart, Forcerestart, Coldrestart, Downrestart]:
+        restartclasses[restartclass.__name__] = restartclass
+    results = []
+    if options.resume:
+        if not os.path.exists(journalname):
+            parser.error("No journal to resume: " + journalname)
+        (plan, results) = read_journal(journalname)
+        if plan is None:
+            parser.error("No campaign to resume in " + journalname)
+        replist = [restartclasses[name] for name in plan['tests']]
+        testreps = plan['testreps']
+        ci = plan['ci']
+        minreps = plan['minreps']
+        maxreps = plan['maxreps']
+        for r in results:  #rebuild the aggregates
+            restartclass = restartclasses[r['type']]
+            elapsedtime = datetime.timedelta(seconds=r['et'])
+            restartclass.count += 1
+            restartclass.total_et += elapsedtime
+            restartclass.times.append(elapsedtime)
+            Restart.testid = max(Restart.testid, r['test'])
+        print "Resuming the campaign started {0}: {1} tests done\n"\
+              .format(plan['started'], len(results))
+    else:
+        journal_write(journalname,
+                      {'record': 'plan',
+                       'started': localtime.strftime("%Y-%m-%d %H:%M:%S"),
+                       'tests': [r.__name__ for r in replist],
+                       'testreps': testreps, 'ci': ci,
+                       'minreps': minreps, 'maxreps': maxreps})
+
+
+    nodes = None
+    if options.nodes:
+        nodes = discover_nodes()
+        print "Nodes:", " ".join(nodes)
 
     #Run the tests
-    for t in testlist:
-        print "Test {0} - {1}:".format(t.testid, t.name)
-        (starttime, endtime, elapsedtime) =  t.do_restart()
-        print "Start: {0}, End: {1}, ET: {2}\n"\
-              .format(starttime, endtime, elapsedtime)
+    testlist = []
+    if ci is None:
+        sequence = []
+        for n in range (0,testreps):
+            sequence.extend(replist)
+        for restartclass in sequence[len(results):]:  #skip the completed
+            testlist.append(restartclass())
+        for t in testlist:
+            run_test(t, journalname, nodes)
+    else:
+        #Repeat until each restart type's CI is narrow enough
+        while True:
+            pending = [r for r in replist
+                       if not is_stable(r, ci, minreps, maxreps)]
+            if not pending:
+                break
+            for restartclass in replist:
+                if is_stable(restartclass, ci, minreps, maxreps):
+                    continue  # skip types that are already stable
+                t = restartclass()
+                testlist.append(t)
+                run_test(t, journalname, nodes)
 
 
     #Print stats
@@ -412,6 +870,13 @@ def main():
         print "Down restart average of {0} tests: {1}"\
               .format(downcount, str(Downrestart.total_et/downcount).split(".")[0])
 
+    print_restart_stats([("Warm restart", Warmrestart),
+                         ("Force restart", Forcerestart),
+                         ("Cold restart", Coldrestart),
+                         ("Down restart", Downrestart)], ci, maxreps)
+
+    print_phase_averages([t.timeline for t in testlist])
+
     print "\nDone"
 
 
@@ -13,16 +13,44 @@ import time
 import datetime
 import sys
 import re
+import os
+import select
+import threading
+import random
 import collections
+import array
+import heapq
+import bisect
+import calendar
+import math
+import json
+import types
 from subprocess import Popen, PIPE, STDOUT
 from optparse import OptionParser
 
 ################################################################################
+#one per disk (location is its enclosure.slot); times are local seconds,
+#errors +/- seconds
 reconstructcopyback_et = collections.namedtuple('reconstructcopyback_et', 
-                                             'vdisk reconstruct_et copyback_et')
+                                             'vdisk location reconstruct_et '
+                                             'copyback_et reconstruct_err '
+                                             'copyback_err')
+#one per vdisk of a scrub or verify test: job (VRSC or VRFY), vdisk size,
+#local seconds +/- error and MB/s of vdisk capacity
+vdiskjob_et = collections.namedtuple('vdiskjob_et',
+                                     'vdisk job size et err mbs')
+#one per run of a priority sweep: the job priority, test name, its
+#reconstructcopyback_et (or vdiskjob_et) list, mean rebuild MB/s (disk
+#capacity per reconstruct second, or the scrub/verify MB/s), host port
+#MB/s and highest controller CPU % (means over the run, None if not
+#sampled)
+sweeprun = collections.namedtuple('sweeprun', 'array priority test results '
+                                  'rebuildmbs hostmbs cpu')
 
 debug = 0
 verbose = False
+rshfa = 'rshfa'   # command to reach the array CLI (dothillsim.py to simulate)
+smcli = 'SMcli'   # NetApp E-Series command line (dothillsim.py to simulate)
 
 ################################################################################
 class disk:
@@ -30,11 +58,1974 @@ class disk:
         self.enclosure = enclosure
         self.slot = slot
         self.vdisk = vdisk
+        self.times = {}   # array time of each DiskTest step, e.g. 'down'
+        self.errors = {}  # seconds since the poll before, for polled times
 
     @property
     def location(self):
         return str(self.enclosure) + '.' + str(self.slot)
 
+################################################################################
+class SessionError(RuntimeError):
+    """A controller CLI session died or did not answer in time"""
+    pass
+
+
+################################################################################
+#Coroutines
+#  A coroutine is a generator that yields what it is waiting for: a Future,
+#  another coroutine, or a list of them (run at the same time, resumes with
+#  the list of results). It gets the result (or the exception) back from
+#  the yield, and gives its own result with raise Return(value) since
+#  python 2 generators can't return a value. E.g.
+#
+#      def get_job_pct_async(self, vdisk):
+#          snapshot = yield self.get_vdisk_snapshot_async()
+#          raise Return(snapshot.vdisks[vdisk])
+#
+#  One EventLoop per thread runs them, waiting with select on all the CLI
+#  sessions at once, so one process can watch many vdisks on many arrays.
+#  (No asyncio in python 2; this is the same idea in a few classes.)
+class Return(Exception):
+    """raise Return(value) gives value as the result of a coroutine"""
+    def __init__(self, value=None):
+        Exception.__init__(self)
+        self.value = value
+
+
+class Future:
+    """Result of something that finishes later in the EventLoop.
+    """
+    def __init__(self):
+        self.done = False
+        self.value = None
+        self.exc_info = None    # sys.exc_info() if it failed
+        self.callbacks = []
+
+    def add_done_callback(self, fn):
+        if self.done:
+            fn(self)
+        else:
+            self.callbacks.append(fn)
+
+    def set_result(self, value):
+        self.finish(value, None)
+
+    def set_exception(self, exc_info):
+        self.finish(None, exc_info)
+
+    def finish(self, value, exc_info):
+        if self.done:
+            return
+        self.done = True
+        self.value = value
+        self.exc_info = exc_info
+        callbacks, self.callbacks = self.callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+    def result(self):
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+###End of Class Future###
+
+
+class Task(Future):
+    """Runs a coroutine in the EventLoop; finishes with its result.
+    """
+    def __init__(self, loop, coroutine):
+        Future.__init__(self)
+        self.loop = loop
+        self.coroutine = coroutine
+        loop.schedule(self.step, None, None)
+
+    def step(self, value, exc_info):
+        try:
+            if exc_info:
+                waitfor = self.coroutine.throw(*exc_info)
+            else:
+                waitfor = self.coroutine.send(value)
+        except Return as r:
+            self.set_result(r.value)
+            return
+        except StopIteration:
+            self.set_result(None)
+            return
+        except Exception:
+            self.set_exception(sys.exc_info())
+            return
+        self.loop.future(waitfor).add_done_callback(self.wakeup)
+
+    def wakeup(self, future):
+        #resume from the loop, not from inside whatever finished the future
+        self.loop.schedule(self.step, future.value, future.exc_info)
+###End of Class Task###
+
+
+class AsyncLimit:
+    """Counting semaphore for coroutines: yield acquire(), then release().
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiters = collections.deque()
+
+    def acquire(self):
+        future = Future()
+        if self.active < self.limit:
+            self.active += 1
+            future.set_result(None)
+        else:
+            self.waiters.append(future)
+        return future
+
+    def release(self):
+        if self.waiters:
+            self.waiters.popleft().set_result(None)  # the slot passes on
+        else:
+            self.active -= 1
+###End of Class AsyncLimit###
+
+
+################################################################################
+class AsyncCLISession:
+    """Controller CLI session for the EventLoop: each command is written to
+    the session and its reply collected as output arrives.
+    """
+    #rshfa without a command leaves us at the controller CLI prompt. Every
+    #CLI command ends with a "Success:" or "Error:" trailer that finishes
+    #with the array time, e.g.
+    #Success: Command completed successfully. (0.0) - Disk 0.0 was placed
+    #in a down state. (2016-06-01 19:08:12)
+    #so the trailer can wrap onto the next line. Some replies have no
+    #trailer, e.g. clear disk-metadata:
+    #Info: Updating disk list...
+    #Info: Disk disk_00.00 metadata was cleared. (2016-06-01 21:32:46)
+    #so a reply also ends at the next "# " prompt. The first prompt after
+    #connecting only ends the login banner.
+    #Commands on one session are queued and sent one at a time. With
+    #oneshot every command gets its own rshfa (a shell, an rsh login and a
+    #CLI login, the original behavior) and its reply ends at end of file.
+    timeout = 300            # seconds to wait for a command's trailer
+    setupcmds = ['set cli-parameters pager off']
+    transportclass = None    # blocking transport to use instead, e.g.
+                             # dothillsim.SimTransport (see BlockingSession)
+
+    rtrailer = re.compile('(Success|Error):')
+    rtrailerend = re.compile('\(\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d\)\s*$')
+    rprompt = re.compile('#\s*$')
+
+    def __init__(self, name, controller, oneshot=False):
+        self.name = name
+        self.controller = controller
+        self.oneshot = oneshot
+        self.p = None
+        self.buf = ''
+        self.lines = []
+        self.intrailer = False
+        self.greeting = False              # no prompt seen since connecting
+        self.queue = collections.deque()   # (rawcmd, Future or None)
+        self.current = None                # Future of the command running
+        self.setup = False                 # current is a setup command
+        self.deadline = None
+        self.connects = 0
+
+    def target(self):
+        return self.name + str(self.controller)
+
+    def send(self, rawcmd):
+        """Return a Future for the output of rawcmd"""
+        future = Future()
+        self.queue.append((rawcmd, future))
+        if self.current is None:
+            self.next()
+        return future
+
+    def alive(self):
+        return self.p is not None and self.p.poll() is None
+
+    def connect(self):
+        cmd = rshfa + ' -V dh ' + self.target()
+        if debug >= 1: print "Opening CLI session: " + cmd
+        self.p = Popen(cmd, shell=True, stdin=PIPE, stdout=PIPE,
+                       stderr=STDOUT, bufsize=0, close_fds=True)
+        self.buf = ''
+        self.connects += 1
+        self.greeting = True
+        #setup commands go first, nobody waits for their output
+        for setupcmd in reversed(self.setupcmds):
+            self.queue.appendleft((setupcmd, None))
+
+    def next(self):
+        """Start the next queued command"""
+        while self.queue and self.current is None:
+            if not self.oneshot and not self.alive():
+                self.connect()
+            rawcmd, future = self.queue.popleft()
+            if debug >= 2: print "session cmd = " + rawcmd
+            try:
+                if self.oneshot:
+                    self.p = Popen(self.oneshotcmd(rawcmd), shell=True,
+                                   stdout=PIPE, stderr=STDOUT, close_fds=True)
+                    self.buf = ''
+                else:
+                    self.p.stdin.write(rawcmd + '\n')
+                    self.p.stdin.flush()
+            except (IOError, OSError) as e:
+                self.close()
+                self.failone(future, "CLI session write failed: %s" % e)
+                continue
+            self.current = future or Future()
+            self.setup = future is None
+            self.deadline = monotonic() + self.timeout
+            self.lines = []
+            self.intrailer = False
+
+    def oneshotcmd(self, rawcmd):
+        return rshfa + ' -V dh ' + self.target() + ' ' + rawcmd
+
+    def complete(self, output):
+        """True if output (to end of file) is a whole reply"""
+        return self.rtrailerend.search(output)
+
+    def fileno(self):
+        """File descriptor to select on, None when no command is running"""
+        if self.current is None or self.p is None:
+            return None
+        return self.p.stdout.fileno()
+
+    def readable(self):
+        data = os.read(self.p.stdout.fileno(), 4096)
+        if not data:
+            if self.oneshot:
+                self.p.wait()
+                output = self.buf
+                if not self.complete(output):
+                    self.fail("No reply from " + self.target() + ": "
+                              + output.strip()[:200])
+                else:
+                    self.finish(output)
+            else:
+                self.fail("CLI session to " + self.target() + " closed")
+            return
+        self.buf += data
+        if self.oneshot:
+            return
+        while '\n' in self.buf and self.current is not None:
+            line, self.buf = self.buf.split('\n', 1)
+            line = line.rstrip('\r')
+            if not self.lines and line.startswith('# '):
+                line = line[2:]    # the prompt the reply follows
+            self.lines.append(line)
+            if not self.intrailer \
+                    and self.rtrailer.match(line.lstrip('# ')):
+                self.intrailer = True
+            if self.intrailer and self.rtrailerend.search(line):
+                self.greeting = False
+                self.finish('\n'.join(self.lines) + '\n')
+        if self.current is not None and self.rprompt.match(self.buf):
+            if self.greeting:      # the prompt after the login banner
+                self.greeting = False
+                self.lines = []
+            self.buf = ''
+            if self.lines:         # a reply with no Success:/Error: trailer
+                self.finish('\n'.join(self.lines) + '\n')
+
+    def check(self, now):
+        if self.current is not None and now > self.deadline:
+            self.fail("Timed out waiting for " + self.target())
+
+    def finish(self, output):
+        future, self.current = self.current, None
+        if self.oneshot:
+            self.p = None
+        future.set_result(output)
+        self.next()
+
+    def fail(self, message):
+        future, self.current = self.current, None
+        self.close()
+        if self.setup:
+            future = None
+        self.failone(future, message)
+        self.next()
+
+    def failone(self, future, message):
+        """Fail future, or if it's a setup command (None) the command the
+        session was opened for, so a dead session isn't reopened forever"""
+        while future is None and self.queue:
+            rawcmd, future = self.queue.popleft()
+        if future is not None:
+            future.set_exception((SessionError, SessionError(message), None))
+
+    def close(self):
+        if self.p is not None:
+            try:
+                if self.p.poll() is None:
+                    if not self.oneshot:
+                        self.p.stdin.write('exit\n')
+                        self.p.stdin.close()
+                    self.p.terminate()
+                self.p.wait()
+            except (IOError, OSError):
+                pass
+        self.p = None
+        self.buf = ''
+###End of Class AsyncCLISession###
+
+
+class AsyncSMcliSession(AsyncCLISession):
+    """Run SMcli scripts on a NetApp E-Series array in the EventLoop.
+    """
+    #SMcli has no interactive session: each script (one or more commands
+    #separated by ;) is its own SMcli process, given both controllers
+    #(<array>1 and <array>2) so SMcli picks one that answers. The reply
+    #ends with "SMcli completed successfully." or "SMcli failed.", e.g.
+    #    Executing script...
+    #    ...
+    #    Script execution complete.
+    #
+    #    SMcli completed successfully.
+    timeout = 600     # seconds; saving the event log can be slow
+    rcompleted = re.compile('SMcli completed successfully\.')
+
+    def __init__(self, name, controller=None):
+        AsyncCLISession.__init__(self, name, controller, oneshot=True)
+
+    def target(self):
+        return self.name + '1 ' + self.name + '2'
+
+    def oneshotcmd(self, script):
+        return "{0} {1} -c '{2}'".format(smcli, self.target(),
+                                         script.replace("'", "'\\''"))
+
+    def complete(self, output):
+        return self.rcompleted.search(output)
+###End of Class AsyncSMcliSession###
+
+
+class BlockingSession:
+    """Run a blocking transport (AsyncCLISession.transportclass) in the
+    EventLoop.
+    """
+    #For transports with no file descriptor to wait on, e.g. the in-process
+    #simulator in dothillsim.py. The command runs when it is sent.
+    def __init__(self, transport):
+        self.transport = transport
+
+    def send(self, rawcmd):
+        future = Future()
+        try:
+            future.set_result(self.transport.send(rawcmd))
+        except SessionError:
+            future.set_exception(sys.exc_info())
+        return future
+
+    def fileno(self):
+        return None
+
+    def readable(self):
+        pass
+
+    def check(self, now):
+        pass
+
+    def close(self):
+        self.transport.close()
+###End of Class BlockingSession###
+
+
+################################################################################
+class EventLoop:
+    """Run coroutines, sleeping in select until a timer or CLI output is due.
+    """
+    local = threading.local()
+
+    @classmethod
+    def current(cls):
+        """Return this thread's EventLoop"""
+        loop = getattr(cls.local, 'loop', None)
+        if loop is None:
+            loop = cls.local.loop = cls()
+        return loop
+
+    def __init__(self):
+        self.ready = collections.deque()   # (fn, args) to call now
+        self.timers = []                   # heap of (monotonic(), seq, fn, args)
+        self.seq = 0
+        self.sessions = {}   # (name, controller, oneshot, sessionclass) -> session
+        self.running = False
+
+    def schedule(self, fn, *args):
+        self.ready.append((fn, args))
+
+    def call_later(self, seconds, fn, *args):
+        self.seq += 1
+        heapq.heappush(self.timers, (monotonic() + seconds, self.seq, fn, args))
+
+    def sleep(self, seconds):
+        """Return a Future that finishes after seconds"""
+        future = Future()
+        self.call_later(seconds, future.set_result, None)
+        return future
+
+    def future(self, waitfor):
+        """Return a Future for what a coroutine yielded"""
+        if isinstance(waitfor, Future):
+            return waitfor
+        if isinstance(waitfor, types.GeneratorType):
+            return Task(self, waitfor)
+        if isinstance(waitfor, (list, tuple)):
+            return self.gather(waitfor)
+        raise TypeError("coroutine yielded %r" % (waitfor,))
+
+    def gather(self, waitfors):
+        """Return a Future for the list of results of waitfors"""
+        futures = [self.future(w) for w in waitfors]
+        result = Future()
+        remaining = [len(futures)]
+        def done(f):
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                for f in futures:
+                    if f.exc_info:
+                        result.set_exception(f.exc_info)
+                        return
+                result.set_result([f.value for f in futures])
+        if not futures:
+            result.set_result([])
+        for f in futures:
+            f.add_done_callback(done)
+        return result
+
+    def session(self, name, controller, oneshot=False, sessionclass=None):
+        key = (name, controller, oneshot, sessionclass)
+        if key not in self.sessions:
+            if sessionclass is not None:
+                self.sessions[key] = sessionclass(name, controller)
+            elif AsyncCLISession.transportclass is None:
+                self.sessions[key] = AsyncCLISession(name, controller, oneshot)
+            else:
+                self.sessions[key] = BlockingSession(
+                    AsyncCLISession.transportclass(name, controller))
+        return self.sessions[key]
+
+    def run(self, waitfor):
+        """Run until waitfor (a coroutine, Future or list) finishes, return
+        its result"""
+        if self.running:
+            raise RuntimeError("EventLoop.run inside a coroutine, "
+                               "yield the coroutine instead")
+        future = self.future(waitfor)
+        self.running = True
+        try:
+            while True:
+                while self.ready:
+                    fn, args = self.ready.popleft()
+                    fn(*args)
+                if future.done:
+                    break
+                self.wait()
+        finally:
+            self.running = False
+        return future.result()
+
+    def wait(self):
+        """Wait for the next timer or CLI output, schedule what is due"""
+        fds = {}
+        for session in self.sessions.values():
+            fd = session.fileno()
+            if fd is not None:
+                fds[fd] = session
+        now = monotonic()
+        timeout = None
+        if self.timers:
+            timeout = max(0, self.timers[0][0] - now)
+        for session in fds.values():
+            left = max(0, session.deadline - now)
+            if timeout is None or left < timeout:
+                timeout = left
+        if timeout is None:
+            raise RuntimeError("EventLoop: nothing left to wait for")
+        if fds:
+            readable, w, x = select.select(fds.keys(), [], [], timeout)
+            for fd in readable:
+                fds[fd].readable()
+        elif timeout > 0:
+            time.sleep(timeout)
+        now = monotonic()
+        for session in self.sessions.values():
+            session.check(now)
+        while self.timers and self.timers[0][0] <= now:
+            when, seq, fn, args = heapq.heappop(self.timers)
+            self.schedule(fn, *args)
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+###End of Class EventLoop###
+
+
+def run_coroutine(waitfor):
+    """Run a coroutine (or list of them) to the end in this thread's
+    EventLoop, return its result"""
+    return EventLoop.current().run(waitfor)
+
+
+def sleep_async(seconds):
+    """time.sleep for coroutines: yield sleep_async(seconds)"""
+    return EventLoop.current().sleep(seconds)
+
+
+################################################################################
+class CLITable:
+    """Rows of a fixed width CLI table (show vdisks, show disks).
+    """
+    #The fields are cut out at the column positions of the header line:
+    #each wanted column runs from its heading to the next heading after
+    #it. Headings may be several words (How Used); those we don't want
+    #(Serial Number, Health Reason, ...) only matter as column ends.
+    #The rows are between the first two rules of dashes.
+    rheading = re.compile('\S+')
+    rrule = re.compile('-{10,}')
+    rtrailer = re.compile('(Success|Error|Info):')
+
+    @classmethod
+    def getcolumns(cls, header, columns, optional=()):
+        """Return {heading: (start, end)} for the wanted columns (and those
+        of the optional columns the header has)"""
+        starts = [m.start() for m in cls.rheading.finditer(header)]
+        spans = {}
+        for name in list(columns) + list(optional):
+            m = re.search('(^|\s)' + re.escape(name) + '(\s|$)', header)
+            if not m and name in optional:
+                continue
+            if not m:
+                raise RuntimeError("No " + name + " column in: "
+                                   + header.strip()[:80])
+            start = m.start() if m.group(1) == '' else m.start() + 1
+            later = [s for s in starts if s >= start + len(name)]
+            if later:
+                spans[name] = (start, later[0])
+            else:
+                spans[name] = (start, None)
+        return spans
+
+    @classmethod
+    def parse(cls, output, columns, optional=()):
+        """Return a list of {heading: value} for the rows of the table whose
+        header starts with columns[0]. Optional columns (not in every
+        firmware) missing from the header are left out of the rows."""
+        rows = []
+        spans = None
+        inrows = False
+        for line in output.splitlines():
+            if debug >= 2: print line
+            if spans is None:
+                if line.startswith(columns[0] + ' '):
+                    spans = cls.getcolumns(line, columns, optional)
+                continue
+            if cls.rrule.match(line):
+                if inrows:
+                    break
+                inrows = True
+                continue
+            if not inrows or line.strip() == '' or cls.rtrailer.match(line):
+                continue
+            fields = {}
+            for name, (start, end) in spans.items():
+                fields[name] = line[start:end].strip()
+            rows.append(fields)
+        if spans is None:
+            raise RuntimeError("Couldn't find the " + columns[0]
+                               + " header line")
+        return rows
+###End of Class CLITable###
+
+
+################################################################################
+vdiskstatus = collections.namedtuple('vdiskstatus',
+                                     'name size raid status job pct health')
+
+class VdiskSnapshot:
+    """Status of every vdisk from a single "show vdisks".
+    """
+    #Name  Size    Free Own Pref   RAID   Disks Spr Chk  Status Jobs      Job%      Serial Number ...
+    #  Health Recommendation
+    #---------------------------------------------------------------------- ...
+    #vd01  899.2GB 0B   A   A      RAID1  2     0   N/A  FTOL   VRSC      35%       00c0ff1bce3c0000 ...
+    #vd02  899.2GB 0B   A   A      RAID1  2     0   N/A  FTOL                       00c0ff1bce3c0000 ...
+    #---------------------------------------------------------------------- ...
+    #Success: Command completed successfully. (2016-06-01 21:30:01)
+    columns = ['Name', 'Size', 'RAID', 'Status', 'Jobs', 'Job%', 'Health']
+
+    def __init__(self, output, eventtime):
+        self.vdisks = self.parse(output)
+        self.eventtime = eventtime     # array time from the Success: line
+        self.fetchtime = time.time()   # local time of the fetch (for the TTL)
+
+    @classmethod
+    def parse(cls, output):
+        """Return {vdisk name: vdiskstatus} from show vdisks output"""
+        vdisks = {}
+        for fields in CLITable.parse(output, cls.columns):
+            job = fields['Jobs']
+            if job == '':  # Job completed
+                job = "Blank"
+                pct = 100
+            else:
+                pct = int(fields['Job%'].rstrip('%') or 0)
+            vdisks[fields['Name']] = vdiskstatus(fields['Name'],
+                                                 fields['Size'],
+                                                 fields['RAID'],
+                                                 fields['Status'], job, pct,
+                                                 fields['Health'])
+        return vdisks
+
+    def age(self):
+        return time.time() - self.fetchtime
+###End of Class VdiskSnapshot###
+
+
+################################################################################
+class DiskTest:
+    """One disk's progress through the drive down/copyback test.
+    """
+    #Each disk steps through its own states so it can move on as soon as
+    #its vdisk's job finishes, independent of the other disks:
+    #  ready -> down -> RCON -> clear-metadata -> CPYBK -> done
+    #A second disk of the same vdisk (RAID6 double failure) follows a
+    #leader: it's downed delay array seconds after the leader's disk,
+    #while the vdisk is reconstructing, instead of waiting for it to be
+    #ready. Its polled job times are the vdisk's (the jobs overlap), so
+    #the event log times per enclosure.slot are the ones to use.
+    WAITREADY = 'wait for ready'
+    WAITRCON = 'wait for RCON start'
+    RCON = 'RCON'
+    WAITCPYBK = 'wait for CPYBK start'
+    CPYBK = 'CPYBK'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    busyjobs = ["INIT", "RCON", "CPYBK", "EXPD"]
+    starttimeout = 3600.0   # array seconds for RCON/CPYBK to show up
+
+    def __init__(self, disk, leader=None, delay=0):
+        self.disk = disk
+        self.leader = leader     # DiskTest downed first on the same vdisk
+        self.delay = delay       # array seconds after the leader's down
+        self.state = self.WAITREADY
+        self.job = None
+        self.initialpct = None
+        self.initialtime = None
+        self.eventtime = None
+        self.estcompletion = None
+
+    @property
+    def finished(self):
+        return self.state in (self.DONE, self.FAILED)
+
+    @property
+    def starting(self):
+        """True while waiting for a job to show up (poll more often)"""
+        return self.state in (self.WAITRCON, self.WAITCPYBK)
+
+    @property
+    def wait(self):
+        """(starting, estcompletion, eventtime) for PollScheduler"""
+        if self.leader is not None and self.state == self.WAITREADY:
+            leaderdown = self.leader.disk.times.get('down')
+            if leaderdown is None:
+                return (True, None, self.eventtime)
+            return (False, leaderdown + datetime.timedelta(seconds=self.delay),
+                    self.eventtime)
+        return (self.starting, self.estcompletion, self.eventtime)
+
+    def step(self, array, snapshot):
+        """Coroutine: advance using the vdisk status in snapshot. Returns
+        True if the state changed."""
+        disk = self.disk
+        vdisk = disk.vdisk
+        if vdisk not in snapshot.vdisks:
+            raise RuntimeError("vdisk " + vdisk + " not found")
+        status = snapshot.vdisks[vdisk]
+        job = status.job; pct = status.pct; eventtime = snapshot.eventtime
+        oldstate = self.state
+        if job != self.job:  # rate is measured from the start of each job
+            self.job = job
+            self.initialpct = pct; self.initialtime = eventtime
+        lasttime = self.eventtime
+        self.eventtime = eventtime
+        self.estcompletion = estimate_completion(pct, eventtime,
+                                                 self.initialpct,
+                                                 self.initialtime)
+
+        if self.state == self.WAITREADY:
+            if self.leader is not None:
+                leaderdown = self.leader.disk.times.get('down')
+                if self.leader.state == self.FAILED:
+                    print 'Not downing {0} {1}, {2} was not downed'\
+                          .format(disk.location, vdisk,
+                                  self.leader.disk.location)
+                    self.state = self.FAILED
+                ready = (leaderdown is not None and
+                         seconds(eventtime - leaderdown) >= self.delay)
+            else:
+                ready = job not in self.busyjobs
+            if ready and self.state == self.WAITREADY:
+                disk.times['ready'] = eventtime
+                print 'Down disk {0} {1}'.format(disk.location, vdisk)
+                try:
+                    yield array.down_disk_async(disk)
+                except RuntimeError as e:
+                    print '%s\n' % e
+                    self.state = self.FAILED
+                else:
+                    print "success"
+                    disk.times['down'] = eventtime
+                    self.state = self.WAITRCON
+        elif self.state == self.WAITRCON:
+            if job == "RCON":
+                self.mark('rconstart', eventtime, lasttime)
+                self.state = self.RCON
+            else:
+                self.check_start('down', 'Reconstruction', eventtime)
+        elif self.state == self.RCON:
+            if job != "RCON":
+                self.mark('rconend', eventtime, lasttime)
+                print 'Reconstruction complete {0} {1}'\
+                      .format(disk.location, vdisk)
+                print 'Clear disk_metadata {0} {1}'.format(disk.location, vdisk)
+                try:
+                    yield array.clear_disk_async(disk)
+                except RuntimeError as e:
+                    print '%s\n' % e
+                else:
+                    print "success"
+                disk.times['clear'] = eventtime
+                self.state = self.WAITCPYBK
+        elif self.state == self.WAITCPYBK:
+            if job == "CPYBK":
+                self.mark('cpybkstart', eventtime, lasttime)
+                self.state = self.CPYBK
+            else:
+                self.check_start('clear', 'Copyback', eventtime)
+        elif self.state == self.CPYBK:
+            if job != "CPYBK":
+                self.mark('cpybkend', eventtime, lasttime)
+                print 'Copyback complete {0} {1}'.format(disk.location, vdisk)
+                self.state = self.DONE
+
+        if verbose and self.state in (self.RCON, self.CPYBK):
+            print_progress(vdisk, job, pct, eventtime,
+                           self.initialpct, self.initialtime, array.clock)
+        if debug >= 1 and self.state != oldstate:
+            print '{0} {1}: {2} -> {3}'\
+                  .format(disk.location, vdisk, oldstate, self.state)
+        raise Return(self.state != oldstate)
+
+    def check_start(self, key, jobname, eventtime):
+        """Fail the disk if its job hasn't started starttimeout array
+        seconds after disk.times[key]"""
+        waited = seconds(eventtime - self.disk.times[key])
+        if waited >= self.starttimeout:
+            after = {'down': 'the disk down',
+                     'clear': 'clearing its metadata'}[key]
+            print 'Error: {0} of {1} {2} did not start within {3:.0f}s of '\
+                  '{4}'.format(jobname, self.disk.location, self.disk.vdisk,
+                               self.starttimeout, after)
+            self.state = self.FAILED
+
+    def mark(self, key, eventtime, lasttime):
+        """Record a job start/end first seen at eventtime; it happened after
+        the poll before (lasttime)"""
+        self.disk.times[key] = eventtime
+        if lasttime:
+            self.disk.errors[key] = seconds(eventtime - lasttime)
+###End of Class DiskTest###
+
+
+def estimate_completion(pct, eventtime, initialpct, initialtime):
+    """Return the estimated completion time of a job, None if unknown"""
+    #Note estcompletion will be off if a new job starts (not likely)
+    if initialpct is None or pct <= initialpct or pct >= 100:
+        return None
+    return eventtime \
+        + (100-pct)*(eventtime - initialtime)/(pct - initialpct)
+
+
+def print_progress(vdisk, job, pct, eventtime, initialpct, initialtime,
+                   clock=None):
+    """Print job progress with an estimated completion time (array times,
+    shown as local time if there's an ArrayClock)"""
+    estcompletion = estimate_completion(pct, eventtime, initialpct, initialtime)
+    if clock is not None:
+        eventtime = clock.to_local(eventtime).replace(microsecond=0)
+        if estcompletion is not None:
+            estcompletion = clock.to_local(estcompletion)
+    if estcompletion is None:
+        print ('vdisk {0} job {1} {2}% complete at {3}'\
+              .format(vdisk, job, pct, eventtime))
+    else:
+        print ('vdisk {0} job {1} {2}% complete at {3}, estimated completion: {4}'\
+              .format(vdisk, job, pct, eventtime, estcompletion.strftime("%Y-%m-%d %H:%M:%S")))
+
+
+def seconds(td):
+    """Return a timedelta as float seconds (no total_seconds() in 2.6)"""
+    return td.days * 86400 + td.seconds + td.microseconds / 1e6
+
+
+def first_down(disklist):
+    """Return the array time the first disk of disklist was downed (None if
+    none was)"""
+    downs = [d.times['down'] for d in disklist if 'down' in d.times]
+    return downs and min(downs) or None
+
+
+################################################################################
+class PollScheduler:
+    """Pick the next poll interval from each job's estimated completion.
+    """
+    #A completion is only seen at the next poll, so the measured time can be
+    #off by up to one interval. Far from done the interval backs off to a
+    #fraction of the remaining time (fewer controller queries); near 100% it
+    #tightens down to mininterval. While waiting for a job to appear, poll
+    #at mininterval. Jitter keeps polls of several arrays from lining up.
+    def __init__(self, mininterval=5, maxinterval=600, jitter=0.1,
+                 fraction=0.25, defaultinterval=60):
+        self.mininterval = mininterval        # seconds
+        self.maxinterval = maxinterval        # seconds
+        self.jitter = jitter                  # +/- fraction of the interval
+        self.fraction = fraction              # of the remaining time
+        self.defaultinterval = defaultinterval  # no estimate yet
+        self.polls = 0
+
+    def clamp(self, interval):
+        return max(self.mininterval, min(self.maxinterval, interval))
+
+    def base_interval(self, starting, estcompletion, eventtime):
+        if starting:
+            return self.mininterval
+        if estcompletion is None or eventtime is None:
+            return self.clamp(self.defaultinterval)
+        return self.clamp(seconds(estcompletion - eventtime) * self.fraction)
+
+    def next_interval(self, waits):
+        """Return seconds to sleep given a list of
+        (starting, estcompletion, eventtime), one per job being waited on"""
+        interval = min([self.base_interval(*w) for w in waits])
+        if self.jitter:
+            interval *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.polls += 1
+        if debug >= 1: print "Next poll in %.1fs" % interval
+        return self.clamp(interval)
+###End of Class PollScheduler###
+
+
+################################################################################
+def monotonic():
+    """Seconds from a fixed point that don't jump with the wall clock"""
+    #os.times()[4] is the elapsed real time from times(2) (no
+    #time.monotonic() in python 2)
+    return os.times()[4]
+
+
+def size_mb(size):
+    """Return a DotHill size such as 899.2GB in MB (base 10, as the array)"""
+    units = {'B': 1e-6, 'KB': 1e-3, 'MB': 1.0, 'GB': 1e3, 'TB': 1e6}
+    m = re.match('([\d.]+)\s*([KMGT]?B)$', size.strip())
+    if not m:
+        return None
+    return float(m.group(1)) * units[m.group(2)]
+
+
+def percentile(values, p):
+    """Return the p-th percentile (nearest rank) of values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(ordered))) - 1
+    return ordered[max(0, min(len(ordered) - 1, rank))]
+
+
+def array_seconds(arraytime):
+    """Return an array time (naive datetime) as seconds, read as if UTC so
+    the local time zone and DST don't enter into it"""
+    return calendar.timegm(arraytime.timetuple())
+
+
+################################################################################
+class ArrayClock:
+    """Offset and drift of an array's clock from the local clock.
+    """
+    #Every CLI reply ends with the array time, e.g.
+    #Success: Command completed successfully. (2016-06-01 21:30:01)
+    #truncated to the second and stamped some time between sending the
+    #command and reading the reply, so each reply bounds
+    #    offset = array seconds - local seconds
+    #to [array - received, array + 1 - sent]. Intersecting many replies
+    #narrows it below a second. Once the replies span driftspan seconds,
+    #drift (array seconds gained per local second) is the least squares
+    #slope of the interval midpoints against local monotonic time, and the
+    #intervals are detrended before they're intersected.
+    #
+    #Test times stay in array time, so a duration between two array times
+    #is exact to the second whatever the offset; the clock converts array
+    #times to local time, corrects durations for drift, and estimates the
+    #array time when a reply has none. Both controllers are assumed to keep
+    #the same time (a disagreement shows up as a larger error).
+    #A drift above maxdrift means the clock was set while we watched (or
+    #the array is dothillsim.py); durations are then left in array seconds.
+    driftspan = 600.0     # local seconds of replies needed to estimate drift
+    maxdrift = 1e-3       # largest drift that is corrected (1000 ppm)
+    maxsamples = 1000
+
+    rstamp = re.compile('\((\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d)\)\s*$')
+
+    def __init__(self):
+        #(array seconds, sent, received, sent monotonic, received monotonic)
+        self.samples = []
+        self.offset = 0.0        # array seconds - local seconds at self.ref
+        self.error = None        # +/- seconds, None until calibrated
+        self.drift = 0.0
+        self.drifterror = 0.0
+        self.ref = None          # (time.time(), monotonic()) of the newest reply
+
+    def add_reply(self, output, sent, received, sentmono, receivedmono):
+        """Add a sample from a CLI reply; return its array time (None if
+        the reply has none)"""
+        m = self.rstamp.search(output)
+        if not m:
+            return None
+        arraytime = datetime.datetime.strptime(m.group(1), "%Y-%m-%d %H:%M:%S")
+        self.samples.append((array_seconds(arraytime), sent, received,
+                             sentmono, receivedmono))
+        if len(self.samples) > self.maxsamples:
+            del self.samples[0]
+        self.estimate()
+        return arraytime
+
+    def estimate(self):
+        samples = self.samples
+        newest = samples[-1]
+        self.ref = (newest[2], newest[4])
+        #drift from interval midpoints against monotonic time
+        self.drift = self.drifterror = 0.0
+        xs = [(s[3] + s[4]) / 2.0 for s in samples]
+        if len(samples) >= 3 and xs[-1] - xs[0] >= self.driftspan:
+            ys = [s[0] + 0.5 - (s[1] + s[2]) / 2.0 for s in samples]
+            xm = sum(xs) / len(xs)
+            ym = sum(ys) / len(ys)
+            sxx = sum([(x - xm) ** 2 for x in xs])
+            slope = sum([(x - xm) * (y - ym) for x, y in zip(xs, ys)]) / sxx
+            residuals = [y - ym - slope * (x - xm) for x, y in zip(xs, ys)]
+            self.drift = slope
+            self.drifterror = (sum([r * r for r in residuals])
+                               / (len(xs) - 2) / sxx) ** 0.5
+        #intersect the detrended intervals (only the newest reply if the
+        #drift is too large to be a clock running fast or slow, or the
+        #intervals don't overlap because of drift not yet estimated)
+        if abs(self.drift) > self.maxdrift:
+            samples = samples[-1:]
+        lo, hi = self.intersect(samples)
+        if lo > hi:
+            lo, hi = self.intersect(samples[-1:])
+        self.offset = (lo + hi) / 2.0
+        self.error = (hi - lo) / 2.0
+
+    def intersect(self, samples):
+        lo = hi = None
+        for arr, sent, received, sentmono, receivedmono in samples:
+            shift = self.drift * (self.ref[1] - receivedmono)
+            l = arr - received + shift
+            h = arr + 1 - sent + shift
+            if lo is None or l > lo:
+                lo = l
+            if hi is None or h < hi:
+                hi = h
+        return (lo, hi)
+
+    def correcting(self):
+        return abs(self.drift) <= self.maxdrift
+
+    def to_local(self, arraytime):
+        """Return the local datetime of an array time"""
+        arr = array_seconds(arraytime)
+        if self.ref is None:
+            return datetime.datetime.fromtimestamp(arr - self.offset)
+        drift = self.correcting() and self.drift or 0.0
+        #arr = t + offset + drift * (t - ref)
+        t = (arr - self.offset + drift * self.ref[0]) / (1 + drift)
+        return datetime.datetime.fromtimestamp(t)
+
+    def to_array(self, localtime=None):
+        """Return the array time (naive datetime) at local time.time()"""
+        if localtime is None:
+            localtime = time.time()
+        drift = 0.0
+        if self.ref is not None and self.correcting():
+            drift = self.drift * (localtime - self.ref[0])
+        return datetime.datetime.utcfromtimestamp(localtime + self.offset + drift)
+
+    def duration(self, et, error=1.0):
+        """Return (local seconds, +/- seconds) of an array time timedelta
+        whose ends are each known to error/2 seconds"""
+        arr = seconds(et)
+        if not self.correcting():
+            return (arr, error)
+        return (arr / (1 + self.drift), error + self.drifterror * abs(arr))
+
+    def describe(self):
+        if self.error is None:
+            return "not calibrated"
+        text = "offset {0:+.2f}s +/- {1:.2f}s, ".format(self.offset, self.error)
+        span = self.samples[-1][4] - self.samples[0][3]
+        if span < self.driftspan:
+            text += "drift not estimated ({0:.0f}s of replies)".format(span)
+        else:
+            text += "drift {0:+.1f} ppm +/- {1:.1f} ppm"\
+                    .format(self.drift * 1e6, self.drifterror * 1e6)
+        if not self.correcting():
+            text += " (not corrected)"
+        return text + " from {0} replies".format(len(self.samples))
+###End of Class ArrayClock###
+
+
+def format_et(et, error=None):
+    """Return seconds (and +/- error) as h:mm:ss, e.g. 2:00:00 +/- 1.0s"""
+    text = str(datetime.timedelta(seconds=int(round(et))))
+    if error is not None:
+        text += " +/- {0:.1f}s".format(error)
+    return text
+
+
+################################################################################
+class ThroughputSeries:
+    """Job % samples of one vdisk, kept in compact arrays.
+    """
+    #Columns: array time and local monotonic time (float seconds), job (an
+    #index into jobnames) and pct. Rates are MB/s of vdisk capacity,
+    #pct change * vdisk size / array time between samples of the same run
+    #of a job. The series covers every test on the vdisk, so a job's samples
+    #are split into runs (instances()) and each is summarized on its own.
+    changethreshold = 0.25   # rate change (fraction) that starts a new segment
+
+    def __init__(self, arrayname, vdisk, size):
+        self.arrayname = arrayname
+        self.vdisk = vdisk
+        self.size = size               # e.g. 899.2GB
+        self.sizemb = size_mb(size)
+        self.jobnames = []
+        self.arraytime = array.array('d')
+        self.localtime = array.array('d')
+        self.job = array.array('B')
+        self.pct = array.array('B')
+
+    def __len__(self):
+        return len(self.pct)
+
+    def add(self, eventtime, localtime, job, pct):
+        if job not in self.jobnames:
+            self.jobnames.append(job)
+        self.arraytime.append(array_seconds(eventtime))
+        self.localtime.append(localtime)
+        self.job.append(self.jobnames.index(job))
+        self.pct.append(pct)
+
+    def instances(self, job):
+        """Return the sample indexes of each run of job, oldest run first"""
+        #A new run starts when the job is seen after another job (or none)
+        #on the vdisk, or when its % drops (it restarted between polls).
+        runs = []
+        if job not in self.jobnames:
+            return runs
+        j = self.jobnames.index(job)
+        for i in range(len(self)):
+            if self.job[i] != j:
+                continue
+            if not runs or self.job[i-1] != j or self.pct[i] < self.pct[i-1]:
+                runs.append([])
+            runs[-1].append(i)
+        return runs
+
+    def intervals(self, job, idx=None):
+        """Return [(start array time, end array time, MB/s)] between
+        consecutive samples of the run of job with sample indexes idx (of
+        every run if None)"""
+        intervals = []
+        if not self.sizemb:
+            return intervals
+        if idx is None:
+            for run in self.instances(job):
+                intervals.extend(self.intervals(job, run))
+            return intervals
+        for a, b in zip(idx, idx[1:]):
+            dt = self.arraytime[b] - self.arraytime[a]
+            if dt > 0:
+                intervals.append((self.arraytime[a], self.arraytime[b],
+                                  (self.pct[b] - self.pct[a]) / 100.0
+                                  * self.sizemb / dt))
+        return intervals
+
+    def rates(self, job, idx=None):
+        """Return [(array time, MB/s)] between consecutive samples of job
+        (of the run with sample indexes idx)"""
+        return [(end, rate) for start, end, rate in self.intervals(job, idx)]
+
+    def changepoints(self, rates):
+        """Return [(array time, old MB/s, new MB/s)] where the rate moves
+        more than changethreshold away from the current segment's mean"""
+        points = []
+        segment = []
+        for t, rate in rates:
+            if segment:
+                mean = sum(segment) / len(segment)
+                if mean > 0 and abs(rate - mean) > self.changethreshold * mean:
+                    points.append((t, mean, rate))
+                    segment = []
+            segment.append(rate)
+        return points
+
+    def summary(self, job):
+        """Return a dict summarizing the rates of each run of job, oldest
+        first ([] if no samples)"""
+        summaries = []
+        for idx in self.instances(job):
+            rates = self.rates(job, idx)
+            values = [r for t, r in rates]
+            et = self.arraytime[idx[-1]] - self.arraytime[idx[0]]
+            dpct = self.pct[idx[-1]] - self.pct[idx[0]]
+            average = None
+            if et > 0 and self.sizemb:
+                average = dpct / 100.0 * self.sizemb / et
+            summaries.append({'job': job, 'start': self.arraytime[idx[0]],
+                              'samples': len(idx), 'average': average,
+                              'p50': percentile(values, 50),
+                              'p95': percentile(values, 95),
+                              'changepoints': self.changepoints(rates)})
+        return summaries
+
+    def basename(self, outdir):
+        return os.path.join(outdir, self.arrayname + '_' + self.vdisk)
+
+    def write_csv(self, outdir):
+        filename = self.basename(outdir) + '.csv'
+        with open(filename, 'w') as f:
+            f.write('arraytime,localtime,vdisk,job,pct\n')
+            for i in range(len(self)):
+                f.write('{0},{1:.3f},{2},{3},{4}\n'.format(
+                    datetime.datetime.utcfromtimestamp(self.arraytime[i])
+                        .strftime("%Y-%m-%d %H:%M:%S"),
+                    self.localtime[i], self.vdisk,
+                    self.jobnames[self.job[i]], self.pct[i]))
+        return filename
+
+    def write_npz(self, outdir):
+        """Write the columns with numpy, return the file name (None if
+        numpy isn't installed)"""
+        try:
+            import numpy
+        except ImportError:
+            return None
+        filename = self.basename(outdir) + '.npz'
+        numpy.savez(filename, arraytime=numpy.array(self.arraytime),
+                    localtime=numpy.array(self.localtime),
+                    job=numpy.array(self.job), pct=numpy.array(self.pct),
+                    jobnames=numpy.array(self.jobnames),
+                    sizemb=numpy.array([self.sizemb or 0.0]))
+        return filename
+###End of Class ThroughputSeries###
+
+
+def print_throughput(serieslist):
+    """Print rate summaries for the jobs in each ThroughputSeries"""
+    def mbs(rate):
+        if rate is None:
+            return '-'
+        return '%.1f' % rate
+    def when(t):
+        return datetime.datetime.utcfromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+    print "\n{0:14} {1:6} {2:8} {3:>5} {4:19} {5:>5} {6:>8} {7:>8} {8:>8}"\
+          .format("Array", "Vdisk", "Size", "Job", "Started", "N", "avgMB/s",
+                  "p50MB/s", "p95MB/s")
+    for series in serieslist:
+        for job in series.jobnames:
+            for sm in series.summary(job):
+                print "{0:14} {1:6} {2:8} {3:>5} {4:19} {5:>5} {6:>8} {7:>8} "\
+                      "{8:>8}".format(series.arrayname, series.vdisk,
+                                      series.size, job, when(sm['start']),
+                                      sm['samples'], mbs(sm['average']),
+                                      mbs(sm['p50']), mbs(sm['p95']))
+                for t, old, new in sm['changepoints']:
+                    print "    rate change at {0}: {1:.1f} -> {2:.1f} MB/s"\
+                          .format(when(t), old, new)
+
+
+################################################################################
+class StatsSeries:
+    """Controller, vdisk, disk and host port statistics of one array
+    sampled while jobs run, kept in compact arrays.
+    """
+    #One row per object per sample: array and local monotonic time (float
+    #seconds), obj (an index into objects, (kind, name) pairs), IOPS, MB/s,
+    #queue depth and CPU load %. Columns a table doesn't have are missing
+    #(-1). Disks are named by location (0.4), controllers by letter (A),
+    #host ports by port (A1).
+    #
+    ## show controller-statistics
+    #Durable ID     CPU Load   Power On Time (Secs)   Bytes per second   IOPS  ...
+    #-------------------------------------------------------------------- ...
+    #controller_A   38         1159107                96.3MB             412   ...
+    ## show vdisk-statistics
+    #Name  Serial Number                    Bytes per second   IOPS  ...
+    #vd01  00c0ff1bce3c000029452a5700000000 48.1MB             188   ...
+    ## show disk-statistics
+    #Durable ID   Serial Number    Bytes per second   IOPS  ...
+    #disk_00.04   KPGJDL2F         48.1MB             94    ...
+    ## show host-port-statistics
+    #Durable ID   Bytes per second   IOPS  ...  Queue Depth ...
+    #hostport_A1  102.4MB            1638  ...  8           ...
+    tables = {
+        'controller': ['Durable ID', 'Bytes per second', 'IOPS', 'CPU Load'],
+        'vdisk': ['Name', 'Bytes per second', 'IOPS'],
+        'disk': ['Durable ID', 'Bytes per second', 'IOPS'],
+        'hostport': ['Durable ID', 'Bytes per second', 'IOPS'],
+    }
+    optional = ['Queue Depth']   # only in some bundles
+    kinds = ['controller', 'vdisk', 'disk', 'hostport']
+    missing = -1.0
+    stallfraction = 0.5   # job rate below this fraction of its median stalls
+    rdisk = re.compile('disk_(\d+)\.(\d+)$')
+    rcontroller = re.compile('(?:controller|hostport)_([A-Z]\d*)$')
+
+    def __init__(self, arrayname):
+        self.arrayname = arrayname
+        self.objects = []
+        self.arraytime = array.array('d')
+        self.localtime = array.array('d')
+        self.obj = array.array('H')
+        self.iops = array.array('d')
+        self.mbs = array.array('d')
+        self.queue = array.array('d')
+        self.cpu = array.array('d')
+
+    def __len__(self):
+        return len(self.obj)
+
+    @classmethod
+    def number(cls, text):
+        try:
+            return float(text)
+        except (TypeError, ValueError):
+            return cls.missing
+
+    def add_table(self, kind, output, eventtime, localtime):
+        """Add a row for every object in the show <kind>-statistics output"""
+        columns = self.tables[kind]
+        for fields in CLITable.parse(output, columns, self.optional):
+            name = fields[columns[0]]
+            m = self.rdisk.match(name)
+            if m:
+                name = '%d.%d' % (int(m.group(1)), int(m.group(2)))
+            m = self.rcontroller.match(name)
+            if m:
+                name = m.group(1)
+            mbs = size_mb(fields['Bytes per second'])
+            if (kind, name) not in self.objects:
+                self.objects.append((kind, name))
+            self.arraytime.append(array_seconds(eventtime))
+            self.localtime.append(localtime)
+            self.obj.append(self.objects.index((kind, name)))
+            self.iops.append(self.number(fields['IOPS']))
+            self.mbs.append(mbs is None and self.missing or mbs)
+            self.queue.append(self.number(fields.get('Queue Depth')))
+            self.cpu.append(self.number(fields.get('CPU Load')))
+
+    def rows(self, start, end, latest=False):
+        """Return the row indexes sampled in (start, end]; if there are none
+        and latest, those of the last sample at or before end"""
+        #rows are added in array time order
+        lo = bisect.bisect_right(self.arraytime, start)
+        hi = bisect.bisect_right(self.arraytime, end)
+        if latest and lo == hi and hi > 0:
+            lo = bisect.bisect_left(self.arraytime, self.arraytime[hi - 1])
+        return range(lo, hi)
+
+    def average(self, kind, column, start, end, combine=sum):
+        """Return the mean over the samples in (start, end] of column
+        ('iops', 'mbs', 'queue' or 'cpu') combined (e.g. sum, max) across
+        the objects of kind, None if not sampled"""
+        values = getattr(self, column)
+        samples = {}   # array time -> values of one sample of the table
+        for i in self.rows(start, end):
+            if self.objects[self.obj[i]][0] == kind and values[i] != self.missing:
+                samples.setdefault(self.arraytime[i], []).append(values[i])
+        if not samples:
+            return None
+        return sum([combine(v) for v in samples.values()]) / len(samples)
+
+    def during(self, start, end, vdisk):
+        """Return the statistics of (start, end] as a dict: highest
+        controller CPU %, vdisk mean IOPS and MB/s, busiest disk (by MB/s)
+        with its MB/s and queue depth, host port MB/s; None where not
+        sampled"""
+        def mean(values):
+            values = [v for v in values if v != self.missing]
+            if not values:
+                return None
+            return sum(values) / len(values)
+        #a job % interval can fall between two statistics samples, the
+        #last one before it is then the closest
+        cpu = []; iops = []; mbs = []; disks = {}
+        for i in self.rows(start, end, latest=True):
+            kind, name = self.objects[self.obj[i]]
+            if kind == 'controller' and self.cpu[i] != self.missing:
+                cpu.append(self.cpu[i])
+            elif kind == 'vdisk' and name == vdisk:
+                iops.append(self.iops[i]); mbs.append(self.mbs[i])
+            elif kind == 'disk':
+                disks.setdefault(name, []).append(i)
+        busiest = None
+        if disks:
+            busiest = max(sorted(disks.keys(), key=location_key),
+                          key=lambda d: mean([self.mbs[i] for i in disks[d]]))
+        stats = {'cpu': None, 'vdiskiops': mean(iops), 'vdiskmbs': mean(mbs),
+                 'disk': busiest, 'diskmbs': None, 'queue': None,
+                 'hostmbs': self.average('hostport', 'mbs', start, end)}
+        if cpu:
+            stats['cpu'] = max(cpu)
+        if busiest is not None:
+            stats['diskmbs'] = mean([self.mbs[i] for i in disks[busiest]])
+            stats['queue'] = mean([self.queue[i] for i in disks[busiest]])
+        return stats
+
+    def aligned(self, series, job):
+        """Return [(start, end, job MB/s, statistics dict)] for the job %
+        intervals of a ThroughputSeries"""
+        #Only samples where the job % moved count, so a % that doesn't move
+        #for several polls is one slow interval, not zero then a burst.
+        j = series.jobnames.index(job)
+        moved = []
+        for i in range(len(series)):
+            if series.job[i] == j and (not moved
+                                       or series.pct[i] != series.pct[moved[-1]]):
+                moved.append(i)
+        aligned = []
+        if not series.sizemb:
+            return aligned
+        for a, b in zip(moved, moved[1:]):
+            start = series.arraytime[a]; end = series.arraytime[b]
+            if end <= start or series.pct[b] < series.pct[a]:
+                continue
+            rate = ((series.pct[b] - series.pct[a]) / 100.0 * series.sizemb
+                    / (end - start))
+            aligned.append((start, end, rate,
+                            self.during(start, end, series.vdisk)))
+        return aligned
+
+    def stalls(self, series, job):
+        """Return the aligned intervals of job whose rate is below
+        stallfraction of its median rate"""
+        aligned = self.aligned(series, job)
+        median = percentile([rate for s, e, rate, st in aligned], 50)
+        if not median:
+            return ([], median)
+        return ([a for a in aligned if a[2] < self.stallfraction * median],
+                median)
+
+    def write_csv(self, outdir):
+        filename = os.path.join(outdir, self.arrayname + '_stats.csv')
+        def text(value):
+            if value == self.missing:
+                return ''
+            return '%g' % value
+        with open(filename, 'w') as f:
+            f.write('arraytime,localtime,kind,name,iops,mbs,queue,cpu\n')
+            for i in range(len(self)):
+                kind, name = self.objects[self.obj[i]]
+                f.write('{0},{1:.3f},{2},{3},{4},{5},{6},{7}\n'.format(
+                    datetime.datetime.utcfromtimestamp(self.arraytime[i])
+                        .strftime("%Y-%m-%d %H:%M:%S"),
+                    self.localtime[i], kind, name, text(self.iops[i]),
+                    text(self.mbs[i]), text(self.queue[i]), text(self.cpu[i])))
+        return filename
+
+    def write_aligned_csv(self, series, outdir):
+        """Write the job % intervals of series with the statistics sampled
+        during each, return the file name"""
+        filename = series.basename(outdir) + '_aligned.csv'
+        def text(value, fmt='%.1f'):
+            if value is None:
+                return ''
+            return fmt % value
+        with open(filename, 'w') as f:
+            f.write('start,end,job,jobmbs,cpu,vdiskiops,vdiskmbs,disk,'
+                    'diskmbs,queue,hostmbs\n')
+            for job in series.jobnames:
+                for start, end, rate, st in self.aligned(series, job):
+                    f.write(','.join([
+                        datetime.datetime.utcfromtimestamp(t)
+                        .strftime("%Y-%m-%d %H:%M:%S") for t in (start, end)]
+                        + [job, text(rate), text(st['cpu'], '%g'),
+                           text(st['vdiskiops']), text(st['vdiskmbs']),
+                           st['disk'] or '', text(st['diskmbs']),
+                           text(st['queue']), text(st['hostmbs'])]) + '\n')
+        return filename
+###End of Class StatsSeries###
+
+
+def print_stalls(serieslist, statslist):
+    """Print the job % intervals where each rebuild's rate stalled, with
+    the array statistics sampled then"""
+    stats = dict([(s.arrayname, s) for s in statslist if len(s)])
+    if not stats:
+        return
+    def num(value, fmt='%.1f'):
+        if value is None:
+            return '-'
+        return fmt % value
+    lines = []
+    for series in sorted(serieslist, key=lambda x: (x.arrayname, x.vdisk)):
+        if series.arrayname not in stats:
+            continue
+        for job in series.jobnames:
+            stalls, median = stats[series.arrayname].stalls(series, job)
+            for start, end, rate, st in stalls:
+                lines.append("{0:14} {1:6} {2:>5} {3:19} {4:>8} {5:>7} {6:>6} "
+                             "{7:>8} {8:>8} {9:6} {10:>8} {11:>6} {12:>8}".format(
+                    series.arrayname, series.vdisk, job,
+                    datetime.datetime.utcfromtimestamp(start)
+                    .strftime("%Y-%m-%d %H:%M:%S"),
+                    format_et(end - start), num(rate), num(st['cpu'], '%g'),
+                    num(st['vdiskiops']), num(st['vdiskmbs']),
+                    st['disk'] or '-', num(st['diskmbs']), num(st['queue']),
+                    num(st['hostmbs'])))
+            if stalls:
+                lines.append("{0:14} {1:6} {2:>5} median {3:.1f} MB/s".format(
+                    series.arrayname, series.vdisk, job, median))
+    if not lines:
+        print "\nNo job rate stalls (below {0:.0%} of the median)"\
+              .format(StatsSeries.stallfraction)
+        return
+    print "\nStalls (job rate below {0:.0%} of its median)"\
+          .format(StatsSeries.stallfraction)
+    print "{0:14} {1:6} {2:>5} {3:19} {4:>8} {5:>7} {6:>6} {7:>8} {8:>8} "\
+          "{9:6} {10:>8} {11:>6} {12:>8}".format(
+              "Array", "Vdisk", "Job", "Start", "Length", "MB/s", "CPU%",
+              "vdIOPS", "vdMB/s", "Disk", "dkMB/s", "Queue", "hostMB/s")
+    for line in lines:
+        print line
+
+
+################################################################################
+class CommandLatency:
+    """CLI command latencies of one array, as a histogram per command.
+    """
+    #Each send to a controller is timed around the transport call, so a
+    #failed attempt that is retried or failed over is a sample of its own.
+    #The command name is its first two words ("show disks vdisk vd01" is
+    #"show disks"), or up to three for an SMcli script command ("show
+    #storageArray longRunningOperations;"). Each sample also records the
+    #seconds the command waited for the array's command limit and the
+    #number of vdisk jobs running in the latest snapshot, to see the CLI
+    #slow down under rebuild load.
+    bounds = [0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0]
+    slowtime = 5.0        # seconds; slower commands are logged as they happen
+
+    def __init__(self, arrayname):
+        self.arrayname = arrayname
+        self.histograms = {}  # command -> counts, one per bound plus overflow
+        self.times = {}       # command -> [seconds] of successful sends
+        self.failed = {}      # command -> failed sends
+        self.slow = {}        # command -> sends of slowtime or more
+        #(local time, command, controller, seconds, ok, queued, jobs)
+        self.samples = []
+
+    @staticmethod
+    def command_name(rawcmd):
+        words = rawcmd.rstrip(' ;').split()
+        if not rawcmd.rstrip().endswith(';'):
+            return ' '.join(words[:2])
+        #SMcli script command: up to its first parameter, at most 3 words
+        names = []
+        for word in words[:3]:
+            if '[' in word or '=' in word or '"' in word:
+                break
+            names.append(word)
+        return ' '.join(names)
+
+    def record(self, rawcmd, controller, et, ok=True, queued=0.0, jobs=None):
+        cmd = self.command_name(rawcmd)
+        if cmd not in self.histograms:
+            self.histograms[cmd] = [0] * (len(self.bounds) + 1)
+            self.times[cmd] = []
+            self.failed[cmd] = 0
+            self.slow[cmd] = 0
+        self.histograms[cmd][bisect.bisect_left(self.bounds, et)] += 1
+        if ok:
+            self.times[cmd].append(et)
+        else:
+            self.failed[cmd] += 1
+        self.samples.append((time.time(), cmd, controller, et, ok, queued,
+                             jobs))
+        if et >= self.slowtime:
+            self.slow[cmd] += 1
+            print "Slow command: '{0}' on {1}{2} took {3:.1f}s{4}"\
+                  .format(rawcmd, self.arrayname, controller, et,
+                          jobs is not None and
+                          " ({0} vdisk jobs running)".format(jobs) or "")
+
+    def summary(self, cmd):
+        times = self.times[cmd]
+        sm = {'count': sum(self.histograms[cmd]),
+              'failed': self.failed[cmd],
+              'slow': self.slow[cmd],
+              'average': None, 'max': None,
+              'p50': percentile(times, 50),
+              'p95': percentile(times, 95)}
+        if times:
+            sm['average'] = sum(times) / len(times)
+            sm['max'] = max(times)
+        return sm
+
+    def to_dict(self):
+        commands = {}
+        for cmd in self.histograms:
+            commands[cmd] = self.summary(cmd)
+            commands[cmd]['histogram'] = self.histograms[cmd]
+        return {'array': self.arrayname, 'bounds': self.bounds,
+                'slowtime': self.slowtime, 'commands': commands,
+                'columns': ['localtime', 'command', 'controller', 'seconds',
+                            'ok', 'queued', 'jobs'],
+                'samples': self.samples}
+###End of Class CommandLatency###
+
+
+def print_latency(latencies):
+    """Print a latency summary of each array's CLI commands"""
+    def sec(t):
+        if t is None:
+            return '-'
+        return '%.2f' % t
+    width = max([20] + [len(cmd) for stats in latencies
+                        for cmd in stats.histograms])
+    row = "{0:14} {1:%d} {2:>6} {3:>6} {4:>5} {5:>7} {6:>7} {7:>7} {8:>7}" % width
+    print "\n" + row.format("Array", "Command", "N", "Failed", "Slow", "avg s",
+                            "p50 s", "p95 s", "max s")
+    for stats in sorted(latencies, key=lambda x: x.arrayname):
+        for cmd in sorted(stats.histograms):
+            sm = stats.summary(cmd)
+            print row.format(stats.arrayname, cmd, sm['count'], sm['failed'],
+                          sm['slow'], sec(sm['average']), sec(sm['p50']),
+                          sec(sm['p95']), sec(sm['max']))
+
+
+def save_latency(latencies, filename):
+    """Write every array's command latencies to filename as JSON"""
+    with open(filename, 'w') as f:
+        json.dump([stats.to_dict() for stats in
+                   sorted(latencies, key=lambda x: x.arrayname)], f, indent=1)
+    print "Saved " + filename
+
+
+################################################################################
+dhevent = collections.namedtuple('dhevent',
+                                 'time seq vdisk enclosure slot kind line')
+
+class EventClassifier:
+    """Turn DotHill event log lines into dhevent records in one pass.
+    """
+    #2016-06-01 19:08:14 [037] #A19784: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL Vdisk reconstruction started. (vdisk: vd01, SN: 00c0ff1bce3c000029452a5700000000) (disk: channel: 0, ID: 20, SN: KXGN1Z0R, enclosure: 0, slot: 20)
+    #The header (time, event code, sequence id) is at fixed offsets so it is
+    #sliced, not matched. The event code is the key into a dispatch table;
+    #the few messages sharing a code (499, 500) are told apart by their
+    #text. Events of other codes are kind 'other' without their text being
+    #looked at, except for the messages whose code isn't known (None),
+    #which are searched for in those. vdisk and enclosure/slot are only
+    #searched for in the parameters of known kinds.
+    messages = [
+        ('reconstructcomplete', '018', 'Reconstruction of a vdisk completed.'),
+        ('reconstructstart', '037', 'Vdisk reconstruction started.'),
+        ('spareused', '009', 'A spare disk was used in a vdisk to bring it back to a fault-tolerant state.'),
+        ('diskdown', '008', 'A disk that was part of a vdisk is down.'),
+        ('copybackspare', '500', 'A disk copyback operation completed. The indicated disk was restored to being a spare.'),
+        ('copybackcomplete', '500', 'A disk copyback operation completed.'),
+        ('copybackfailed', None, 'A disk copyback operation failed.'),
+        ('copybacksource', '499', 'A disk copyback operation started. The indicated disk is the source disk.'),
+        ('copybackstart', '499', 'A disk copyback operation started. The indicated disk is the destination disk.'),
+        ('spareadded', None, 'A spare disk drive was added to a vdisk.'),
+    ]
+
+    rvd = re.compile('vdisk: ([^,)\s]+)')
+    res = re.compile('enclosure: (\d+), slot: (\d+)')
+
+    def __init__(self, timedelta=datetime.timedelta(0)):
+        self.timedelta = timedelta   # subtracted from event times
+        #code -> [(message, kind)], longest message first so a message
+        #that starts another one is tried before it
+        self.codes = {}
+        for kind, code, text in sorted(self.messages,
+                                       key=lambda m: -len(m[2])):
+            self.codes.setdefault(code, []).append((text, kind))
+        self.uncoded = self.codes.pop(None, [])
+        #Building a datetime from six ints costs more than the rest of the
+        #parse, so dates and times of day are converted once and cached
+        #(at most 86400 times of day).
+        self.dates = {}
+        self.timesofday = {}
+
+    def eventtime(self, date, timeofday):
+        """Return the datetime for 'yyyy-mm-dd', 'hh:mm:ss'"""
+        try:
+            base = self.dates[date]
+        except KeyError:
+            base = datetime.datetime(int(date[0:4]), int(date[5:7]),
+                                     int(date[8:10])) - self.timedelta
+            self.dates[date] = base
+        try:
+            offset = self.timesofday[timeofday]
+        except KeyError:
+            offset = datetime.timedelta(hours=int(timeofday[0:2]),
+                                        minutes=int(timeofday[3:5]),
+                                        seconds=int(timeofday[6:8]))
+            self.timesofday[timeofday] = offset
+        return base + offset
+
+    def seq(self, line):
+        """Return the sequence id of line, None if it isn't an event"""
+        #yyyy-mm-dd hh:mm:ss [ccc] #Xnnnn: ...
+        if line[19:21] != ' [' or line[4:5] != '-' or line[13:14] != ':':
+            return None
+        end = line.find('] #', 21, 32)
+        if end < 0:
+            return None
+        colon = line.find(': ', end + 4, end + 20)
+        if colon < 0 or not line[end + 4:colon].isdigit():
+            return None
+        return line[end + 3:colon]
+
+    def classify(self, line, kinds=None):
+        """Return a dhevent for line, None if it isn't an event (or, given
+        kinds, isn't an event of one of them)"""
+        #the header checks of seq(), inline as this runs for every line
+        if line[19:21] != ' [' or line[4:5] != '-' or line[13:14] != ':':
+            return None
+        end = line.find('] #', 21, 32)
+        if end < 0:
+            return None
+        colon = line.find(': ', end + 4, end + 20)
+        if colon < 0 or not line[end + 4:colon].isdigit():
+            return None
+        kind = 'other'
+        vdisk = enclosure = slot = None
+        for text, k in self.codes.get(line[21:end], self.uncoded):
+            params = line.find(text, colon)
+            if params >= 0:
+                kind = k
+                if kinds is not None and kind not in kinds:
+                    return None
+                params += len(text)
+                mvd = self.rvd.search(line, params)
+                if mvd:
+                    vdisk = mvd.group(1)
+                mes = self.res.search(line, params)
+                if mes:
+                    enclosure, slot = mes.groups()
+                break
+        if kinds is not None and kind not in kinds:
+            return None
+        try:
+            eventtime = self.dates[line[0:10]] + self.timesofday[line[11:19]]
+        except KeyError:
+            eventtime = self.eventtime(line[0:10], line[11:19])
+        return dhevent(eventtime, line[end + 3:colon], vdisk, enclosure,
+                       slot, kind, line)
+###End of Class EventClassifier###
+
+
+
+class EventStore:
+    """Local copy of an array's event log, fetched incrementally.
+    """
+    #Every event carries a per-controller sequence id, e.g. #A19792, so
+    #only events newer than the last id seen are fetched. "show events last
+    #<n>" is newest first; n is doubled until the window reaches back to
+    #the last id seen (or maxnumentries), so a busy log isn't missed. The
+    #ids start again when a controller's log is cleared (or the name is
+    #given to another array), so an event at or below the last id still
+    #counts as new when it is later than the last event stored. A new
+    #store has no last id: it reads back to the 'since' time it is given
+    #(the first disk down of a test), or just the newest n without one.
+    #Events are appended to <eventdir>/<array>.events as
+    #seq<TAB>kind<TAB>vdisk<TAB>enclosure<TAB>slot<TAB>event line
+    #and indexed in memory by (vdisk, kind).
+    maxnumentries = 6400
+
+    def __init__(self, array, path):
+        self.array = array
+        self.path = path
+        self.cursor = {}     # controller letter -> last sequence number
+        self.latest = {}     # controller letter -> time of that event
+        self.index = {}      # (vdisk, kind) -> [dhevent] in time order
+        self.count = 0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for entry in f:
+                fields = entry.rstrip('\n').split('\t', 5)
+                if len(fields) != 6:
+                    continue
+                event = self.array.classify_event(fields[5])
+                if event:
+                    self.index_event(event)
+        if verbose:
+            print 'Loaded {0} events from {1}'.format(self.count, self.path)
+
+    def index_event(self, event):
+        self.index.setdefault((event.vdisk, event.kind), []).append(event)
+        #events are stored oldest first, so the last one is the newest
+        #even when the ids have started again
+        ctl = event.seq[0]
+        self.cursor[ctl] = int(event.seq[1:])
+        self.latest[ctl] = event.time
+        self.count += 1
+
+    def stored(self, event):
+        """True if event is at or below its controller's cursor and isn't
+        later than the last event stored"""
+        ctl, num = event.seq[0], int(event.seq[1:])
+        return (num <= self.cursor.get(ctl, -1)
+                and not event.time > self.latest[ctl])
+
+    def fetch_async(self, numentries):
+        """Coroutine: returns (events newer than the cursor oldest first,
+        True if the window reached events already seen for every controller)"""
+        stdout = yield self.array.runcmd_async('show events last '
+                                               + str(numentries))
+        new = []
+        reached = {}
+        seen = {}
+        nlines = 0
+        #most of the window was seen by the last fetch, so only the new
+        #events are classified
+        seqof = self.array.classifier.seq
+        for line in stdout.splitlines():
+            seq = seqof(line)
+            if not seq:
+                continue
+            if debug >= 2: print line
+            nlines += 1
+            ctl, num = seq[0], int(seq[1:])
+            seen[ctl] = True
+            if ctl in reached:
+                continue
+            event = self.array.classify_event(line)
+            if self.stored(event):
+                reached[ctl] = True
+                continue
+            new.append(event)
+        new.reverse()
+        complete = (nlines < numentries
+                    or (reached and len(reached) == len(seen)))
+        raise Return((new, complete))
+
+    def fetch(self, numentries):
+        return run_coroutine(self.fetch_async(numentries))
+
+    def sync_async(self, since=None):
+        """Coroutine: fetch and store the events logged since the last sync
+        (for a new store, since the array time since), returns the number
+        of new events"""
+        numentries = self.array.defaultnumentries
+        while True:
+            new, complete = yield self.fetch_async(numentries)
+            if not self.cursor and not complete:
+                if since is None:
+                    break
+                times = [e.time for e in new if e.time]
+                complete = bool(times) and min(times) < since
+            if complete or numentries >= self.maxnumentries:
+                break
+            numentries = min(numentries * 2, self.maxnumentries)
+            if debug >= 1: print "Reading {0} events".format(numentries)
+        if not complete and (self.cursor or since is not None):
+            print 'Error: more than {0} new events, some were missed'\
+                  .format(numentries)
+        with open(self.path, 'a') as f:
+            for event in new:
+                f.write('\t'.join([event.seq, event.kind, event.vdisk or '',
+                                   event.enclosure or '', event.slot or '',
+                                   event.line]) + '\n')
+                self.index_event(event)
+        if debug >= 1: print "{0} new events".format(len(new))
+        raise Return(len(new))
+
+    def sync(self, since=None):
+        return run_coroutine(self.sync_async(since))
+
+    def find(self, vdisk, kind, after=None):
+        """Return the events of kind for vdisk (at or after 'after')"""
+        events = self.index.get((vdisk, kind), [])
+        if after:
+            events = [e for e in events if e.time and e.time >= after]
+        return events
+
+    def find_kind(self, kind, after=None):
+        """Return the events of kind for any vdisk (at or after 'after') in
+        time order"""
+        events = []
+        for (vdisk, k), found in self.index.items():
+            if k == kind:
+                events.extend(self.find(vdisk, kind, after))
+        events.sort(key=lambda e: e.time)
+        return events
+###End of Class EventStore###
+
+
+################################################################################
+def location_key(location):
+    """Sort key of an enclosure.slot location, e.g. '0.12' -> (0, 12)"""
+    return tuple([int(n) for n in location.split('.')])
+
+
+class Topology:
+    """Which disks make up each vdisk of an array, its RAID level, and the
+    spares.
+    """
+    #Discovered from one show vdisks, one show disks and a show disks vdisk
+    #<vdisk> per vdisk (show disks has no vdisk column), e.g.
+    ## show disks
+    #Location Serial Number        Vendor   Rev  How Used   Type   Size     Rate*(Gb/s) SP Health
+    #  Health Reason
+    #  Health Recommendation
+    #------------------------------------------------------------------------------- ...
+    #0.0      KPGJDL2F             HGST     A3D0 VDISK      SAS    900.1GB  6.0            OK
+    #0.20     KXGN1Z0R             HGST     A3D0 GLOBAL SP  SAS    900.1GB  6.0            OK
+    #------------------------------------------------------------------------------- ...
+    #Success: Command completed successfully. (2016-06-01 21:30:01)
+    #It is saved as <topologydir>/<array serial>_<bundle version>.topology
+    #(JSON), so it's only discovered again when the array or its firmware
+    #changes, the vdisks no longer match, or with --rediscover.
+    diskcolumns = ['Location', 'Serial Number', 'How Used', 'Size', 'Health']
+    sparetypes = ['GLOBAL SP', 'VDISK SP']
+
+    def __init__(self, serial, version):
+        self.serial = serial
+        self.version = version
+        self.vdisks = {}   # name -> {'raid':, 'size':, 'disks': [location]}
+        self.disks = {}    # location -> {'serial':, 'use':, 'size':, 'health':, 'vdisk':}
+
+    @classmethod
+    def filename(cls, topologydir, serial, version):
+        return os.path.join(topologydir, '{0}_{1}.topology'.format(serial, version))
+
+    def add_disks(self, output):
+        """Add every disk in show disks output"""
+        for fields in CLITable.parse(output, self.diskcolumns):
+            self.disks[fields['Location']] = {
+                'serial': fields['Serial Number'], 'use': fields['How Used'],
+                'size': fields['Size'], 'health': fields['Health'],
+                'vdisk': None}
+
+    def add_vdisk(self, status, output):
+        """Add a vdisk from its vdiskstatus and show disks vdisk output"""
+        members = [fields['Location'] for fields
+                   in CLITable.parse(output, self.diskcolumns)]
+        members.sort(key=location_key)
+        self.vdisks[status.name] = {'raid': status.raid, 'size': status.size,
+                                    'disks': members}
+        for location in members:
+            if location in self.disks:
+                self.disks[location]['vdisk'] = status.name
+
+    @property
+    def spares(self):
+        return sorted([l for l, d in self.disks.items()
+                       if d['use'] in self.sparetypes], key=location_key)
+
+    def matches(self, snapshot):
+        """True if snapshot has the same vdisks with the same RAID levels"""
+        if sorted(snapshot.vdisks.keys()) != sorted(self.vdisks.keys()):
+            return False
+        for name, status in snapshot.vdisks.items():
+            if status.raid != self.vdisks[name]['raid']:
+                return False
+        return True
+
+    def spread(self, members, count):
+        """Return count of members, taking enclosures in turn"""
+        byenclosure = {}
+        for location in sorted(members, key=location_key):
+            byenclosure.setdefault(location.split('.')[0], []).append(location)
+        chosen = []
+        while len(chosen) < count and byenclosure:
+            for enclosure in sorted(byenclosure.keys(), key=int):
+                chosen.append(byenclosure[enclosure].pop(0))
+                if not byenclosure[enclosure]:
+                    del byenclosure[enclosure]
+                if len(chosen) == count:
+                    break
+        return chosen
+
+    def select(self, raid6disks=1):
+        """Return a test plan [(enclosure, slot, vdisk)] with a member disk of
+        every vdisk (raid6disks of each RAID6 vdisk)"""
+        #Entry k of each vdisk is in round k, so the first len(vdisks)
+        #entries cover every vdisk once (tests 1 and 2 take the first one
+        #or two), and a vdisk's disks come from different enclosures where
+        #possible.
+        rounds = []
+        for name in sorted(self.vdisks.keys()):
+            vdisk = self.vdisks[name]
+            count = 1
+            if vdisk['raid'] == 'RAID6':
+                count = raid6disks
+            for k, location in enumerate(self.spread(vdisk['disks'], count)):
+                if k == len(rounds):
+                    rounds.append([])
+                enclosure, slot = location.split('.')
+                rounds[k].append((int(enclosure), int(slot), name))
+        plan = []
+        for r in rounds:
+            plan.extend(r)
+        return plan
+
+    def save(self, path):
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'serial': self.serial, 'version': self.version,
+                       'vdisks': self.vdisks, 'disks': self.disks}, f,
+                      indent=1, sort_keys=True)
+        os.rename(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """Return the Topology saved in path, None if there isn't one"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            saved = json.load(f)
+        topology = cls(saved['serial'], saved['version'])
+        topology.vdisks = saved['vdisks']
+        topology.disks = saved['disks']
+        return topology
+
+    def describe(self):
+        lines = []
+        for name in sorted(self.vdisks.keys()):
+            vdisk = self.vdisks[name]
+            lines.append('{0:6} {1:6} {2:9} {3}'.format(
+                name, vdisk['raid'], vdisk['size'], ' '.join(vdisk['disks'])))
+        lines.append('spares: ' + ' '.join(self.spares))
+        return '\n'.join(lines)
+###End of Class Topology###
+
+
 ################################################################################
 class DotHillArray:
     pass
@@ -44,14 +2035,33 @@ class DotHillArray:
 class DotHillArrayGL(DotHillArray):
     #Tested on Product ID:DH4544, Bundle version:GL145R006
     #RE for version from show version
-    controller = 1           # controller to access (1 for A or 2 for B)
+    controller = 1           # controller for changes (1 for A or 2 for B)
+    controllers = [1, 2]     # controllers that can answer show commands
+    latencyalpha = 0.3       # weight of the newest sample in the latency EWMA
+    latencyslack = 0.2       # controllers this close in latency take turns
+    downretrytime = 120      # seconds before retrying a failed controller
     initialsleeptime = 60    # GL takes ~30s from disk down to RCON started
-    startsleeptime = 15      # Sleep time waiting for initial state
-    sleeptime = 60           # recheck interval
+    sleeptime = 60           # recheck interval with no completion estimate
+    minpolltime = 5          # shortest poll interval (also startup polling)
+    maxpolltime = 600        # longest poll interval
+    polljitter = 0.1         # +/- fraction of random jitter on intervals
     defaultnumentries = 100  # default number of events to retrieve from log
-
-    #delta from array time to local time
-    timedelta = datetime.timedelta(seconds = time.altzone)
+    eventdir = '.'           # directory for the local event store
+    usesessions = True       # False to fork rshfa for every command
+    maxcommands = 2          # commands in flight to one array at once
+    topologydir = '.'        # directory for cached Topology files
+    rediscover = False       # True to ignore a cached Topology
+    raid6disks = 1           # disks of each RAID6 vdisk put in a plan
+    stagger = 0              # seconds between downs of one vdisk's disks
+    snapshotttl = 5          # seconds a show vdisks snapshot is reused
+    statsinterval = 60       # seconds between statistics samples, 0=off
+    statscommands = [('controller', 'show controller-statistics'),
+                     ('vdisk', 'show vdisk-statistics'),
+                     ('disk', 'show disk-statistics'),
+                     ('hostport', 'show host-port-statistics')]
+    clockclass = ArrayClock
+    classifierclass = EventClassifier
+    eventstoreclass = EventStore
 
 
     #show version patterns:
@@ -62,38 +2072,58 @@ class DotHillArrayGL(DotHillArray):
     #show system patterns:
     #SCSI Product ID, e.g. SCSI Product ID: DH4544
     rpi = re.compile('SCSI Product ID: (?P<id>\w+)')
-
-
-    #show vdisks patterns:
-    #job and percent complete
-    rjp = re.compile('(?P<job>\w+)\s+(?P<pct>\d+)%')  
+    #Midplane Serial Number, e.g. Midplane Serial Number: 00C0FF1B50B6
+    rsn = re.compile('Midplane Serial Number: (?P<serial>\w+)')
 
 
     #event log patterns:
     rdt = re.compile('(?P<time>(?P<yyyy>\d\d\d\d)-(?P<mm>\d\d)-(?P<dd>\d\d) (?P<hour>\d\d):(?P<minute>\d\d):(?P<second>\d\d))')
 
-    rrc = re.compile('Reconstruction of a vdisk completed.')
-    rrs = re.compile('Vdisk reconstruction started.')
-    rsu = re.compile('A spare disk was used in a vdisk to bring it back to a fault-tolerant state.')
-    rdd = re.compile('A disk that was part of a vdisk is down.')
+    #event log lines are parsed by EventClassifier
+
+    rs = re.compile('Success')
 
-    rccs= re.compile('A disk copyback operation completed. The indicated disk was restored to being a spare.')
-    rcc = re.compile('A disk copyback operation completed. [(]')
-    rcf = re.compile('A disk copyback operation failed.')
-    rcs = re.compile('A disk copyback operation started. The indicated disk is the source disk.')
-    rcd = re.compile('A disk copyback operation started. The indicated disk is the destination disk.')
-    rda = re.compile('A spare disk drive was added to a vdisk.')
+    #commands that start a vdisk job (the vdisk name is {0})
+    jobcommands = {'VRSC': 'scrub vdisk {0}', 'VRFY': 'verify vdisk {0}'}
+    jobstartgrace = 30   # array seconds a started job may take to show
 
-    rvd = re.compile('vdisk: (?P<vdisk>vd\d+)')
-    res = re.compile('enclosure: (?P<enclosure>\d+), slot: (?P<slot>\d+)')
+    #show job-parameters pattern, e.g. Priority: High
+    rjp = re.compile('(?:Utility )?Priority: (?P<priority>\w+)')
+    jobpriorities = ['high', 'medium', 'low']   # set job-parameters priority
 
-    rs = re.compile('Success')
+    #commands that don't change the array, so they can be sent again
+    readonlycommands = ('show ',)
 
 
-    def __init__(self, name):
+    def __init__(self, name, connect=True):
         self.name = name
-        self.get_version()
-        self.getscsiproductid()
+        self.snapshot = None
+        self.snapshotfetch = None   # Task of the show vdisks in flight
+        self.serial = None
+        self.topology = None
+        self.cmdlimit = AsyncLimit(self.maxcommands)
+        self.series = {}     # vdisk -> ThroughputSeries of job % samples
+        self.stats = StatsSeries(name)
+        self.statswaiters = 0   # waits for jobs the sampler runs for
+        self.statstask = None   # Task of the statistics sampler
+        self.latency = {}    # controller -> EWMA of command seconds
+        self.cmdstats = CommandLatency(name)
+        self.downuntil = {}  # controller -> time.time() to retry it
+        self.nextcontroller = 0
+        self.clock = self.clockclass()
+        self.classifier = self.classifierclass()   # event times stay array time
+        self.poller = PollScheduler(self.minpolltime, self.maxpolltime,
+                                    self.polljitter,
+                                    defaultinterval=self.sleeptime)
+        self.events = self.eventstoreclass(self, os.path.join(self.eventdir,
+                                                              name + '.events'))
+        if connect:
+            run_coroutine(self.connect_async())
+
+
+    def connect_async(self):
+        """Coroutine: get the bundle version and SCSI Product ID"""
+        yield [self.get_version_async(), self.getscsiproductid_async()]
 
 
     def get_eventtime(self, line):
@@ -109,22 +2139,143 @@ class DotHillArrayGL(DotHillArray):
                                         int(hour), int(minute), int(second))
         else: 
             return 0  # couldn't find time in line
-        return eventtime - self.timedelta #(won't work properly if DST changes)
+        return eventtime  # array time, see ArrayClock
 
 
     def getrshcmd(self, cmd):
-        return 'rshfa -V dh ' + self.name + str(self.controller) + ' ' + cmd
+        return rshfa + ' -V dh ' + self.name + str(self.controller) + ' ' + cmd
+
+
+    def pick_controllers(self, rawcmd):
+        """Return the controllers to try for rawcmd, best first"""
+        #show commands go to the controller with the lower latency (so the
+        #one busy with a rebuild is avoided), taking turns when they're
+        #close. Other commands go to self.controller. A controller that
+        #failed is tried last until downretrytime has passed, and stays
+        #out of the other commands (which are sent once) until a show
+        #command has got through to it again.
+        now = time.time()
+        readonly = rawcmd.startswith(self.readonlycommands)
+        if not readonly:
+            return sorted(self.controllers,
+                          key=lambda c: (c in self.downuntil,
+                                         self.downuntil.get(c, 0),
+                                         c != self.controller))
+        up = [c for c in self.controllers if self.downuntil.get(c, 0) <= now]
+        down = [c for c in self.controllers if c not in up]
+        if len(up) < 2:
+            ordered = up + down
+            if self.controller in up:
+                ordered.remove(self.controller)
+                ordered.insert(0, self.controller)
+            return ordered
+        #untried controllers count as fastest so every one gets measured
+        latency = dict([(c, self.latency.get(c, 0.0)) for c in up])
+        fastest = min(latency.values())
+        close = [c for c in up
+                 if latency[c] <= fastest * (1 + self.latencyslack)]
+        self.nextcontroller = (self.nextcontroller + 1) % len(close)
+        first = close[self.nextcontroller]
+        return [first] + [c for c in up if c != first] + down
+
+
+    def runcmd_async(self, rawcmd):
+        """Coroutine: run a CLI command on the array, returns its output.
+        """
+        #If a controller doesn't answer (e.g. during a failover) a show
+        #command is sent to the other one. A session that fails is retried
+        #once (reconnecting). Other commands (down, clear, set, ...) may
+        #have run before the session failed, so they are sent once and a
+        #failure is raised as the SessionError. At most maxcommands run at
+        #once per array.
+        loop = EventLoop.current()
+        queuedmono = monotonic()
+        yield self.cmdlimit.acquire()
+        queued = monotonic() - queuedmono
+        jobs = None
+        if self.snapshot is not None:
+            jobs = len([v for v in self.snapshot.vdisks.values()
+                        if v.job != "Blank"])
+        try:
+            readonly = rawcmd.startswith(self.readonlycommands)
+            controllers = self.pick_controllers(rawcmd)
+            if not readonly:
+                controllers = controllers[:1]
+            for controller in controllers:
+                start = time.time()
+                startmono = monotonic()
+                session = loop.session(self.name, controller,
+                                       oneshot=not self.usesessions)
+                stdout = None
+                for attempt in range(self.usesessions and readonly and 2 or 1):
+                    sendmono = monotonic()
+                    try:
+                        stdout = yield session.send(rawcmd)
+                        break
+                    except SessionError as e:
+                        error = e
+                        if debug >= 1: print "%s, reconnecting" % e
+                    finally:
+                        self.cmdstats.record(rawcmd, controller,
+                                             monotonic() - sendmono,
+                                             stdout is not None, queued, jobs)
+                if stdout is None:
+                    print "Controller {0} of {1} failed: {2}"\
+                          .format(controller, self.name, error)
+                    self.downuntil[controller] = time.time() + self.downretrytime
+                    if not readonly:
+                        raise error   # it may have run, don't repeat it
+                    continue
+                end = time.time()
+                self.clock.add_reply(stdout, start, end, startmono, monotonic())
+                et = end - start
+                old = self.latency.get(controller)
+                if old is None:
+                    self.latency[controller] = et
+                else:
+                    self.latency[controller] = (self.latencyalpha * et
+                                                + (1 - self.latencyalpha) * old)
+                self.downuntil.pop(controller, None)
+                if debug >= 1 and controller != self.controller:
+                    print "'{0}' sent to controller {1}".format(rawcmd, controller)
+                raise Return(stdout)
+            if self.usesessions:
+                #last resort: one rshfa per command
+                print "CLI session to {0}{1} unusable, using rshfa"\
+                      .format(self.name, controllers[0])
+                sendmono = monotonic()
+                stdout = None
+                try:
+                    stdout = yield loop.session(self.name, controllers[0],
+                                                oneshot=True).send(rawcmd)
+                finally:
+                    self.cmdstats.record(rawcmd, controllers[0],
+                                         monotonic() - sendmono,
+                                         stdout is not None, queued, jobs)
+                raise Return(stdout)
+            raise RuntimeError("No controller of " + self.name + " answered")
+        finally:
+            self.cmdlimit.release()
+
+
+    def runcmd(self, rawcmd):
+        """Run a CLI command on the array, return its output.
+        """
+        return run_coroutine(self.runcmd_async(rawcmd))
 
 
     def sendrshcmd(self, rawcmd):
-        cmd = self.getrshcmd(rawcmd)
-        if debug >= 2: print "cmd = " + cmd
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        print p.communicate()
+        print self.runcmd(rawcmd)
+
+
+    def get_version(self):
+        """Return the bundle version of this array.
+        """
+        return run_coroutine(self.get_version_async())
 
 
-    def get_version(self):  
-        """Return the bundle version of this array.
+    def get_version_async(self):
+        """Coroutine: returns the bundle version of this array.
         """
         ## show version
         #Controller A Versions
@@ -138,17 +2289,14 @@ class DotHillArrayGL(DotHillArray):
         #Build Date: Fri Dec 11 10:24:33 MST 2015
         #
         #Success: Command completed successfully. (2016-06-13 23:31:21)
-        cmd = self.getrshcmd('show version')
-        if debug >= 2: print "cmd = " + cmd
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        stdout, stderr = p.communicate()
+        stdout = yield self.runcmd_async('show version')
         for line in stdout.splitlines():
             if debug >= 2: print line
             m = self.rbv.match(line)  #search for Bundle Version:
             if m:
                 self.version =  m.group('version')
         if (self.version): 
-            return self.version
+            raise Return(self.version)
         else:
             raise RuntimeError("Couldn't get bundle version.")
 
@@ -156,6 +2304,12 @@ class DotHillArrayGL(DotHillArray):
     def getscsiproductid(self):
         """Return the SCSI Product ID
         """
+        return run_coroutine(self.getscsiproductid_async())
+
+
+    def getscsiproductid_async(self):
+        """Coroutine: returns the SCSI Product ID
+        """
         ## show system
         #System Information
         #------------------
@@ -179,45 +2333,53 @@ class DotHillArrayGL(DotHillArray):
 
         #Success: Command completed successfully. (2016-06-14 16:23:36)
 
-        cmd = self.getrshcmd('show system')
-        if debug >= 2: print "cmd = " + cmd
-
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        stdout, stderr = p.communicate()
+        stdout = yield self.runcmd_async('show system')
         for line in stdout.splitlines():
             if debug >= 2: print line
             m = self.rpi.match(line)  #search for SCSI Product ID:
             if m:
                 self.scsiproductid =  m.group('id')
+            m = self.rsn.match(line)  #search for Midplane Serial Number:
+            if m:
+                self.serial = m.group('serial')
         if (self.scsiproductid):
-            return self.scsiproductid
+            raise Return(self.scsiproductid)
         else:
             raise RuntimeError("Couldn't get SCSI Product ID.")
 
 
-    def down_disk(self, disk):  
-        """Down the specified disk."
+    def down_disk(self, disk):
+        """Down the specified disk.
+        """
+        return run_coroutine(self.down_disk_async(disk))
+
+
+    def down_disk_async(self, disk):
+        """Coroutine: down the specified disk.
         """
         ## down disk 0.0
         #"Info: Disk 0.0 was placed in a down state. (0.0)
         #Success: Command completed successfully. (0.0) - Disk 0.0 was placed 
         #in a down state. (2016-06-01 19:08:12)"
-        cmd = self.getrshcmd('down disk ' + disk.location)
-        if debug >= 2: print "cmd = " + cmd
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        stdout, stderr = p.communicate()
+        stdout = yield self.runcmd_async('down disk ' + disk.location)
         for line in stdout.splitlines():
             if debug >= 2: print line
             m = self.rs.match(line)  #search for Success
             if m:
                 if debug == 1: print line
-                return True
+                raise Return(True)
         raise RuntimeError("down disk failed")
 
 
-    def clear_disk(self, disk):  
+    def clear_disk(self, disk):
         """Clear disk-metadata for the specified disk.
         """
+        return run_coroutine(self.clear_disk_async(disk))
+
+
+    def clear_disk_async(self, disk):
+        """Coroutine: clear disk-metadata for the specified disk.
+        """
         ## clear disk-metadata 0.0
         #"Info: Updating disk list...
         #Info: Disk disk_00.00 metadata was cleared. (2016-06-01 21:32:46)"
@@ -228,72 +2390,197 @@ class DotHillArrayGL(DotHillArray):
         pe = re.compile('Error')  
         pc = re.compile('metadata was cleared')  
 
-        cmd = self.getrshcmd('clear disk-metadata ' + disk.location)
-        if debug >= 2: print "cmd = " + cmd
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        stdout, stderr = p.communicate()
+        stdout = yield self.runcmd_async('clear disk-metadata ' + disk.location)
         for line in stdout.splitlines():
             if debug >= 2: print line
             se = pe.search(line)
             sc = pc.search(line)
             if sc:
                 if debug == 1: print line
-                return True
+                raise Return(True)
             elif se:
                 raise RuntimeError(line)
         raise RuntimeError("Did not find metadata was cleared message")
 
 
-    def get_job_pct(self, vdisk):  
+    def get_job_priority_async(self):
+        """Coroutine: returns the job (utility) priority, e.g. high
+        """
+        ## show job-parameters
+        #Job Parameters
+        #--------------
+        #Auto Stall Recovery: Enabled
+        #Priority: High
+        #
+        #Success: Command completed successfully. (2016-06-14 16:23:36)
+        stdout = yield self.runcmd_async('show job-parameters')
+        for line in stdout.splitlines():
+            if debug >= 2: print line
+            m = self.rjp.match(line)  #search for Priority:
+            if m:
+                raise Return(m.group('priority').lower())
+        raise RuntimeError("Couldn't get the job priority.")
+
+
+    def set_job_priority_async(self, priority):
+        """Coroutine: set the job (utility) priority: high, medium or low
+        """
+        stdout = yield self.runcmd_async('set job-parameters priority '
+                                         + priority)
+        for line in stdout.splitlines():
+            if debug >= 2: print line
+            if self.rs.match(line):  #search for Success
+                raise Return(True)
+        raise RuntimeError("set job-parameters priority {0} failed: {1}"
+                           .format(priority, stdout.strip()))
+
+
+    def save_job_priority_async(self):
+        """Coroutine: returns the job priority setting, to be put back by
+        restore_job_priority_async
+        """
+        priority = yield self.get_job_priority_async()
+        raise Return(priority)
+
+
+    def restore_job_priority_async(self, saved):
+        """Coroutine: put back a job priority from save_job_priority_async
+        """
+        yield self.set_job_priority_async(saved)
+        raise Return(True)
+
+
+    def describe_job_priority(self, saved):
+        return saved
+
+
+    def get_vdisk_snapshot(self, maxage=None):
+        """Return a VdiskSnapshot of all vdisks, reusing one that is recent.
+        """
+        return run_coroutine(self.get_vdisk_snapshot_async(maxage))
+
+
+    def get_vdisk_snapshot_async(self, maxage=None):
+        """Coroutine: returns a VdiskSnapshot of all vdisks, reusing one
+        that is recent.
+        """
+        #Callers inside the TTL (e.g. several waiters polling different
+        #vdisks) share one snapshot, and callers that come while a show
+        #vdisks is running wait for it instead of sending another.
+        if maxage is None:
+            maxage = self.snapshotttl
+        if self.snapshot is not None and self.snapshot.age() <= maxage:
+            raise Return(self.snapshot)
+        if self.snapshotfetch is None:
+            self.snapshotfetch = EventLoop.current().future(
+                self.fetch_snapshot_async())
+        snapshot = yield self.snapshotfetch
+        raise Return(snapshot)
+
+
+    def fetch_snapshot_async(self):
+        """Coroutine: run show vdisks, returns the new self.snapshot"""
+        try:
+            stdout = yield self.runcmd_async('show vdisks')
+        finally:
+            self.snapshotfetch = None
+        eventtime = 0
+        for line in stdout.splitlines():
+            if self.rs.match(line):  # search for "Success"
+                if debug == 1: print line
+                eventtime = self.get_eventtime(line)
+                break
+        if not eventtime:
+            #estimate the array time instead of mixing in local time
+            if debug > 0: print "Couldn't find eventtime, using the array clock estimate"
+            eventtime = self.clock.to_array()
+        self.snapshot = VdiskSnapshot(stdout, eventtime)
+        self.record_samples(self.snapshot)
+        raise Return(self.snapshot)
+
+
+    def record_samples(self, snapshot):
+        """Add the job % of every busy vdisk in snapshot to self.series"""
+        localtime = monotonic()
+        for name, status in snapshot.vdisks.items():
+            if status.job == "Blank":
+                continue
+            if name not in self.series:
+                self.series[name] = ThroughputSeries(self.name, name,
+                                                     status.size)
+            self.series[name].add(snapshot.eventtime, localtime,
+                                  status.job, status.pct)
+
+
+    def get_topology(self):
+        """Return the Topology of this array (discovered or cached)"""
+        return run_coroutine(self.get_topology_async())
+
+
+    def get_topology_async(self):
+        """Coroutine: returns the Topology of this array, from the cache if
+        it still matches the vdisks, otherwise discovered and cached
+        """
+        snapshot = yield self.get_vdisk_snapshot_async(maxage=0)
+        path = Topology.filename(self.topologydir, self.serial, self.version)
+        topology = None
+        if not self.rediscover:
+            topology = Topology.load(path)
+            if topology and not topology.matches(snapshot):
+                print "Vdisks of {0} changed, discovering again".format(self.name)
+                topology = None
+        if topology is None:
+            names = sorted(snapshot.vdisks.keys())
+            outputs = yield [self.runcmd_async('show disks')] \
+                + [self.runcmd_async('show disks vdisk ' + name)
+                   for name in names]
+            topology = Topology(self.serial, self.version)
+            topology.add_disks(outputs[0])
+            for name, output in zip(names, outputs[1:]):
+                topology.add_vdisk(snapshot.vdisks[name], output)
+            for status in snapshot.vdisks.values():
+                if status.job != "Blank" or status.status != 'FTOL':
+                    print "Warning: {0} {1} is {2} {3}, its disks may not be "\
+                          "the usual ones".format(self.name, status.name,
+                                                 status.status, status.job)
+            topology.save(path)
+            if verbose: print "Saved " + path
+        elif verbose:
+            print "Topology of {0} from {1}".format(self.name, path)
+        self.topology = topology
+        raise Return(topology)
+
+
+    def get_job_pct(self, vdisk):
         """Return the completion% of the current job for the specified vdisk.
         """
+        return run_coroutine(self.get_job_pct_async(vdisk))
+
+
+    def get_job_pct_async(self, vdisk):
+        """Coroutine: returns (job, completion%, array time) of the current
+        job for the specified vdisk.
+        """
         #GL:
-        ## show vdisks vd01
+        ## show vdisks
         #Name  Size    Free Own Pref   RAID   Disks Spr Chk  Status Jobs      Job%      Serial Number                    Drive Spin Down        Spin Down Delay       Health     Health Reason
         #  Health Recommendation
         #--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
         #vd01  899.2GB 0B   A   A      RAID1  2     0   N/A  FTOL   VRSC      35%       00c0ff1bce3c000029452a5700000000 Disabled               0                     OK
-
-        ## show vdisks vd01
-        #Name  Size    Free Own Pref   RAID   Disks Spr Chk  Status Jobs      Job%      Serial Number                    Drive Spin Down        Spin Down Delay       Health
-        #  Health Reason Health Recommendation
-        #------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-        #vd01  899.2GB 0B   A   A      RAID1  2     0   N/A  FTOL                       00c0ff1bce3c000029452a5700000000 Disabled               0                     OK
+        #vd02  899.2GB 0B   A   A      RAID1  2     0   N/A  FTOL                       00c0ff1bce3c000029452a5700000000 Disabled               0                     OK
         #
-        #------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+        #--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
         #Success: Command completed successfully. (2016-06-01 21:30:01)
 
         if (self.version[0:2]=="GL"):
-            cmd = self.getrshcmd('show vdisks ' + vdisk)
-            if debug >= 2: print "cmd = " + cmd
-            p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-            stdout, stderr = p.communicate()
-            foundpct = False
-            foundtime = False
-            for line in stdout.splitlines():
-                if debug >= 2: print line
-                mjp = self.rjp.search(line)  # search for job and %complete
-                if mjp:
-                    if debug == 1: print line
-                    foundpct = True
-                    self.job = mjp.group('job')
-                    self.pct = mjp.group('pct')
-                    for line in stdout.splitlines():
-                        ms = self.rs.match(line)  # search for "Success"
-                        if ms:
-                            if debug == 1: print line
-                            eventtime = self.get_eventtime(line)
-                            foundtime = True
-                            break
-                    break;
-            if not foundtime:
-                if debug > 0: print "Couldn't find eventtime, substituting local time"
-                eventtime = datetime.datetime.now()
-                
-            if (foundpct):
-                return (self.job, int(self.pct), eventtime)
-            else:  # Job completed
-                return ("Blank", 100, eventtime)
+            snapshot = yield self.get_vdisk_snapshot_async()
+            if vdisk not in snapshot.vdisks:
+                raise RuntimeError("vdisk " + vdisk + " not found")
+            status = snapshot.vdisks[vdisk]
+            if debug == 1: print status
+            self.job = status.job
+            self.pct = status.pct
+            raise Return((self.job, self.pct, snapshot.eventtime))
 
 
     #Jobs for GL
@@ -308,253 +2595,1420 @@ class DotHillArrayGL(DotHillArray):
     def wait_til_ready(self, vdisk):
         """Wait until the specified vdisk is not busy
         """
-        time.sleep(self.initialsleeptime)
-        job, pct, eventtime = self.get_job_pct(vdisk)
+        return run_coroutine(self.wait_til_ready_async(vdisk))
+
+
+    def wait_til_ready_async(self, vdisk):
+        """Coroutine: wait until the specified vdisk is not busy
+        """
+        yield sleep_async(self.initialsleeptime)
+        job, pct, eventtime = yield self.get_job_pct_async(vdisk)
         initialpct = pct; initialtime = eventtime
         while ((job=="INIT") or (job=="RCON") or (job=="CPYBK")
                 or (job=="EXPD")):
-            time.sleep(self.sleeptime)
-            job, pct = self.get_job_pct(vdisk)
+            estcompletion = estimate_completion(pct, eventtime,
+                                                initialpct, initialtime)
+            yield sleep_async(self.poller.next_interval(
+                [(False, estcompletion, eventtime)]))
+            job, pct, eventtime = yield self.get_job_pct_async(vdisk)
             if verbose:
-                if pct == initialpct or pct == 100:
-                    print ('vdisk {0} job {1} {2}% complete at {3}'\
-                          .format(vdisk, job, pct, eventtime))
-                else:
-                    #Note estcompletion will be off if a new job starts (not likely)
-                    estcompletion = eventtime \
-                        + (100-pct)*(eventtime - initialtime)/(pct - initialpct)
-                    print ('vdisk {0} job {1} {2}% complete at {3}, estimated completion: {4}'\
-                          .format(vdisk, job, pct, eventtime, estcompletion.strftime("%Y-%m-%d %H:%M:%S")))
-        return True
+                print_progress(vdisk, job, pct, eventtime,
+                               initialpct, initialtime, self.clock)
+        raise Return(True)
 
 
     def wait_for_job(self, vdisk, myjob):
         """Wait until the specified vdisk starts and completes the specified job
         """
-        time.sleep(self.startsleeptime)
-        job, pct, eventtime = self.get_job_pct(vdisk)
-        if verbose:
-            print ('vdisk {0} job {1} {2}% complete at {3}'\
-                  .format(vdisk, job, pct, eventtime))
-        while (job != myjob):
-            if debug >= 2: print line
-            time.sleep(self.startsleeptime)
-            job, pct, eventtime = self.get_job_pct(vdisk)
+        return run_coroutine(self.wait_for_job_async(vdisk, myjob))
+
+
+    def wait_for_job_async(self, vdisk, myjob):
+        """Coroutine: wait until the specified vdisk starts and completes the
+        specified job
+        """
+        self.start_stats()
+        try:
+            yield sleep_async(self.poller.next_interval([(True, None, None)]))
+            job, pct, eventtime = yield self.get_job_pct_async(vdisk)
             if verbose:
                 print ('vdisk {0} job {1} {2}% complete at {3}'\
                       .format(vdisk, job, pct, eventtime))
-        initialpct = pct; initialtime = eventtime
-        while (job == myjob):
-            if debug >= 2: print line
-            time.sleep(self.sleeptime)
-            job, pct, eventtime = self.get_job_pct(vdisk)
-            if verbose:
-                if pct == initialpct or pct == 100:
+            while (job != myjob):
+                yield sleep_async(self.poller.next_interval([(True, None, None)]))
+                job, pct, eventtime = yield self.get_job_pct_async(vdisk)
+                if verbose:
                     print ('vdisk {0} job {1} {2}% complete at {3}'\
                           .format(vdisk, job, pct, eventtime))
-                else:
-                    estcompletion = eventtime \
-                        + (100-pct)*(eventtime - initialtime)/(pct - initialpct)
-                    print ('vdisk {0} job {1} {2}% complete at {3}, estimated completion: {4}'\
-                          .format(vdisk, job, pct, eventtime, estcompletion.strftime("%Y-%m-%d %H:%M:%S")))
+            initialpct = pct; initialtime = eventtime
+            while (job == myjob):
+                estcompletion = estimate_completion(pct, eventtime,
+                                                    initialpct, initialtime)
+                yield sleep_async(self.poller.next_interval(
+                    [(False, estcompletion, eventtime)]))
+                job, pct, eventtime = yield self.get_job_pct_async(vdisk)
+                if verbose:
+                    print_progress(vdisk, job, pct, eventtime,
+                                   initialpct, initialtime, self.clock)
+        finally:
+            self.stop_stats()
+
+        raise Return(True)
+
+
+    def start_stats(self):
+        """Sample the array statistics every statsinterval seconds (in the
+        background) until stop_stats has been called as many times"""
+        #Waits on several vdisks share one sampler; it stops at its next
+        #sample after the last of them is done.
+        self.statswaiters += 1
+        if self.statsinterval <= 0 or not self.statscommands:
+            return
+        if self.statstask is None or self.statstask.done:
+            self.statstask = Task(EventLoop.current(),
+                                  self.stats_sampler_async())
+
+
+    def stop_stats(self):
+        self.statswaiters -= 1
+
+
+    def stats_sampler_async(self):
+        """Coroutine: add a statistics sample to self.stats every
+        statsinterval seconds while anything waits for a job"""
+        while self.statswaiters > 0:
+            try:
+                yield self.sample_stats_async()
+            except RuntimeError as e:
+                #e.g. a bundle without these commands; the test goes on
+                print "Stopped sampling statistics of {0}: {1}"\
+                      .format(self.name, e)
+                self.statsinterval = 0
+                break
+            yield sleep_async(self.statsinterval)
+
+
+    def sample_stats_async(self):
+        """Coroutine: run each of statscommands once, adding the rows to
+        self.stats at the array time of its reply"""
+        for kind, rawcmd in self.statscommands:
+            stdout = yield self.runcmd_async(rawcmd)
+            eventtime = None
+            for line in stdout.splitlines():
+                if self.rs.match(line):  # search for "Success"
+                    eventtime = self.get_eventtime(line)
+                    break
+            if not eventtime:
+                eventtime = self.clock.to_array()
+            self.stats.add_table(kind, stdout, eventtime, monotonic())
+
+
+    def classify_event(self, line):
+        """Return a dhevent for an event log line, None if not an event"""
+        return self.classifier.classify(line)
 
-        return True
+
+    def job_times(self, vdisk, after=None):
+        """Return the RCON and CPYBK start/end times of vdisk from the event
+        store as {'rconstart':, 'rconend':, 'cpybkstart':, 'cpybkend':}
+        """
+        #2016-06-01 19:08:14 [037] #A19784: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL Vdisk reconstruction started. (vdisk: vd01, SN: 00c0ff1bce3c000029452a5700000000) (disk: channel: 0, ID: 20, SN: KXGN1Z0R, enclosure: 0, slot: 20)
+        #2016-06-01 21:27:35 [018] #A19785: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL Reconstruction of a vdisk completed. (vdisk: vd01, SN: 00c0ff1bce3c000029452a5700000000)  
+        #2016-06-01 21:32:43 [499] #A19789: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL A disk copyback operation started. The indicated disk is the destination disk. (vdisk: vd01, SN: 00c0ff1bce3c000029452a5700000000) (to disk: channel: 0, ID: 0, SN: KPGJDL2F, enclosure: 0, slot: 0)
+        #2016-06-01 23:50:00 [500] #A19792: ... A disk copyback operation completed. (vdisk: vd01, ...)
+        #The latest start is used (earlier copyback starts may have failed)
+        #and the first completion after it.
+        times = {}
+        starts = self.events.find(vdisk, 'reconstructstart', after)
+        if not starts:
+            return times
+        times['rconstart'] = starts[-1].time
+        ends = self.events.find(vdisk, 'reconstructcomplete', times['rconstart'])
+        if not ends:
+            return times
+        times['rconend'] = ends[0].time
+        starts = self.events.find(vdisk, 'copybackstart', times['rconend'])
+        if not starts:
+            return times
+        times['cpybkstart'] = starts[-1].time
+        ends = self.events.find(vdisk, 'copybackcomplete', times['cpybkstart'])
+        if ends:
+            times['cpybkend'] = ends[0].time
+        return times
+
+
+    def disk_job_times(self, d, since=None):
+        """Return the RCON and CPYBK start/end times of disk d (by its
+        enclosure.slot) from the event store, as job_times does; since is
+        the first disk down of the test (default d's own down)
+        """
+        #2016-06-01 19:08:12 [008] ... A disk that was part of a vdisk is down. (disk: channel: 0, ID: 0, SN: KPGJDL2F, enclosure: 0, slot: 0)
+        #2016-06-01 19:08:12 [009] ... A spare disk was used in a vdisk to bring it back to a fault-tolerant state. (vdisk: vd01, ...) (disk: channel: 0, ID: 20, ..., enclosure: 0, slot: 20)
+        #2016-06-01 23:50:00 [500] ... A disk copyback operation completed. The indicated disk was restored to being a spare. (disk: ..., enclosure: 0, slot: 20)
+        #The spare logged right after d's down event is the disk that's
+        #reconstructed (its reconstruction started event names it), and
+        #copyback ends when that spare is restored. Reconstruction completed
+        #events only name the vdisk, so with two rebuilds on one vdisk they
+        #are matched to the starts in order. Without a down event for d
+        #(e.g. an older log) this is job_times of d's vdisk.
+        vdisk = d.vdisk
+        after = d.times.get('down')
+        location = (str(d.enclosure), str(d.slot))
+        def at(e):
+            return (e.enclosure, e.slot)
+        def order(e):
+            return (e.time, int(e.seq[1:]))
+        downs = [e for e in self.events.find(None, 'diskdown', after)
+                 if at(e) == location]
+        if not downs:
+            return self.job_times(vdisk, after)
+        down = after and downs[0] or downs[-1]
+        spares = [e for e in self.events.find(vdisk, 'spareused', down.time)
+                  if order(e) > order(down)]
+        if not spares:
+            return {}
+        spare = at(min(spares, key=order))
+        times = {}
+        allstarts = self.events.find(vdisk, 'reconstructstart',
+                                     since or down.time)
+        starts = [e for e in allstarts
+                  if e.time >= down.time and at(e) == spare]
+        if not starts:
+            return times
+        times['rconstart'] = starts[0].time
+        k = len([e for e in allstarts if order(e) < order(starts[0])])
+        ends = self.events.find(vdisk, 'reconstructcomplete', since or down.time)
+        if not ends or ends[-1].time < times['rconstart']:
+            return times
+        times['rconend'] = max(ends[min(k, len(ends) - 1)].time,
+                               times['rconstart'])
+        starts = [e for e in self.events.find(vdisk, 'copybackstart',
+                                              times['rconend'])
+                  if at(e) == location]
+        if not starts:
+            return times
+        times['cpybkstart'] = starts[-1].time
+        ends = [e for e in self.events.find(None, 'copybackspare',
+                                            times['cpybkstart'])
+                if at(e) == spare]
+        if not ends:
+            ends = self.events.find(vdisk, 'copybackcomplete',
+                                    times['cpybkstart'])
+        if ends:
+            times['cpybkend'] = ends[0].time
+        return times
 
 
     def get_drive_down_copyback_results(self, disklist = []):
         """Get drive reconstruction/copyback times from the event log
         """
+        return run_coroutine(self.get_drive_down_copyback_results_async(disklist))
+
+
+    def get_drive_down_copyback_results_async(self, disklist = []):
+        """Coroutine: get drive reconstruction/copyback times from the
+        event log
+        """
         # Tested on GL
-        numentries = self.defaultnumentries  #number of events to retrieve from log
-
-        vdisklist = []
-        reconstructcompletetime = {}
-        reconstructstarttime = {}
-        reconstruct_et = {}
-        copybackcompletetime = {}
-        copybackstarttime = {}
-        copyback_et = {}
         resultlist = []
 
+        since = first_down(disklist)
+        yield self.events.sync_async(since)
         for disk in disklist:
-            vdisklist.append(disk.vdisk)
+            vdisk = disk.vdisk
+            name = disk.location + ' ' + vdisk
+            #events before a disk was downed are from older tests
+            times = self.disk_job_times(disk, since)
+            source = 'event log'
+            errors = {}
+            if 'cpybkend' not in times:
+                #Fall back to the job start/end times seen while polling
+                polled = [k for k in ['rconstart', 'rconend', 'cpybkstart',
+                                      'cpybkend'] if k in disk.times]
+                if len(polled) == 4:
+                    print 'Error: did not find all expected events for {0}, '\
+                          'using polled times (+/- one poll interval)'\
+                          .format(name)
+                    times = disk.times
+                    errors = disk.errors
+                    source = 'polling'
+            if verbose:
+                for k in ['rconstart', 'rconend', 'cpybkstart', 'cpybkend']:
+                    if k in times:
+                        print '{0} {1} {2} {3}'.format(times[k], disk.location,
+                                                       vdisk, k)
+            if 'rconend' not in times:
+                print 'Error: Found recontstruction start without '\
+                      'reconstruction complete for {0}. Might need to '\
+                      'wait longer\n'.format(name)
+                continue
+            #Event times are whole array seconds; a polled time is late by
+            #up to one poll interval
+            reconstruct_et, reconstruct_err = self.clock.duration(
+                times['rconend'] - times['rconstart'],
+                errors.get('rconstart', 0) + errors.get('rconend', 0) + 1.0)
+            print '{0} reconstruction time: {1}\n'\
+                  .format(name, format_et(reconstruct_et, reconstruct_err))
+            if 'cpybkend' not in times:
+                print 'Error: Found copyback start without '\
+                      'copyback omplete for {0}. Might need to '\
+                      'wait longer.\n'.format(name)
+                continue
+            copyback_et, copyback_err = self.clock.duration(
+                times['cpybkend'] - times['cpybkstart'],
+                errors.get('cpybkstart', 0) + errors.get('cpybkend', 0) + 1.0)
+            print '{0} copyback time: {1}\n'\
+                  .format(name, format_et(copyback_et, copyback_err))
+            if debug >= 1: print '{0} times from {1}'.format(name, source)
+            resultlist.append(reconstructcopyback_et(vdisk, disk.location,
+                                                     reconstruct_et,
+                                                     copyback_et,
+                                                     reconstruct_err,
+                                                     copyback_err))
+        if verbose:
+            print '{0} clock: {1}'.format(self.name, self.clock.describe())
+        raise Return(resultlist)
+
+
+    def update_times_from_events(self, disk, since=None):
+        """Replace polled job times of disk with the event log times"""
+        return run_coroutine(self.update_times_from_events_async(disk, since))
+
+
+    def update_times_from_events_async(self, disk, since=None):
+        """Coroutine: replace polled job times of disk with the event log
+        times"""
+        yield self.events.sync_async(since)
+        times = self.disk_job_times(disk, since)
+        disk.times.update(times)
+        for key in times:
+            disk.errors.pop(key, None)
+
 
-        cmd = self.getrshcmd('show events last ' + str(numentries))
-        if debug >= 2: print "cmd = " + cmd
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        stdout, stderr = p.communicate()
+    def run_disktests(self, tests):
+        """Poll all vdisks together and step each DiskTest until all are done
+        """
+        return run_coroutine(self.run_disktests_async(tests))
+
+
+    def run_disktests_async(self, tests):
+        """Coroutine: poll all vdisks together and step each DiskTest until
+        all are done
+        """
+        #One show vdisks per poll covers every disk. A disk moves to its
+        #next step as soon as its own job changes, so one vdisk's copyback
+        #doesn't wait on another vdisk's reconstruction. The interval is
+        #the shortest one any of the disks needs. The array statistics are
+        #sampled meanwhile (start_stats). The event log is synced first so
+        #the events of the test are all newer than the store's last id.
+        yield self.events.sync_async()
+        self.start_stats()
+        try:
+            while True:
+                snapshot = yield self.get_vdisk_snapshot_async(maxage=0)
+                for test in tests:
+                    if test.finished:
+                        continue
+                    changed = yield test.step(self, snapshot)
+                    if changed and test.state in (DiskTest.WAITCPYBK,
+                                                  DiskTest.DONE):
+                        #a job just ended, use the event times instead of polled
+                        yield self.update_times_from_events_async(
+                            test.disk, first_down([t.disk for t in tests]))
+                if all(test.finished for test in tests):
+                    break
+                yield sleep_async(self.poller.next_interval(
+                    [test.wait for test in tests if not test.finished]))
+        finally:
+            self.stop_stats()
+        if verbose:
+            print 'Polled {0} times'.format(self.poller.polls)
+        raise Return(tests)
+
+
+    def start_vdisk_job_async(self, vdisk, job):
+        """Coroutine: start job (VRSC or VRFY) on vdisk, returns the array
+        time it started
+        """
+        ## scrub vdisk vd01
+        #Success: Command completed successfully. - Scrub was started on
+        #vdisk vd01. (2016-06-14 16:23:36)
+        if job not in self.jobcommands:
+            raise RuntimeError("Can't start {0} on {1}".format(job, self.name))
+        stdout = yield self.runcmd_async(self.jobcommands[job].format(vdisk))
         for line in stdout.splitlines():
             if debug >= 2: print line
-            #pdt = self.rdt.search(line)  #search for date/time
-            #if pdt:
-            #    year = pdt.group('yyyy')
-            #    month = pdt.group('mm')
-            #    day = pdt.group('dd')
-            #    hour = pdt.group('hour')
-            #    minute = pdt.group('minute')
-            #    second = pdt.group('second')
-            #    eventtime = datetime.datetime(int(year), int(month), int(day),
-            #                                int(hour), int(minute), int(second))
-            eventtime = self.get_eventtime(line)
-
-            prc = self.rrc.search(line)
-            prs = self.rrs.search(line)
-            pcc = self.rcc.search(line)
-            pcd = self.rcd.search(line)
-
-            if pcc:  # "A disk copyback operation completed"
-            #2016-06-01 23:50:00 [500] #A19792: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL A disk copyback operation completed. The indicated disk was restored to being a spare. (disk: channel: 0, ID: 20, SN: KXGN1Z0R, enclosure: 0, slot: 20)
-                pvd = self.rvd.search(line)
-                vdisk = pvd.group('vdisk')
-                if debug == 1: 
-                    print line
-                elif verbose:
-                    print ('{0} {1} copyback completed'.format(eventtime,vdisk))
-                if vdisk in vdisklist:
-                    copybackcompletetime[vdisk] = eventtime        
-            #elif pcd and not vdisk in copybackstarttime:  
-            elif pcd: # "A disk copyback operation started. The indicated disk is the destination disk."
-                #2016-06-01 21:32:43 [499] #A19789: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL A disk copyback operation started. The indicated disk is the destination disk. (vdisk: vd01, SN: 00c0ff1bce3c000029452a5700000000) (to disk: channel: 0, ID: 0, SN: KPGJDL2F, enclosure: 0, slot: 0)
-                pvd = self.rvd.search(line)
-                vdisk = pvd.group('vdisk')
-                # There can be more starts earlier if they failed so don't check 
-                # for any more if already found.
-                if not vdisk in copybackstarttime:
-                    pes = self.res.search(line)  #search for enclosure and slot
-                    enclosure = pes.group('enclosure')
-                    slot = pes.group('slot')
-                    if debug == 1: 
-                        print line
-                    elif verbose:
-                        print('{0} {1}.{2} {3} copyback started' \
-                            .format(eventtime, enclosure, slot, vdisk))
-                    if vdisk in vdisklist:
-                        copybackstarttime[vdisk] = eventtime        
-                        if vdisk in copybackcompletetime:
-                            copyback_et[vdisk] = (copybackcompletetime[vdisk]
-                                              - eventtime)
-                            print '{0} copyback time: {1}\n'\
-                                  .format(vdisk, copyback_et[vdisk])
-                        else:
-                            print 'Error: Found copyback start without '\
-                                  'copyback omplete for {0}. Might need to '\
-                                  'wait longer.\n'\
-                                  .format(vdisk)
-            elif prc:  # "Reconstruction of a vdisk completed."
-                #2016-06-01 21:27:35 [018] #A19785: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL Reconstruction of a vdisk completed. (vdisk: vd01, SN: 00c0ff1bce3c000029452a5700000000)  
-                pvd = self.rvd.search(line)  #search for vdisk
-                vdisk = pvd.group('vdisk')
-                if debug == 1: 
-                    print line
-                elif verbose:
-                    print('{0} {1} reconstruction completed'\
-                           .format(eventtime, vdisk))
-                if vdisk in vdisklist:
-                    reconstructcompletetime[vdisk] = eventtime        
-            elif prs:  # "Vdisk reconstruction started."
-            #2016-06-01 19:08:14 [037] #A19784: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL Vdisk reconstruction started. (vdisk: vd01, SN: 00c0ff1bce3c000029452a5700000000) (disk: channel: 0, ID: 20, SN: KXGN1Z0R, enclosure: 0, slot: 20)
-                pvd = self.rvd.search(line)  #search for vdisk
-                vdisk = pvd.group('vdisk')
-                pes = self.res.search(line)  #search for enclosure and slot
-                enclosure = pes.group('enclosure')
-                slot = pes.group('slot')
-                if debug == 1: 
-                    print line
-                elif verbose:
-                    print '{0} {1}.{2} {3} reconstruction started'\
-                          .format(eventtime, enclosure, slot, vdisk)
-                if vdisk in vdisklist:
-                    # At this point should have found copyback complete, 
-                    # copyback started, and reconstruction complete.
-                    reconstructstarttime[vdisk] = eventtime        
-                    if vdisk in reconstructcompletetime:
-                        reconstruct_et[vdisk] = (reconstructcompletetime[vdisk]
-                                              - eventtime)
-                        print '{0} reconstruction time: {1}\n'\
-                              .format(vdisk, reconstruct_et[vdisk])
-                        resultlist.append([reconstructcopyback_et, vdisk, 
-                                   reconstruct_et[vdisk], copyback_et[vdisk]])
-                    else:
-                        print 'Error: Found recontstruction start without '\
-                              'reconstruction complete for {0}. Might need to '\
-                              'wait longer\n'.format(vdisk)
-                    vdisklist.remove(vdisk)
-                    if len(vdisklist) == 0:  # Found all of them
+            if self.rs.match(line):  #search for Success
+                raise Return(self.get_eventtime(line) or self.clock.to_array())
+        raise RuntimeError("{0} {1} not started: {2}".format(
+            job, vdisk, stdout.strip()))
+
+
+    def vdisk_job_test(self, vdisks, job):
+        """Scrub (VRSC) or verify (VRFY) test of vdisks.
+        """
+        return run_coroutine(self.vdisk_job_test_async(vdisks, job))
+
+
+    def vdisk_job_test_async(self, vdisks, job):
+        """Coroutine: run job (VRSC or VRFY) on each of vdisks and time it,
+        returns a list of vdiskjob_et
+        """
+        #Every idle vdisk is started at once. If the array refuses one (too
+        #many utilities running) it is tried again after the next one ends.
+        #A job's end is between the last poll that showed it and the first
+        #that didn't, so the time is to the midpoint, +/- half that gap.
+        print '{0} of {1}'.format({'VRSC': 'Scrub', 'VRFY': 'Verify'}
+                                  .get(job, job), ', '.join(vdisks))
+        pending = list(vdisks)
+        running = {}   # vdisk -> {'start':, 'seen':, 'last':, 'pct':, ...}
+        refused = False   # the array refused the last start
+        results = []
+        self.start_stats()
+        try:
+            while pending or running:
+                snapshot = yield self.get_vdisk_snapshot_async(maxage=0)
+                now = snapshot.eventtime
+                for vdisk in sorted(running.keys()):
+                    r = running[vdisk]
+                    status = snapshot.vdisks[vdisk]
+                    if status.job == job:
+                        if not r['seen']:
+                            r['initialpct'] = status.pct
+                            r['initialtime'] = now
+                        r['seen'] = True
+                        r['last'] = now; r['pct'] = status.pct
+                        if verbose:
+                            print_progress(vdisk, job, status.pct, now,
+                                           r['initialpct'], r['initialtime'],
+                                           self.clock)
+                        continue
+                    if not r['seen'] and \
+                            seconds(now - r['start']) < self.jobstartgrace:
+                        continue
+                    gap = now - r['last']
+                    et, err = self.clock.duration(
+                        r['last'] + gap / 2 - r['start'],
+                        seconds(gap) / 2 + 1.0)
+                    mb = size_mb(status.size)
+                    mbs = mb and et > 0 and mb / et or None
+                    results.append(vdiskjob_et(vdisk, job, status.size, et,
+                                               err, mbs))
+                    print '{0} {1} complete: {2}{3}'.format(
+                        vdisk, job, format_et(et, err),
+                        mbs and ', {0:.1f} MB/s'.format(mbs) or '')
+                    del running[vdisk]
+                    refused = False
+                for vdisk in list(pending):
+                    if refused:
                         break
-        if len(vdisklist) != 0:
-            print 'Error: did not find all expected entries. '\
-                  'May need to read more entries\n'
-        return resultlist
+                    if snapshot.vdisks[vdisk].job != "Blank":
+                        continue   # busy with something else, wait
+                    try:
+                        start = yield self.start_vdisk_job_async(vdisk, job)
+                    except RuntimeError as e:
+                        if not running:
+                            raise
+                        if verbose: print '{0}, retrying later'.format(e)
+                        refused = True
+                        break
+                    pending.remove(vdisk)
+                    running[vdisk] = {'start': start, 'seen': False,
+                                      'last': start, 'pct': 0,
+                                      'initialpct': None, 'initialtime': None}
+                if not pending and not running:
+                    break
+                waits = [(not r['seen'],
+                          r['seen'] and estimate_completion(
+                              r['pct'], r['last'], r['initialpct'],
+                              r['initialtime']) or None, r['last'])
+                         for r in running.values()]
+                yield sleep_async(self.poller.next_interval(
+                    waits or [(True, None, None)]))
+        finally:
+            self.stop_stats()
+        results.sort(key=lambda r: vdisks.index(r.vdisk))
+        raise Return(results)
 
 
-    def drive_down_drive_copyback(self, disklist = []):
+    def drive_down_drive_copyback(self, disklist = [], stagger=0):
         """ Drive down, drive copyback test.
         """
-        #Check that drives are up and ready
-        #Input is a list of namedtuple disk
-        #Each disk will be downed. When the reconstructions are complete,
-        #the disk-metadata will be cleared. When the copybacks are complete,
-        #The completion times will be determined
-        #Note: Only one drive per vdisk can be tested. 
+        return run_coroutine(self.drive_down_drive_copyback_async(disklist,
+                                                                  stagger))
 
-        #Wait for disks ready
-        for disk in disklist:
-            vdisk = disk.vdisk
-            print 'Wait for vdisk ready ' + vdisk
-            self.wait_til_ready(vdisk)
-        print 'Vdisks ready'
 
-        #Down drives
+    def drive_down_drive_copyback_async(self, disklist = [], stagger=0):
+        """Coroutine: drive down, drive copyback test.
+        """
+        #Input is a list of disk
+        #Each disk is downed as soon as its vdisk is ready. When its
+        #reconstruction is complete, its disk-metadata is cleared. When all
+        #the copybacks are complete, the completion times are determined.
+        #More disks of the same vdisk (a RAID6 can lose two) are downed
+        #stagger array seconds after the one before, during its rebuild.
+        print 'Drive down/copyback of ' \
+              + ', '.join([d.location + ' ' + d.vdisk for d in disklist])
+        tests = []
+        last = {}   # vdisk -> its latest DiskTest
         for disk in disklist:
-            print 'Down disk {0}.{1} {2}'\
-                  .format(str(disk.enclosure), str(disk.slot), disk.vdisk)
-            try:
-                self.down_disk(disk)
-            except RuntimeError as e:
-                print '%s\n' % e
+            if disk.vdisk in last:
+                test = DiskTest(disk, last[disk.vdisk], stagger)
             else:
-                print "success"
+                test = DiskTest(disk)
+            last[disk.vdisk] = test
+            tests.append(test)
+        tests = yield self.run_disktests_async(tests)
+        for test in tests:
+            if test.state == DiskTest.FAILED:
+                print 'Disk {0} {1} failed, no times'\
+                      .format(test.disk.location, test.disk.vdisk)
+        print 'Copyback complete'
 
-        #Wait for reconstruction to complete
-        for disk in disklist:
-            vdisk = disk.vdisk
-            print 'Wait for reconstruction of vdisk ' + vdisk
-            self.wait_for_job(vdisk,"RCON")
-        print 'Reconstruction complete'
+        #Get reconstruction and copyback times
+        results = yield self.get_drive_down_copyback_results_async(
+            [test.disk for test in tests if test.state == DiskTest.DONE])
+        raise Return(results)
 
-        #Clear disk-metadata
-        for disk in disklist:
-            enclosure = disk.enclosure; drive = disk.slot; vdisk = disk.vdisk
-            print 'Clear disk_metadata {0}.{1} {2}' \
-                  .format(str(enclosure), str(drive), vdisk)
+###End of Class DotHillArrayGL###
+
+
+################################################################################
+#NetApp E-Series through SMcli
+def smcli_blocks(output, headers):
+    """Split SMcli output into [(kind, header match, {field: value})], a
+    block per header line; headers is [(kind, compiled regex)]"""
+    #e.g. show allDrives;
+    #   Drive at Tray 0, Slot 1
+    #      Status:                     Optimal
+    #      Mode:                       Assigned
+    #      Raw capacity:               558.912 GB
+    #      Volume group:               1
+    #Field names are lowercased; the first of a repeated field is kept.
+    rfield = re.compile('^\s*([A-Za-z][\w /()-]*?):\s+(\S.*?)\s*$')
+    blocks = []
+    for line in output.splitlines():
+        for kind, rheader in headers:
+            m = rheader.match(line)
+            if m:
+                blocks.append((kind, m, {}))
+                break
+        else:
+            f = rfield.match(line)
+            if f and blocks:
+                blocks[-1][2].setdefault(f.group(1).lower(), f.group(2))
+    return blocks
+
+
+def smcli_size(size):
+    """Return an SMcli capacity such as 1,117.865 GB as a DotHill style size
+    (1117.865GB)"""
+    return size.replace(',', '').replace(' ', '')
+
+
+class NetAppEventClassifier:
+    """Turn NetApp major event log (MEL) records into dhevent records.
+    """
+    #save storageArray allEvents writes records such as
+    #    Date/Time: 6/1/16 7:08:14 PM
+    #    Sequence number: 19784
+    #    Event type: 2026
+    #    Description: Reconstruction started
+    #    ...
+    #    Component type: Drive
+    #    Component location: Tray 0, Slot 5
+    #    Logged by: Controller in slot A
+    #NetAppEventStore keeps each as one line in the DotHill layout,
+    #    2016-06-01 19:08:14 [2026] #A19784: Reconstruction started (Tray 0, Slot 5)
+    #which is what classify() reads. The descriptions vary with the
+    #firmware, so kinds are matched by pattern, the first match wins.
+    patterns = [
+        ('copybackfailed', 'copyback.*fail'),
+        ('copybackstart', 'copyback.*start'),
+        ('copybackcomplete', 'copyback.*(complete|finish)'),
+        ('reconstructstart', 'reconstruction.*start'),
+        ('reconstructcomplete', 'reconstruction.*(complete|finish)'),
+        ('spareused', 'hot spare.*(in use|taken over)'),
+        ('diskdown', 'drive.*fail'),
+    ]
+    timeformats = ['%m/%d/%y %I:%M:%S %p', '%m/%d/%Y %I:%M:%S %p',
+                   '%m/%d/%y %H:%M:%S', '%m/%d/%Y %H:%M:%S']
+    rline = re.compile('(\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d) \[(\w*)\] '
+                       '#(\w\d+): (.*?)(?: \((.*)\))?$')
+    rlocation = re.compile('(?:Tray|Enclosure|Shelf) (\d+),(?: Drawer \d+,)? '
+                           'Slot (\d+)', re.IGNORECASE)
+    rvolumegroup = re.compile('Volume group(?::\s*| ")([^",)]+)', re.IGNORECASE)
+    rcontroller = re.compile('slot (\w)\s*$', re.IGNORECASE)
+
+    def __init__(self):
+        self.kinds = [(kind, re.compile(pattern, re.IGNORECASE))
+                      for kind, pattern in self.patterns]
+
+    def line(self, datetimetext, fields):
+        """Return the one-line form of a MEL record, None if its time or
+        sequence number can't be read"""
+        eventtime = None
+        for timeformat in self.timeformats:
             try:
-                self.clear_disk(disk)
-            except RuntimeError as e:
-                print '%s\n' % e
-            else:
-                print "success"
+                eventtime = datetime.datetime.strptime(datetimetext, timeformat)
+                break
+            except ValueError:
+                pass
+        seq = fields.get('sequence number', '').replace(',', '')
+        if eventtime is None or not seq.isdigit():
+            return None
+        m = self.rcontroller.search(fields.get('logged by', ''))
+        controller = m and m.group(1).upper() or 'A'
+        line = '{0} [{1}] #{2}{3}: {4}'.format(
+            eventtime.strftime("%Y-%m-%d %H:%M:%S"),
+            fields.get('event type', ''), controller, seq,
+            fields.get('description', ''))
+        if 'component location' in fields:
+            line += ' ({0})'.format(fields['component location'])
+        return line
 
-        #Wait for copyback to complete
-        for disk in disklist:
-            vdisk = disk.vdisk
-            print 'Wait for copyback for vdisk ' + vdisk
-            self.wait_for_job(vdisk,"CPYBK")
-        print 'Copyback complete'
+    def classify(self, line):
+        """Return a dhevent for line, None if it isn't an event"""
+        m = self.rline.match(line)
+        if not m:
+            return None
+        timetext, code, seq, description, params = m.groups()
+        eventtime = datetime.datetime.strptime(timetext, "%Y-%m-%d %H:%M:%S")
+        kind = 'other'
+        for k, rkind in self.kinds:
+            if rkind.search(description):
+                kind = k
+                break
+        vdisk = enclosure = slot = None
+        mvg = params and self.rvolumegroup.search(params)
+        if mvg:
+            vdisk = mvg.group(1).strip()
+        mes = params and self.rlocation.search(params)
+        if mes:
+            enclosure, slot = [str(int(n)) for n in mes.groups()]
+        return dhevent(eventtime, seq, vdisk, enclosure, slot, kind, line)
+###End of Class NetAppEventClassifier###
 
 
-        #Get reconstruction and copyback times
-        #return self.get_drive_down_copyback_results(disk)
-        return self.get_drive_down_copyback_results(disklist)
+class NetAppEventStore(EventStore):
+    """EventStore filled from the NetApp MEL instead of show events.
+    """
+    #SMcli saves the newest numentries events to a file on this host; they
+    #are read back, made into one line each (NetAppEventClassifier.line)
+    #and stored and indexed like DotHill events.
+    rrecord = re.compile('\s*Date/Time:\s*(.*?)\s*$')
 
-###End of Class DotHillArrayGL###
+    def fetch_async(self, numentries):
+        """Coroutine: returns (events newer than the cursor oldest first,
+        True if the window reached events already seen for every controller)"""
+        path = os.path.abspath(self.path + '.mel')
+        yield self.array.runcmd_async('save storageArray allEvents file="{0}" '
+                                      'count={1};'.format(path, numentries))
+        with open(path, 'r') as f:
+            text = f.read()
+        os.remove(path)
+        new = []
+        reached = {}
+        seen = {}
+        blocks = smcli_blocks(text, [('event', self.rrecord)])
+        events = []
+        for kind, m, fields in blocks:
+            line = self.array.classifier.line(m.group(1), fields)
+            event = line and self.array.classify_event(line)
+            if event:
+                events.append(event)
+        #newest first, as show events lists them
+        events.sort(key=lambda e: (e.time, int(e.seq[1:])), reverse=True)
+        for event in events:
+            if debug >= 2: print event.line
+            ctl = event.seq[0]
+            seen[ctl] = True
+            if ctl in reached:
+                continue
+            if self.stored(event):
+                reached[ctl] = True
+                continue
+            new.append(event)
+        new.reverse()
+        complete = (len(blocks) < numentries
+                    or (reached and len(reached) == len(seen)))
+        raise Return((new, complete))
+###End of Class NetAppEventStore###
+
+
+class NetAppSnapshot(VdiskSnapshot):
+    """Status of every volume group from one show storageArray
+    longRunningOperations.
+    """
+    #LOGICAL DEVICES  OPERATION       STATUS         TIME REMAINING
+    #Volume_1         Reconstruction  35% Completed  00:22 hr:min
+    #Operations are listed per volume (or volume group); a volume group's
+    #job is the least complete one of its volumes, named as on a DotHill so
+    #DiskTest works unchanged.
+    rlro = re.compile('^\s*(?P<name>\S+)\s+(?P<op>[A-Za-z][A-Za-z ]*?)\s+'
+                      '(?P<pct>\d+)%\s+Completed', re.IGNORECASE)
+    jobs = [('reconstruct', 'RCON'), ('copyback', 'CPYBK'),
+            ('initializ', 'INIT'), ('format', 'INIT'), ('expan', 'EXPD'),
+            ('defrag', 'EXPD'), ('parity', 'VRFY')]
+
+    def __init__(self, output, eventtime, topology):
+        self.topology = topology
+        VdiskSnapshot.__init__(self, output, eventtime)
+
+    def jobname(self, operation):
+        for word, job in self.jobs:
+            if word in operation.lower():
+                return job
+        return operation.split()[0].upper()
+
+    def parse(self, output):
+        """Return {volume group: vdiskstatus} from longRunningOperations"""
+        groupof = {}
+        for name, vdisk in self.topology.vdisks.items():
+            groupof[name] = name
+            for volume in vdisk.get('volumes', []):
+                groupof[volume] = name
+        running = {}   # volume group -> (job, pct)
+        for line in output.splitlines():
+            m = self.rlro.match(line)
+            if not m or m.group('name') not in groupof:
+                continue
+            group = groupof[m.group('name')]
+            pct = int(m.group('pct'))
+            if group not in running or pct < running[group][1]:
+                running[group] = (self.jobname(m.group('op')), pct)
+        vdisks = {}
+        for name, vdisk in self.topology.vdisks.items():
+            job, pct = running.get(name, ("Blank", 100))
+            vdisks[name] = vdiskstatus(name, vdisk['size'], vdisk['raid'],
+                                       'N/A', job, pct, 'N/A')
+        return vdisks
+###End of Class NetAppSnapshot###
+
+
+class HostClock(ArrayClock):
+    """ArrayClock of an array whose clock is set from this host.
+    """
+    #SMcli replies carry no array time, so NetAppArraySM sets the controller
+    #clocks from this host (set storageArray time;) and array times are
+    #local times.
+    def add_reply(self, output, sent, received, sentmono, receivedmono):
+        return None
+
+    def to_local(self, arraytime):
+        return arraytime
+
+    def to_array(self, localtime=None):
+        if localtime is None:
+            localtime = time.time()
+        return datetime.datetime.fromtimestamp(localtime)
+
+    def describe(self):
+        return "set from this host"
+###End of Class HostClock###
+
+
+class NetAppArraySM(DotHillArrayGL):
+    """Drive down/copyback tests on a NetApp E-Series array through SMcli.
+    """
+    #The same operations as DotHillArrayGL, so DiskTest, the polling and
+    #the results are shared:
+    #  down disk           -> set drive [<tray>,<slot>] operationalState=failed;
+    #  RCON                -> Reconstruction in longRunningOperations
+    #  clear disk-metadata -> revive drive [<tray>,<slot>]; (copyback to it)
+    #  CPYBK               -> Copyback in longRunningOperations
+    #  show events         -> save storageArray allEvents (NetAppEventStore)
+    #Volume groups take the place of vdisks. SMcli takes seconds to start, so
+    #the commands sent in one pass of the EventLoop are batched into one
+    #SMcli script: a poll, or connecting, is one SMcli call however many
+    #coroutines are waiting on it. SMcli stops a script at the first command
+    #that fails, after running the ones before it, so only read-only
+    #commands are batched: a failed batch is sent again one command at a
+    #time and the error goes to the command that caused it. A command that
+    #changes the array is sent in a script of its own, once.
+    clockclass = HostClock
+    classifierclass = NetAppEventClassifier
+    eventstoreclass = NetAppEventStore
+    settime = True           # set the controller clocks from this host
+    statscommands = []       # SMcli performance statistics aren't sampled
+    jobcommands = {}         # no scrub/verify tests (check volume parity
+                             # runs in the foreground)
+    readonlycommands = ('show ', 'save ')
+    jobpriorities = ['lowest', 'low', 'medium', 'high', 'highest']
+
+    #show storageArray summary patterns:
+    rversion = re.compile('(?:Current )?(?:Package|Firmware) version:\s*(\S+)',
+                          re.IGNORECASE)
+    rserial = re.compile('Chassis serial number:\s*(\S+)', re.IGNORECASE)
+    rproduct = re.compile('(?:Board|Product) ID:\s*(\S+)', re.IGNORECASE)
+    #show allDrives; show allVolumes; block headers
+    topologyheaders = [
+        ('drive', re.compile('\s*Drive at (?:Tray|Enclosure|Shelf) (\d+),'
+                             '(?: Drawer \d+,)? Slot (\d+)', re.IGNORECASE)),
+        ('volume', re.compile('\s*Volume name:\s*(\S+)', re.IGNORECASE))]
+    groupfields = ['volume group', 'associated volume group',
+                   'current volume group']
+
+
+    def __init__(self, name, connect=True):
+        self.batch = []   # (script command, Future, monotonic()) to send
+        self.version = self.scsiproductid = None
+        DotHillArrayGL.__init__(self, name, connect)
+
+
+    def connect_async(self):
+        """Coroutine: set the array clock, get the firmware version, serial
+        number and Topology (one SMcli call)"""
+        commands = ['show storageArray summary;']
+        if self.settime:
+            commands.insert(0, 'set storageArray time;')
+        results = yield [self.runcmd_async(c) for c in commands] \
+            + [self.get_topology_async()]
+        summary = results[len(commands) - 1]
+        for attr, regex, default in [('version', self.rversion, 'unknown'),
+                                     ('serial', self.rserial, self.name),
+                                     ('scsiproductid', self.rproduct,
+                                      'E-Series')]:
+            m = regex.search(summary)
+            setattr(self, attr, m and m.group(1) or default)
+        path = Topology.filename(self.topologydir, self.serial, self.version)
+        self.topology.serial = self.serial
+        self.topology.version = self.version
+        self.topology.save(path)
+        if verbose: print "Saved " + path
+
+
+    def runcmd_async(self, rawcmd):
+        """Coroutine: run an SMcli script command (ending in ;), returns the
+        output of the SMcli call it was sent in (batched with other
+        read-only commands).
+        """
+        future = Future()
+        entry = (rawcmd, future, monotonic())
+        if not rawcmd.startswith(self.readonlycommands):
+            EventLoop.current().future(self.sendbatch_async([entry]))
+        else:
+            self.batch.append(entry)
+            if len(self.batch) == 1:
+                #after the coroutines that are ready have run (and sent theirs)
+                EventLoop.current().call_later(0, self.flush)
+        output = yield future
+        raise Return(output)
+
+
+    def flush(self):
+        batch, self.batch = self.batch, []
+        EventLoop.current().future(self.sendbatch_async(batch))
+
+
+    def sendbatch_async(self, batch):
+        """Coroutine: send the commands of batch as one SMcli script"""
+        loop = EventLoop.current()
+        jobs = None
+        if self.snapshot is not None:
+            jobs = len([v for v in self.snapshot.vdisks.values()
+                        if v.job != "Blank"])
+        yield self.cmdlimit.acquire()
+        sendmono = monotonic()
+        output = error = None
+        try:
+            session = loop.session(self.name, None,
+                                   sessionclass=AsyncSMcliSession)
+            output = yield session.send(' '.join([c for c, f, q in batch]))
+        except SessionError:
+            error = sys.exc_info()
+        finally:
+            self.cmdlimit.release()
+        et = monotonic() - sendmono
+        for rawcmd, future, queued in batch:
+            self.cmdstats.record(rawcmd, '', et, output is not None,
+                                 sendmono - queued, jobs)
+        if output is None and len(batch) > 1:
+            if debug >= 1:
+                print "SMcli script failed, sending its {0} commands one "\
+                      "at a time".format(len(batch))
+            yield [self.sendbatch_async([entry]) for entry in batch]
+        elif output is None:
+            batch[0][1].set_exception(error)
+        else:
+            for rawcmd, future, queued in batch:
+                future.set_result(output)
+
+
+    def down_disk_async(self, disk):
+        """Coroutine: fail the specified drive.
+        """
+        yield self.runcmd_async('set drive [{0},{1}] operationalState=failed;'
+                                .format(disk.enclosure, disk.slot))
+        raise Return(True)
+
+
+    def clear_disk_async(self, disk):
+        """Coroutine: revive the failed drive, so the hot spare is copied back
+        to it.
+        """
+        yield self.runcmd_async('revive drive [{0},{1}];'
+                                .format(disk.enclosure, disk.slot))
+        raise Return(True)
+
+
+    def fetch_snapshot_async(self):
+        """Coroutine: run show storageArray longRunningOperations, returns
+        the new self.snapshot"""
+        try:
+            topology = yield self.get_topology_async()
+            stdout = yield self.runcmd_async(
+                'show storageArray longRunningOperations;')
+        finally:
+            self.snapshotfetch = None
+        self.snapshot = NetAppSnapshot(stdout, self.clock.to_array(), topology)
+        self.record_samples(self.snapshot)
+        raise Return(self.snapshot)
+
+
+    def get_topology_async(self):
+        """Coroutine: returns the Topology of this array (the volume groups
+        and their drives), discovered when connecting
+        """
+        if self.topology is None:
+            outputs = yield [self.runcmd_async('show allDrives;'),
+                             self.runcmd_async('show allVolumes;')]
+            #one output when both went in the same SMcli call, two when a
+            #failed batch was sent again one command at a time
+            unique = []
+            for output in outputs:
+                if output not in unique:
+                    unique.append(output)
+            self.topology = self.parse_topology('\n'.join(unique))
+        raise Return(self.topology)
+
+
+    def get_job_priority_async(self):
+        """Coroutine: returns the modification priority of the first volume
+        """
+        stdout = yield self.runcmd_async('show allVolumes;')
+        for kind, m, fields in smcli_blocks(stdout, self.topologyheaders):
+            if fields.get('modification priority'):
+                raise Return(fields['modification priority'].lower())
+        raise RuntimeError("Couldn't get the modification priority.")
+
+
+    def set_job_priority_async(self, priority):
+        """Coroutine: set the modification priority of every volume
+        (lowest, low, medium, high or highest)
+        """
+        yield self.runcmd_async('set allVolumes modificationPriority='
+                                + priority + ';')
+        raise Return(True)
+
+
+    def save_job_priority_async(self):
+        """Coroutine: returns {volume: modification priority}, to be put
+        back by restore_job_priority_async
+        """
+        stdout = yield self.runcmd_async('show allVolumes;')
+        saved = {}
+        for kind, m, fields in smcli_blocks(stdout, self.topologyheaders):
+            if kind == 'volume' and fields.get('modification priority'):
+                saved[m.group(1)] = fields['modification priority'].lower()
+        if not saved:
+            raise RuntimeError("Couldn't get the modification priorities.")
+        raise Return(saved)
+
+
+    def restore_job_priority_async(self, saved):
+        """Coroutine: put back the modification priority of each volume
+        from save_job_priority_async
+        """
+        #one command if they were all the same, else one per volume (each
+        #its own SMcli call, as they change the array)
+        if len(set(saved.values())) == 1:
+            yield self.set_job_priority_async(saved.values()[0])
+            raise Return(True)
+        for volume in sorted(saved):
+            yield self.runcmd_async('set volume ["{0}"] modificationPriority='
+                                    '{1};'.format(volume, saved[volume]))
+        raise Return(True)
+
+
+    def describe_job_priority(self, saved):
+        if len(set(saved.values())) == 1:
+            return saved.values()[0]
+        return ', '.join(['{0} {1}'.format(v, saved[v]) for v in sorted(saved)])
+
+
+    def parse_topology(self, output):
+        """Return the Topology in show allDrives and show allVolumes output
+        """
+        topology = Topology(self.serial, self.version)
+        groups = {}   # volume group -> {'raid':, 'sizemb':, 'volumes':}
+        for kind, m, fields in smcli_blocks(output, self.topologyheaders):
+            group = None
+            for key in self.groupfields:
+                if fields.get(key, 'None') not in ('None', 'N/A', ''):
+                    group = fields[key].strip('"')
+                    break
+            if kind == 'drive':
+                location = '{0}.{1}'.format(int(m.group(1)), int(m.group(2)))
+                mode = (fields.get('mode', '') + ' '
+                        + fields.get('role', '')).lower()
+                if 'hot spare' in mode:
+                    use = 'GLOBAL SP'
+                elif group:
+                    use = 'VDISK'
+                else:
+                    use = 'AVAIL'
+                topology.disks[location] = {
+                    'serial': fields.get('serial number', ''), 'use': use,
+                    'size': smcli_size(fields.get('raw capacity', '')),
+                    'health': fields.get('status', ''),
+                    'vdisk': use == 'VDISK' and group or None}
+            elif group:
+                vg = groups.setdefault(group, {'raid': '', 'sizemb': 0.0,
+                                               'volumes': []})
+                vg['volumes'].append(m.group(1))
+                if fields.get('raid level'):
+                    vg['raid'] = 'RAID' + fields['raid level']
+                vg['sizemb'] += size_mb(smcli_size(fields.get('capacity', ''))) \
+                    or 0.0
+        for name, vg in groups.items():
+            members = sorted([l for l, d in topology.disks.items()
+                              if d['vdisk'] == name], key=location_key)
+            topology.vdisks[name] = {'raid': vg['raid'],
+                                     'size': '{0:.1f}GB'.format(vg['sizemb'] / 1e3),
+                                     'disks': members,
+                                     'volumes': vg['volumes']}
+        return topology
+
+
+    def get_job_pct_async(self, vdisk):
+        """Coroutine: returns (job, completion%, array time) of the current
+        job for the specified volume group.
+        """
+        snapshot = yield self.get_vdisk_snapshot_async()
+        if vdisk not in snapshot.vdisks:
+            raise RuntimeError("volume group " + vdisk + " not found")
+        status = snapshot.vdisks[vdisk]
+        self.job = status.job
+        self.pct = status.pct
+        raise Return((self.job, self.pct, snapshot.eventtime))
+
+
+    def disk_job_times(self, d, since=None):
+        """Return the RCON and CPYBK start/end times of disk d from the MEL
+        as {'rconstart':, 'rconend':, 'cpybkstart':, 'cpybkend':}
+        """
+        #MEL events name the drive or its volume group, not the hot spare,
+        #so each is the first event of its kind for either after the one
+        #before.
+        location = (str(d.enclosure), str(d.slot))
+        def first(kind, after):
+            for e in self.events.find_kind(kind, after):
+                if (e.enclosure, e.slot) == location or e.vdisk == d.vdisk:
+                    return e.time
+            return None
+        times = {}
+        after = d.times.get('down') or since
+        for key, kind in [('rconstart', 'reconstructstart'),
+                          ('rconend', 'reconstructcomplete'),
+                          ('cpybkstart', 'copybackstart'),
+                          ('cpybkend', 'copybackcomplete')]:
+            after = first(kind, after)
+            if after is None:
+                break
+            times[key] = after
+        return times
+###End of Class NetAppArraySM###
+
+
+def array_backend(backend='auto'):
+    """Return the array class for backend: 'dothill', 'netapp' or 'auto'
+    (NetApp if savesysteminfo.isnetapp() finds SMcli arrays)"""
+    if backend == 'auto':
+        import savesysteminfo
+        savesysteminfo.quiet = True
+        savesysteminfo.verbose = False
+        savesysteminfo.debug = False
+        backend = savesysteminfo.isnetapp() and 'netapp' or 'dothill'
+    return {'dothill': DotHillArrayGL, 'netapp': NetAppArraySM}[backend]
 ################################################################################
-        
-    
-#Use "show vdisks" to show all vdisks in the array
-#Use "show disk vdisk <vdisk>" to show the disks used by a vdisk
+#-t test -> the names of its runs, in order
+testruns = {1: ["1down1back"], 2: ["2down2back"],
+            3: ["1down1back", "2down2back"], 4: ["alldownallback"],
+            5: ["raid6single", "raid6double"], 6: ["scrub"], 7: ["verify"]}
+vdiskjobruns = {"scrub": 'VRSC', "verify": 'VRFY'}   # run -> its vdisk job
+
+
+def run_drive_tests(array, plan, test):
+    """Run drive test 0-7 on array using the disks in plan, return a list of
+    (test name, [reconstructcopyback_et or vdiskjob_et])"""
+    return run_coroutine(run_drive_tests_async(array, plan, test))
+
+
+def pick_plan_async(array, test):
+    """Coroutine: returns a plan for test picked from the array's Topology
+    """
+    topology = yield array.get_topology_async()
+    if verbose: print topology.describe()
+    raid6disks = array.raid6disks
+    if test == 5:
+        raid6disks = max(2, raid6disks)
+    plan = topology.select(raid6disks)
+    print "Plan for {0}: {1}".format(array.name, ', '.join(
+        ['{0}.{1} {2}'.format(e, s, v) for (e, s, v) in plan]))
+    raise Return(plan)
+
+
+def run_drive_tests_async(array, plan, test):
+    """Coroutine: run drive test 0-7 on array using the disks in plan (None
+    to pick them from the array's Topology), returns a list of
+    (test name, [reconstructcopyback_et or vdiskjob_et])"""
+    #test 1 uses the first disk in the plan, test 2 the first two, test 4
+    #the first disk of every vdisk (as many as there are spares), test 5
+    #the first vdisk with two disks in the plan: one of them alone, then
+    #both (the second stagger array seconds after the first). Tests 6 and 7
+    #scrub or verify every vdisk in the plan (no disks are downed).
+    results = []
+    if plan is None:
+        plan = yield pick_plan_async(array, test)
+    if test == 0:
+        enclosure, slot, vdisk = plan[0]
+        print "Wait for copyback"
+        yield array.wait_for_job_async(vdisk, "CPYBK")
+        times = yield array.get_drive_down_copyback_results_async(
+            [disk(enclosure, slot, vdisk)])
+        results.append(("wait_for_copy", times))
+        raise Return(results)
+
+    ran = {}
+    for run in testruns.get(test, []):
+        if run in vdiskjobruns:
+            vdisks = []
+            for (e, s, v) in plan:
+                if v not in vdisks:
+                    vdisks.append(v)
+            times = yield array.vdisk_job_test_async(vdisks,
+                                                     vdiskjobruns[run])
+            results.append((run, times))
+            continue
+        if run == "1down1back":
+            print "Starting one drive down, one drive copyback test"
+            disks = plan[:1]
+        elif run == "2down2back":
+            print "Starting two drives down, two drives copyback"
+            disks = plan[:2]
+        elif run in ("raid6single", "raid6double"):
+            disks = double_failure_pair(plan, array.topology)
+            if run == "raid6single":
+                disks = disks[:1]
+                print "Starting one drive down of {0}, one drive copyback "\
+                      "(single-disk baseline)".format(disks[0][2])
+            else:
+                print "Starting two drives down of {0}, two drives copyback"\
+                      " ({1})".format(disks[0][2], array.stagger and
+                                      "staggered {0}s".format(array.stagger)
+                                      or "at once")
+        else:
+            disks = []
+            for entry in plan:
+                if entry[2] not in [v for (e, s, v) in disks]:
+                    disks.append(entry)
+            if array.topology:
+                disks = disks[:len(array.topology.spares)]
+            print "Starting {0} drives down, {0} drives copyback (every vdisk)"\
+                  .format(len(disks))
+        #new disk objects each run so times from an earlier run aren't used
+        disklist = [disk(e, s, v) for (e, s, v) in disks]
+        times = yield array.drive_down_drive_copyback_async(disklist,
+                                                            array.stagger)
+        results.append((run, times))
+        ran[run] = disklist
+    if "raid6single" in ran and "raid6double" in ran:
+        print_overlap(array, ran["raid6single"], ran["raid6double"])
+    raise Return(results)
+
+
+def double_failure_pair(plan, topology=None):
+    """Return the first two plan entries of one vdisk, preferring a RAID6
+    vdisk if the Topology is known"""
+    byvdisk = {}
+    order = []
+    for entry in plan:
+        if entry[2] not in byvdisk:
+            order.append(entry[2])
+        byvdisk.setdefault(entry[2], []).append(entry)
+    candidates = [v for v in order if len(byvdisk[v]) >= 2]
+    if topology:
+        raid6 = [v for v in candidates
+                 if topology.vdisks.get(v, {}).get('raid') == 'RAID6']
+        candidates = raid6 or candidates
+    if not candidates:
+        raise RuntimeError("No vdisk with two disks in the plan (use a "
+                           "RAID6 vdisk and --raid6disks 2)")
+    return byvdisk[candidates[0]][:2]
+
+
+def print_overlap(array, single, double):
+    """Compare the overlapping rebuild of the disks in double with the
+    single-disk rebuild in single (lists of disk)"""
+    #The rebuild window runs from the first reconstruction start to the last
+    #reconstruction end; throughput is the disk capacity rebuilt per second.
+    keys = ['rconstart', 'rconend']
+    if [d for d in single + double if not all([k in d.times for k in keys])]:
+        print 'Error: missing reconstruction times, no overlap comparison'
+        return
+    def size(d):
+        if array.topology and d.location in array.topology.disks:
+            return size_mb(array.topology.disks[d.location]['size'])
+        return None
+    def rate(disks, et):
+        sizes = [size(d) for d in disks]
+        if None in sizes or et <= 0:
+            return ''
+        return ', {0:.1f} MB/s'.format(sum(sizes) / et)
+    d0 = single[0]
+    single_et, single_err = array.clock.duration(
+        d0.times['rconend'] - d0.times['rconstart'], 1.0)
+    start = min([d.times['rconstart'] for d in double])
+    end = max([d.times['rconend'] for d in double])
+    window, window_err = array.clock.duration(end - start, 1.0)
+    print 'Overlapping rebuild of {0} ({1}): window {2}{3}'.format(
+        double[0].vdisk, ' '.join([d.location for d in double]),
+        format_et(window, window_err), rate(double, window))
+    for d in double:
+        et, err = array.clock.duration(d.times['rconend'] - d.times['rconstart'],
+                                       1.0)
+        print '    {0}: {1}'.format(d.location, format_et(et, err))
+    print 'Single-disk rebuild of {0} ({1}): {2}{3}'.format(
+        d0.vdisk, d0.location, format_et(single_et, single_err),
+        rate(single, single_et))
+    if single_et > 0:
+        print '{0} disks rebuilt in {1:.2f}x the single-disk time'\
+              .format(len(double), window / single_et)
+
+
+def run_priority_sweep_async(array, plan, test, priorities):
+    """Coroutine: run drive test 1-7 on array once at each job priority in
+    priorities, returns a list of sweeprun"""
+    #Each priority is set just before its runs and the array's own priority
+    #is put back after them, even if a run fails, so a sweep never leaves
+    #an array at a test setting. Test 3 is its 1down1back and 2down2back
+    #runs, each with its own host/CPU window. The disks come from the same
+    #plan every time so the runs differ only in priority.
+    if plan is None:
+        plan = yield pick_plan_async(array, test)
+    elif array.topology is None:
+        yield array.get_topology_async()   # disk sizes for the rates
+    original = yield array.save_job_priority_async()
+    print "Job priority of {0}: {1}, sweeping {2}".format(
+        array.name, array.describe_job_priority(original),
+        ", ".join(priorities))
+    tests = {3: [1, 2]}.get(test, [test])
+    runs = []
+    for priority in priorities:
+        yield array.set_job_priority_async(priority)
+        results = []
+        try:
+            print "Job priority {0} on {1}".format(priority, array.name)
+            for t in tests:
+                start = array_seconds(array.clock.to_array())
+                done = yield run_drive_tests_async(array, plan, t)
+                end = array_seconds(array.clock.to_array())
+                results.extend([(testname, times, start, end)
+                                for testname, times in done])
+        finally:
+            yield array.restore_job_priority_async(original)
+        for testname, times, start, end in results:
+            rates = []
+            for r in times:
+                disks = array.topology and array.topology.disks or {}
+                if isinstance(r, vdiskjob_et):
+                    if r.mbs is not None:
+                        rates.append(r.mbs)
+                elif r.location in disks and r.reconstruct_et > 0:
+                    rates.append(size_mb(disks[r.location]['size'])
+                                 / r.reconstruct_et)
+            runs.append(sweeprun(array.name, priority, testname, times,
+                                 rates and sum(rates) / len(rates) or None,
+                                 array.stats.average('hostport', 'mbs',
+                                                     start, end),
+                                 array.stats.average('controller', 'cpu',
+                                                     start, end, max)))
+    raise Return(runs)
+
+
+def print_sweep(runs):
+    """Print a priority sweep as a table per array and test: mean rebuild
+    (or scrub/verify) and copyback time, rebuild MB/s, host MB/s and
+    controller CPU"""
+    def num(value, fmt='%.1f'):
+        if value is None:
+            return '-'
+        return fmt % value
+    def mean_et(values):
+        if not values:
+            return '-'
+        return format_et(sum(values) / len(values))
+    def job_et(t):
+        if isinstance(t, vdiskjob_et):
+            return t.et
+        return t.reconstruct_et
+    print "\n{0:14} {1:14} {2:8} {3:>3} {4:>12} {5:>12} {6:>11} {7:>9} "\
+          "{8:>5}".format("Array", "Test", "Priority", "N", "Reconstruct",
+                          "Copyback", "RebuildMB/s", "HostMB/s", "CPU%")
+    for r in sorted(runs, key=lambda x: (x.array, x.test)):
+        print "{0:14} {1:14} {2:8} {3:>3} {4:>12} {5:>12} {6:>11} {7:>9} "\
+              "{8:>5}".format(r.array, r.test, r.priority, len(r.results),
+                              mean_et([job_et(t) for t in r.results]),
+                              mean_et([t.copyback_et for t in r.results
+                                       if not isinstance(t, vdiskjob_et)]),
+                              num(r.rebuildmbs), num(r.hostmbs),
+                              num(r.cpu, '%.0f'))
+
+
+def read_plan(planfile):
+    """Return {array name: [(enclosure, slot, vdisk)]} from a plan file"""
+    #One disk per line:  <array> <enclosure>.<slot> <vdisk>
+    #e.g.  damc002-3 0.0 vd01
+    plans = {}
+    with open(planfile, 'r') as f:
+        for line in f:
+            fields = line.split('#')[0].split()
+            if not fields:
+                continue
+            if len(fields) != 3:
+                raise RuntimeError("Bad plan line: " + line.rstrip())
+            name, location, vdisk = fields
+            enclosure, slot = location.split('.')
+            plans.setdefault(name, []).append((int(enclosure), int(slot), vdisk))
+    return plans
+
+
+def hosts_arrays():
+    """Return the DotHill array names in /etc/hosts"""
+    #savesysteminfo.hosts() finds the DAMC* controller names, e.g. damc002-31
+    #and damc002-32 for controllers 1 and 2 of array damc002-3.
+    import savesysteminfo
+    savesysteminfo.quiet = True
+    savesysteminfo.verbose = False
+    savesysteminfo.debug = False
+    savesysteminfo.outdir = '.'   # only used when copying
+    savesysteminfo.hosts(copy=False)
+    names = []
+    for ip, controller in savesysteminfo.arraylist:
+        name = controller.lower()[:-1]
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def run_campaign(plans, test, workers, arrayclass=None, priorities=None):
+    """Run the drive tests on all arrays in plans at the same time, at most
+    workers arrays at once, as arrayclass (default DotHillArrayGL), once at
+    each job priority if priorities are given. Return
+    ([(array name, test name, results)], [ThroughputSeries],
+    [CommandLatency], [StatsSeries], [sweeprun])"""
+    #Each array's tests run as a coroutine in one EventLoop, at most
+    #workers at a time, so the campaign takes about as long as its slowest
+    #array instead of the sum of all of them, without a thread per array.
+    report = []
+    serieslist = []
+    latencies = []
+    statslist = []
+    sweep = []
+    limit = AsyncLimit(workers)
+
+    def test_array(name):
+        yield limit.acquire()
+        try:
+            array = (arrayclass or DotHillArrayGL)(name, connect=False)
+            latencies.append(array.cmdstats)
+            statslist.append(array.stats)
+            yield array.connect_async()
+            print "Array {0}: SCSI Product ID {1}, Bundle version {2}"\
+                  .format(name, array.scsiproductid, array.version)
+            if priorities:
+                runs = yield run_priority_sweep_async(array, plans[name],
+                                                      test, priorities)
+                sweep.extend(runs)
+                results = [(r.test + '@' + r.priority, r.results) for r in runs]
+            else:
+                results = yield run_drive_tests_async(array, plans[name], test)
+            for testname, times in results:
+                report.append((name, testname, times))
+            serieslist.extend(array.series.values())
+        except Exception as e:
+            print "Array {0} failed: {1}".format(name, e)
+            report.append((name, "failed: %s" % e, []))
+        finally:
+            limit.release()
+
+    run_coroutine([test_array(name) for name in sorted(plans.keys())])
+    return (report, serieslist, latencies, statslist, sweep)
+
+
+def save_throughput(serieslist, outdir, statslist=[]):
+    """Write each ThroughputSeries as CSV (and NPZ if numpy is installed)
+    and each StatsSeries, raw and aligned with the job % intervals, to
+    outdir and print the rate summary"""
+    serieslist = sorted(serieslist, key=lambda x: (x.arrayname, x.vdisk))
+    stats = dict([(s.arrayname, s) for s in statslist if len(s)])
+    for series in serieslist:
+        print "Saved " + series.write_csv(outdir)
+        npz = series.write_npz(outdir)
+        if npz:
+            print "Saved " + npz
+        if series.arrayname in stats:
+            print "Saved " + stats[series.arrayname]\
+                  .write_aligned_csv(series, outdir)
+    for name in sorted(stats.keys()):
+        print "Saved " + stats[name].write_csv(outdir)
+    print_throughput(serieslist)
+
+
+def print_report(report):
+    """Print the merged reconstruction/copyback times of a campaign, then
+    the scrub/verify times"""
+    report = sorted(report, key=lambda x: (x[0], x[1]))
+    width = max([14] + [len(testname) for name, testname, results in report
+                        if results])
+    vdiskjobs = [(name, testname, r) for name, testname, results in report
+                 for r in results if isinstance(r, vdiskjob_et)]
+    if len(vdiskjobs) < len([r for n, t, results in report for r in results]) \
+            or not vdiskjobs:
+        print "\n{0:14} {1:{6}} {2:6} {3:6} {4:>20} {5:>20}"\
+              .format("Array", "Test", "Vdisk", "Disk", "Reconstruct",
+                      "Copyback", width)
+    for name, testname, results in report:
+        if not results:
+            print "{0:14} {1}".format(name, testname)
+        for r in results:
+            if isinstance(r, vdiskjob_et):
+                continue
+            print "{0:14} {1:{6}} {2:6} {3:6} {4:>20} {5:>20}"\
+                  .format(name, testname, r.vdisk, r.location,
+                          format_et(r.reconstruct_et, r.reconstruct_err),
+                          format_et(r.copyback_et, r.copyback_err), width)
+    if not vdiskjobs:
+        return
+    print "\n{0:14} {1:{7}} {2:6} {3:5} {4:>9} {5:>20} {6:>8}"\
+          .format("Array", "Test", "Vdisk", "Job", "Size", "Time", "MB/s",
+                  width)
+    for name, testname, r in vdiskjobs:
+        print "{0:14} {1:{7}} {2:6} {3:5} {4:>9} {5:>20} {6:>8}"\
+              .format(name, testname, r.vdisk, r.job, r.size,
+                      format_et(r.et, r.err),
+                      r.mbs is None and '-' or '%.1f' % r.mbs, width)
+
+
 ################################################################################
 def main():
-    usage="%prog [-d] [-v] [-t]"
+    global debug
+    global verbose
+    global rshfa
+    global smcli
+
+    usage="%prog [-d] [-v] [-t] [-r] [-a array]... [--allarrays] [-p plan] [-j workers]"
     parser = OptionParser(usage, version="%prog 0.14")
     #debug = 0  # 0=Debug off,
     #           # 1=show info such as DotHill commands
@@ -567,47 +4021,162 @@ def main():
                       help="enable vebose mode")
     #test = 0   # test to run 
     parser.add_option("-t", "--test", type="int", dest="test", default=3,
-                      help="specify test 0-3: 0=wait_for_copy,1=1down1back,2=2down2back,3=1down1back+2down2back")
+                      help="specify test 0-7: 0=wait_for_copy,1=1down1back,2=2down2back,3=1down1back+2down2back,4=alldownallback (a disk of every vdisk),5=raid6single+raid6double (two disks of a RAID6 vdisk),6=scrub (VRSC),7=verify (VRFY) of every vdisk in the plan")
+    parser.add_option("--priorities", dest="priorities",
+                      help="run test 1-7 once at each of these comma separated job priorities (high, medium, low; on NetApp lowest, low, medium, high, highest), restoring the array's priority after each, and compare them")
+    parser.add_option("--stagger", type="float", dest="stagger",
+                      default=DotHillArrayGL.stagger,
+                      help="array seconds between downing two disks of one vdisk (test 5), 0=at once, default=%default")
+    parser.add_option("--starttimeout", type="float", dest="starttimeout",
+                      default=DiskTest.starttimeout,
+                      help="array seconds to wait for a reconstruction or copyback to start before failing the disk, default=%default")
+    parser.add_option("--minpoll", type="float", dest="minpoll",
+                      default=DotHillArrayGL.minpolltime,
+                      help="shortest job poll interval in seconds, default=%default")
+    parser.add_option("--maxpoll", type="float", dest="maxpoll",
+                      default=DotHillArrayGL.maxpolltime,
+                      help="longest job poll interval in seconds, default=%default")
+    parser.add_option("--polljitter", type="float", dest="polljitter",
+                      default=DotHillArrayGL.polljitter,
+                      help="random +/- fraction added to poll intervals, default=%default")
+    parser.add_option("--eventdir", dest="eventdir",
+                      default=DotHillArrayGL.eventdir,
+                      help="directory for the local array event store, default=%default")
+    parser.add_option("-a", "--array", action="append", dest="arrays",
+                      help="array to test, e.g. damc002-3 (repeat for more arrays)")
+    parser.add_option("--allarrays",
+                      action="store_true", dest="allarrays", default=False,
+                      help="test every DAMC array in /etc/hosts")
+    parser.add_option("-p", "--plan", dest="planfile",
+                      help="file of '<array> <enclosure>.<slot> <vdisk>' lines giving the disks to test on each array (default: pick them from the array's topology)")
+    parser.add_option("--topologydir", dest="topologydir",
+                      default=DotHillArrayGL.topologydir,
+                      help="directory for cached array topologies, default=%default")
+    parser.add_option("--rediscover",
+                      action="store_true", dest="rediscover", default=False,
+                      help="discover array topologies again instead of using the cache")
+    parser.add_option("--raid6disks", type="int", dest="raid6disks",
+                      default=DotHillArrayGL.raid6disks,
+                      help="disks of each RAID6 vdisk to put in a picked plan, default=%default")
+    parser.add_option("-j", "--workers", type="int", dest="workers", default=0,
+                      help="number of arrays to test at once, default=all")
+    parser.add_option("-s", "--seriesdir", dest="seriesdir",
+                      help="save job % samples per vdisk (CSV, NPZ if numpy is installed) and print rebuild rates")
+    parser.add_option("--statsinterval", type="float", dest="statsinterval",
+                      default=DotHillArrayGL.statsinterval,
+                      help="seconds between controller/vdisk/disk statistics samples while jobs run, 0=off, default=%default")
+    parser.add_option("--stallfraction", type="float", dest="stallfraction",
+                      default=StatsSeries.stallfraction,
+                      help="report job intervals slower than this fraction of the median rate as stalls, default=%default")
+    parser.add_option("--slowcmd", type="float", dest="slowcmd",
+                      default=CommandLatency.slowtime,
+                      help="log array commands taking this many seconds or more, default=%default")
+    parser.add_option("--latencyfile", dest="latencyfile",
+                      help="save per-command latency histograms and samples as JSON")
+    parser.add_option("-c", "--controller", type="int", dest="controller",
+                      default=DotHillArrayGL.controller,
+                      help="controller for down/clear commands (1=A, 2=B), default=%default")
+    parser.add_option("--rshfacmd", dest="rshfacmd", default=rshfa,
+                      help="command used to reach the array CLI, default=%default")
+    parser.add_option("--smclicmd", dest="smclicmd", default=smcli,
+                      help="NetApp SMcli command, default=%default")
+    parser.add_option("--backend", dest="backend", default="auto",
+                      choices=["auto", "dothill", "netapp"],
+                      help="array type: dothill, netapp (SMcli) or auto (netapp if SMcli finds arrays), default=%default")
+    parser.add_option("-r", "--rshfa",
+                      action="store_true", dest="rshfa", default=False,
+                      help="run each array command with its own rshfa instead of a CLI session")
     (options, args) = parser.parse_args()
     debug = options.debug
     verbose = options.verbose
     test = options.test
+    if options.rshfa:
+        DotHillArrayGL.usesessions = False
+    DotHillArrayGL.eventdir = options.eventdir
+    rshfa = options.rshfacmd
+    smcli = options.smclicmd
+    DotHillArrayGL.controller = options.controller
+    DotHillArrayGL.minpolltime = options.minpoll
+    DotHillArrayGL.maxpolltime = options.maxpoll
+    DotHillArrayGL.polljitter = options.polljitter
+    DotHillArrayGL.topologydir = options.topologydir
+    DotHillArrayGL.rediscover = options.rediscover
+    DotHillArrayGL.raid6disks = options.raid6disks
+    DotHillArrayGL.stagger = options.stagger
+    DiskTest.starttimeout = options.starttimeout
+    DotHillArrayGL.statsinterval = options.statsinterval
+    StatsSeries.stallfraction = options.stallfraction
+    CommandLatency.slowtime = options.slowcmd
 
 
 ####
-    array3 = DotHillArrayGL("damc002-3")
-    print "Array: " + array3.name
-    print "SCSI Product ID: " + array3.scsiproductid
-    print "Bundle version: " + array3.version
+    if options.planfile:
+        plans = read_plan(options.planfile)
+    else:
+        names = options.arrays or []
+        if options.allarrays:
+            names += [n for n in hosts_arrays() if n not in names]
+        if not names:
+            names = ["damc002-3"]
+        plans = dict([(name, None) for name in names])   # discover
+
+    arrayclass = array_backend(options.backend)
+    priorities = []
+    if options.priorities:
+        priorities = [p.strip().lower() for p in options.priorities.split(',')
+                      if p.strip()]
+        if test not in (1, 2, 3, 4, 5, 6, 7):
+            parser.error("--priorities needs test 1-7")
+    for run in testruns.get(test, []):
+        if run in vdiskjobruns \
+                and vdiskjobruns[run] not in arrayclass.jobcommands:
+            parser.error("test {0} ({1}) isn't supported on these arrays"
+                         .format(test, run))
+        for p in priorities:
+            if p not in arrayclass.jobpriorities:
+                parser.error("--priorities: {0} isn't one of {1}".format(
+                    p, ", ".join(arrayclass.jobpriorities)))
 
     localtime = datetime.datetime.now()
     print "Local time: {0}\n".format(localtime.strftime("%Y-%m-%d %H:%M:%S"))
-
-    disk1 = disk(0,0, "vd01")
-    disk2 = disk(0,1, "vd02")
-
     print "Running test", test
+    if arrayclass is not DotHillArrayGL:
+        print "NetApp arrays (SMcli)"
 
-    if test == 0:
-        print "Wait for copyback"
-        array3.wait_for_job("vd01", "CPYBK")
-        array3.get_drive_down_copyback_results([disk(0,0, "vd01")])
-
-    elif test == 1:
-        print "Starting one drive down, one drive copyback test"
-        array3.drive_down_drive_copyback([disk1])
-
-    elif test == 2:
-        print "Starting two drives down, two drives copyback"
-        array3.drive_down_drive_copyback([disk1, disk2])
-
-    elif test == 3:
-        print "Starting one drive down, one drive copyback test"
-        array3.drive_down_drive_copyback([disk1])
+    if len(plans) == 1:
+        name = plans.keys()[0]
+        array3 = arrayclass(name)
+        print "Array: " + array3.name
+        print "SCSI Product ID: " + array3.scsiproductid
+        print "Bundle version: " + array3.version
+        if priorities:
+            sweep = run_coroutine(run_priority_sweep_async(
+                array3, plans[name], test, priorities))
+        else:
+            run_drive_tests(array3, plans[name], test)
+        serieslist = array3.series.values()
+        latencies = [array3.cmdstats]
+        statslist = [array3.stats]
+    else:
+        workers = options.workers or len(plans)
+        print "Arrays: {0}, {1} at a time".format(" ".join(sorted(plans)),
+                                                  workers)
+        report, serieslist, latencies, statslist, sweep = run_campaign(
+            plans, test, workers, arrayclass, priorities)
+        print_report(report)
+        print "Campaign time: {0}".format(
+            str(datetime.datetime.now() - localtime).split(".")[0])
 
-        print "Starting two drives down, two drives copyback"
-        array3.drive_down_drive_copyback([disk1, disk2])
+    if priorities:
+        print_sweep(sweep)
+    print_stalls(serieslist, statslist)
+    if options.seriesdir:
+        save_throughput(serieslist, options.seriesdir, statslist)
+    print_latency(latencies)
+    if options.latencyfile:
+        save_latency(latencies, options.latencyfile)
 
+    EventLoop.current().close()
     print "Done"
 
 
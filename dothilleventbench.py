@@ -0,0 +1,152 @@
+#!/usr/bin/python
+
+################################################################################
+# dothilleventbench.py
+# Benchmark DotHill event log classification on a synthetic event log
+#   Compares dothilldmandr.EventClassifier (one pass per line) with the
+#   original per-line parse (date/time regex + four message searches), with
+#   records only for the original's four kinds, and the sequence id alone
+#   (what EventStore reads of the events it has already seen)
+#
+# Examples:
+# dothilleventbench.py              (1,000,000 events)
+# dothilleventbench.py -n 100000 -r 3
+################################################################################
+
+import time
+import datetime
+import re
+from optparse import OptionParser
+
+import dothilldmandr
+
+
+#One line of each kind in EventClassifier.messages plus one it doesn't know
+templates = [
+    "{0} [037] #A{1}: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL Vdisk reconstruction started. (vdisk: vd{2:02d}, SN: 00c0ff1bce3c000029452a5700000000) (disk: channel: 0, ID: {3}, SN: KXGN1Z0R, enclosure: 0, slot: {3})",
+    "{0} [018] #A{1}: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL Reconstruction of a vdisk completed. (vdisk: vd{2:02d}, SN: 00c0ff1bce3c000029452a5700000000)",
+    "{0} [499] #A{1}: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL A disk copyback operation started. The indicated disk is the destination disk. (vdisk: vd{2:02d}, SN: 00c0ff1bce3c000029452a5700000000) (to disk: channel: 0, ID: {3}, SN: KPGJDL2F, enclosure: 0, slot: {3})",
+    "{0} [499] #A{1}: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL A disk copyback operation started. The indicated disk is the source disk. (vdisk: vd{2:02d}, SN: 00c0ff1bce3c000029452a5700000000) (from disk: channel: 0, ID: 20, SN: KXGN1Z0R, enclosure: 0, slot: 20)",
+    "{0} [500] #A{1}: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL A disk copyback operation completed. (vdisk: vd{2:02d}, SN: 00c0ff1bce3c000029452a5700000000)",
+    "{0} [500] #A{1}: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL A disk copyback operation completed. The indicated disk was restored to being a spare. (disk: channel: 0, ID: 20, SN: KXGN1Z0R, enclosure: 0, slot: 20)",
+    "{0} [501] #A{1}: DH4544 Array SN#00C0FF1BCE3C Controller A ERROR A disk copyback operation failed. (vdisk: vd{2:02d}, SN: 00c0ff1bce3c000029452a5700000000)",
+    "{0} [008] #A{1}: DH4544 Array SN#00C0FF1BCE3C Controller A WARNING A disk that was part of a vdisk is down. (disk: channel: 0, ID: {3}, SN: KPGJDL2F, enclosure: 0, slot: {3})",
+    "{0} [009] #A{1}: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL A spare disk was used in a vdisk to bring it back to a fault-tolerant state. (vdisk: vd{2:02d}, SN: 00c0ff1bce3c000029452a5700000000)",
+    "{0} [033] #A{1}: DH4544 Array SN#00C0FF1BCE3C Controller A INFORMATIONAL A spare disk drive was added to a vdisk. (vdisk: vd{2:02d}, SN: 00c0ff1bce3c000029452a5700000000) (disk: channel: 0, ID: 20, SN: KXGN1Z0R, enclosure: 0, slot: 20)",
+    "{0} [464] #B{1}: DH4544 Array SN#00C0FF1BCE3C Controller B INFORMATIONAL A SAS host port link went up. (port: A1)",
+]
+
+
+def make_log(numevents):
+    """Return a list of numevents synthetic event lines"""
+    start = datetime.datetime(2016, 6, 1)
+    lines = []
+    for n in range(numevents):
+        eventtime = (start + datetime.timedelta(seconds=n)).strftime("%Y-%m-%d %H:%M:%S")
+        lines.append(templates[n % len(templates)]
+                     .format(eventtime, 10000 + n, n % 24 + 1, n % 24))
+    return lines
+
+
+#Original per-line work in get_drive_down_copyback_results, for comparison
+rdt = re.compile('(?P<time>(?P<yyyy>\d\d\d\d)-(?P<mm>\d\d)-(?P<dd>\d\d) (?P<hour>\d\d):(?P<minute>\d\d):(?P<second>\d\d))')
+rrc = re.compile('Reconstruction of a vdisk completed.')
+rrs = re.compile('Vdisk reconstruction started.')
+rcc = re.compile('A disk copyback operation completed. [(]')
+rcd = re.compile('A disk copyback operation started. The indicated disk is the destination disk.')
+rvd = re.compile('vdisk: (?P<vdisk>vd\d+)')
+res = re.compile('enclosure: (?P<enclosure>\d+), slot: (?P<slot>\d+)')
+
+def baseline(lines):
+    found = 0
+    for line in lines:
+        pdt = rdt.search(line)
+        eventtime = datetime.datetime(int(pdt.group('yyyy')), int(pdt.group('mm')),
+                                      int(pdt.group('dd')), int(pdt.group('hour')),
+                                      int(pdt.group('minute')), int(pdt.group('second')))
+        prc = rrc.search(line)
+        prs = rrs.search(line)
+        pcc = rcc.search(line)
+        pcd = rcd.search(line)
+        if pcc or prc:
+            rvd.search(line)
+            found += 1
+        elif pcd or prs:
+            rvd.search(line)
+            res.search(line)
+            found += 1
+    return found
+
+
+def classifier(lines):
+    c = dothilldmandr.EventClassifier(datetime.timedelta(0))
+    classify = c.classify
+    found = 0
+    for line in lines:
+        if classify(line).kind != 'other':
+            found += 1
+    return found
+
+
+#The kinds the original types, for a like for like comparison
+originalkinds = set(['reconstructstart', 'reconstructcomplete',
+                     'copybackstart', 'copybackcomplete'])
+
+def wanted(lines):
+    c = dothilldmandr.EventClassifier(datetime.timedelta(0))
+    classify = c.classify
+    found = 0
+    for line in lines:
+        if classify(line, originalkinds):
+            found += 1
+    return found
+
+
+def sequence(lines):
+    c = dothilldmandr.EventClassifier(datetime.timedelta(0))
+    seq = c.seq
+    found = 0
+    for line in lines:
+        if seq(line):
+            found += 1
+    return found
+
+
+def best_of(fn, lines, repeat):
+    best = None
+    for r in range(repeat):
+        start = time.time()
+        found = fn(lines)
+        et = time.time() - start
+        if best is None or et < best:
+            best = et
+    return (best, found)
+
+
+################################################################################
+def main():
+    usage="%prog [-n] [-r]"
+    parser = OptionParser(usage, version="%prog 0.1")
+    parser.add_option("-n", "--numevents", type="int", dest="numevents",
+                      default=1000000,
+                      help="number of synthetic events, default=%default")
+    parser.add_option("-r", "--repeat", type="int", dest="repeat", default=1,
+                      help="report the best of this many runs, default=%default")
+    (options, args) = parser.parse_args()
+
+    print "Generating {0} events".format(options.numevents)
+    lines = make_log(options.numevents)
+
+    for name, fn in [("original", baseline), ("EventClassifier", classifier),
+                     ("original's kinds", wanted),
+                     ("sequence id only", sequence)]:
+        et, found = best_of(fn, lines, options.repeat)
+        print "{0:16} {1:8.2f}s {2:10.0f} events/s ({3} matched)"\
+              .format(name, et, len(lines) / et, found)
+    print "Note: the original only types 4 of the {0} event kinds"\
+          .format(len(dothilldmandr.EventClassifier.messages))
+
+
+################################################################################
+if __name__ == "__main__":
+    main()
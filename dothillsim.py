@@ -0,0 +1,931 @@
+#!/usr/bin/python
+
+################################################################################
+# dothillsim.py
+# Offline stand-in for a DotHill DH4544 (GL145R006) array CLI
+#   Models vdisks, disks, spares, RCON/CPYBK/VRSC/VRFY jobs (at the job
+#   priority, with the controller, vdisk, disk and host port statistics
+#   they cause) and the event log with the message formats dothilldmandr.py
+#   parses. Array time can run faster than real time (compression) so hours
+#   of rebuild take seconds.
+#
+# Used three ways:
+#  - as rshfa:  dothillsim.py -V dh <array><controller> [command]
+#    (no command: an interactive CLI session on stdin/stdout). State is
+#    kept in <statedir>/<array>.json between invocations.
+#  - in process: dothilldmandr.AsyncCLISession.transportclass = SimTransport
+#  - as SMcli:  dothillsim.py <array>1 <array>2 -c '<script>' (a NetApp
+#    E-Series view of the same array, for dothilldmandr.py --backend netapp).
+#    The controller clocks are set from the host, so use compression 1.
+#  - to set up an array:  dothillsim.py --init damc002-3 -x 100 --vdisks 8
+#
+# Examples:
+# dothillsim.py --init damc002-3 -x 200 --rcontime 7200 --cpybktime 8000
+# dothilldmandr.py --backend dothill --rshfacmd dothillsim.py -a damc002-3 -t 2 --minpoll 0.1 --maxpoll 2
+# dothillsim.py -V dh damc002-31 show vdisks
+# dothillsim.py --show damc002-3
+# dothillsim.py --init damc010-3 -x 1 --rcontime 40 --cpybktime 50 --rcondelay 2
+# dothilldmandr.py --backend netapp --smclicmd dothillsim.py -a damc010-3 -t 1 --minpoll 0.5 --maxpoll 2
+################################################################################
+
+import os
+import sys
+import time
+import datetime
+import re
+import json
+import fcntl
+from optparse import OptionParser
+
+
+statedir = os.environ.get('DOTHILLSIM_DIR', '/tmp/dothillsim')
+
+#Array settings (--init options and SimTransport.config)
+defaultconfig = {
+    'compress': 1.0,        # array seconds per real second
+    'vdisks': 8,            # number of vdisks
+    'raid': 'RAID1',        # RAID1, RAID5, RAID6 or RAID10
+    'disksper': 2,          # disks per vdisk
+    'spares': 4,            # global spares
+    'disksize': 899.2,      # GB
+    'rcontime': 7200.0,     # array seconds to reconstruct one disk
+    'cpybktime': 8000.0,    # array seconds to copy back one disk
+    'rcondelay': 30.0,      # array seconds from disk down to RCON start
+    'cpybkdelay': 5.0,      # array seconds from clear metadata to CPYBK start
+    'overlap': 0.5,         # each extra concurrent rebuild adds this much time
+    'cmdlatency': 0.0,      # real seconds each command takes
+    'hostmbs': 400.0,       # host workload MB/s through the host ports
+    'scrubmbs': 150.0,      # MB/s of vdisk capacity a scrub or verify reads
+    'utilities': 4,         # scrubs/verifies that can run at once
+    'failed': [],           # controllers (1, 2) that don't answer
+}
+
+timeformat = "%Y-%m-%d %H:%M:%S"
+
+
+################################################################################
+class SimArray:
+    """State and CLI of one simulated array.
+    """
+    #Each disk down becomes a rebuild record that goes through
+    #  pending -> rcon -> rebuilt -> cpybkpending -> cpybk -> done
+    #and each scrub or verify one that goes from vrsc or vrfy to done
+    #as array time passes. advance() applies every transition due at the
+    #current array time (writing its events) before a command runs.
+    product = 'DH4544'
+    bundle = 'GL145R006'
+    #job priority -> (job time multiplier, share of the host MB/s lost
+    #while jobs run); lowest and highest are SMcli modification priorities
+    priorities = {'highest': (0.8, 0.6), 'high': (1.0, 0.5),
+                  'medium': (1.6, 0.3), 'low': (2.5, 0.15), 'lowest': (4.0, 0.1)}
+    priority = 'high'   # until set job-parameters changes it
+
+    vdiskheader = ('Name  Size    Free Own Pref   RAID   Disks Spr Chk  Status Jobs      Job%      '
+                   'Serial Number                    Drive Spin Down        Spin Down Delay       '
+                   'Health     Health Reason')
+
+    def __init__(self, name, config=None, state=None):
+        self.name = name
+        if state is not None:
+            self.__dict__.update(state)
+            return
+        self.config = dict(defaultconfig)
+        self.config.update(config or {})
+        c = self.config
+        self.serial = '00C0FF1B' + '%04X' % (sum([ord(ch) for ch in name]) % 65536)
+        self.realstart = time.time()
+        self.arraystart = time.time()
+        self.seq = 19000
+        self.events = []        # formatted event lines, oldest first
+        self.rebuilds = []      # dicts, see advance()
+        self.disks = {}         # location -> {'serial', 'use', 'vdisk'}
+        self.vdisks = {}        # name -> {'raid', 'members', 'serial'}
+        numvdisks = c['vdisks']; disksper = c['disksper']
+        for v in range(numvdisks):
+            vdisk = 'vd%02d' % (v + 1)
+            members = []
+            for d in range(disksper):
+                members.append('0.%d' % (d * numvdisks + v))
+            self.vdisks[vdisk] = {'raid': c['raid'], 'members': members,
+                                  'serial': self.serial.lower() + '%024x' % (v + 1)}
+            for location in members:
+                self.disks[location] = {'use': 'VDISK', 'vdisk': vdisk}
+        first = numvdisks * disksper
+        for n in range(c['spares']):
+            self.disks['0.%d' % (first + n)] = {'use': 'GLOBAL SP', 'vdisk': ''}
+        for location, d in self.disks.items():
+            d['serial'] = 'K%07X' % (abs(hash(self.name + location)) % 0xFFFFFFF)
+
+    def todict(self):
+        return dict([(k, v) for k, v in self.__dict__.items() if k != 'name'])
+
+    ##### time
+    def now(self):
+        """Array time in seconds since the epoch"""
+        return (self.arraystart
+                + (time.time() - self.realstart) * self.config['compress'])
+
+    def timestr(self, t=None):
+        if t is None:
+            t = self.now()
+        return datetime.datetime.fromtimestamp(int(t)).strftime(timeformat)
+
+    ##### events
+    def log(self, t, code, severity, message):
+        self.seq += 1
+        self.events.append('{0} [{1:03d}] #A{2}: {3} Array SN#{4} Controller A {5} {6}'
+                           .format(self.timestr(t), code, self.seq,
+                                   self.product, self.serial, severity, message))
+
+    def diskparams(self, location, prefix='disk'):
+        enclosure, slot = location.split('.')
+        return '({0}: channel: 0, ID: {1}, SN: {2}, enclosure: {3}, slot: {4})'\
+               .format(prefix, slot, self.disks[location]['serial'], enclosure, slot)
+
+    def vdiskparams(self, vdisk):
+        return '(vdisk: {0}, SN: {1})'.format(vdisk, self.vdisks[vdisk]['serial'])
+
+    ##### jobs
+    def rcontime(self, rebuild):
+        """Array seconds for rebuild, longer when it overlaps others"""
+        others = [r for r in self.rebuilds if r is not rebuild
+                  and r['vdisk'] == rebuild['vdisk'] and r['phase'] == 'rcon']
+        return (self.config['rcontime'] * self.priorities[self.priority][0]
+                * (1 + self.config['overlap'] * len(others)))
+
+    def cpybktime(self):
+        return self.config['cpybktime'] * self.priorities[self.priority][0]
+
+    def scrubmbs(self):
+        return self.config['scrubmbs'] / self.priorities[self.priority][0]
+
+    def advance(self):
+        """Apply the job transitions due by the current array time"""
+        now = self.now()
+        while True:
+            due = []
+            for r in self.rebuilds:
+                if r['phase'] in ('pending', 'rcon', 'cpybkpending', 'cpybk',
+                                  'vrsc', 'vrfy') and r['at'] <= now:
+                    due.append(r)
+            if not due:
+                break
+            r = min(due, key=lambda x: x['at'])
+            t = r['at']
+            vdisk = r['vdisk']
+            if r['phase'] == 'pending':
+                r['phase'] = 'rcon'
+                r['start'] = t
+                r['at'] = t + self.rcontime(r)
+                self.log(t, 37, 'INFORMATIONAL', 'Vdisk reconstruction started. '
+                         + self.vdiskparams(vdisk) + ' ' + self.diskparams(r['spare']))
+            elif r['phase'] == 'rcon':
+                r['phase'] = 'rebuilt'
+                self.log(t, 18, 'INFORMATIONAL', 'Reconstruction of a vdisk completed. '
+                         + self.vdiskparams(vdisk))
+            elif r['phase'] == 'cpybkpending':
+                r['phase'] = 'cpybk'
+                r['start'] = t
+                r['at'] = t + self.cpybktime()
+                self.log(t, 499, 'INFORMATIONAL', 'A disk copyback operation started. '
+                         'The indicated disk is the source disk. '
+                         + self.vdiskparams(vdisk) + ' ' + self.diskparams(r['spare'], 'from disk'))
+                self.log(t, 499, 'INFORMATIONAL', 'A disk copyback operation started. '
+                         'The indicated disk is the destination disk. '
+                         + self.vdiskparams(vdisk) + ' ' + self.diskparams(r['failed'], 'to disk'))
+            elif r['phase'] == 'vrsc':
+                r['phase'] = 'done'
+                self.log(t, 207, 'INFORMATIONAL', 'Vdisk scrub completed. No errors '
+                         'were found. ' + self.vdiskparams(vdisk))
+            elif r['phase'] == 'vrfy':
+                r['phase'] = 'done'
+                self.log(t, 21, 'INFORMATIONAL', 'Vdisk verification completed. No '
+                         'errors were found. ' + self.vdiskparams(vdisk))
+            elif r['phase'] == 'cpybk':
+                r['phase'] = 'done'
+                members = self.vdisks[vdisk]['members']
+                members[members.index(r['spare'])] = r['failed']
+                self.disks[r['failed']].update({'use': 'VDISK', 'vdisk': vdisk})
+                self.disks[r['spare']].update({'use': 'GLOBAL SP', 'vdisk': ''})
+                self.log(t, 500, 'INFORMATIONAL', 'A disk copyback operation completed. '
+                         + self.vdiskparams(vdisk))
+                self.log(t, 500, 'INFORMATIONAL', 'A disk copyback operation completed. '
+                         'The indicated disk was restored to being a spare. '
+                         + self.diskparams(r['spare']))
+        self.rebuilds = [r for r in self.rebuilds if r['phase'] != 'done']
+
+    def pct(self, r, now):
+        return int(100 * (now - r['start']) / (r['at'] - r['start']))
+
+    def vdiskjob(self, vdisk, now):
+        """Return (status, job, pct) of vdisk"""
+        active = [r for r in self.rebuilds if r['vdisk'] == vdisk]
+        missing = len([r for r in active if r['phase'] in ('pending', 'rcon')])
+        status = 'FTOL'
+        if missing:
+            if self.vdisks[vdisk]['raid'] == 'RAID6' and missing == 1:
+                status = 'FTDN'
+            else:
+                status = 'CRIT'
+        for phase in ['rcon', 'cpybk', 'vrsc', 'vrfy']:
+            running = [r for r in active if r['phase'] == phase]
+            if running:
+                return (status, phase.upper(),
+                        min([self.pct(r, now) for r in running]))
+        return (status, '', None)
+
+    def vdisksize(self, vdisk):
+        raid = self.vdisks[vdisk]['raid']
+        n = len(self.vdisks[vdisk]['members'])
+        data = {'RAID1': 1, 'RAID10': n // 2, 'RAID5': n - 1, 'RAID6': n - 2}[raid]
+        return '%.1fGB' % (data * self.config['disksize'])
+
+    ##### commands
+    def trailer(self, text='Command completed successfully.'):
+        return 'Success: {0} ({1})\n'.format(text, self.timestr())
+
+    def error(self, text):
+        return 'Error: {0} ({1})\n'.format(text, self.timestr())
+
+    def show_version(self, args):
+        out = ''
+        for ctl in ['A', 'B']:
+            out += ('Controller {0} Versions\n---------------------\n'
+                    'Bundle Version: {1}\nBuild Date: Fri Dec 11 10:24:33 MST 2015\n\n'
+                    .format(ctl, self.bundle))
+        return out + self.trailer()
+
+    def show_system(self, args):
+        return ('System Information\n------------------\n'
+                'System Name: {0}\nMidplane Serial Number: {1}\n'
+                'Product ID: {2}\nSCSI Vendor ID: DotHill\nSCSI Product ID: {2}\n'
+                'Enclosure Count: 1\nHealth: OK\n\n\n'
+                .format(self.name.upper(), self.serial, self.product)
+                + self.trailer())
+
+    def format_row(self, header, values):
+        """Place values at the column positions of their headings"""
+        row = ''
+        for heading, value in values:
+            start = re.search('(^|(?<=\\s))' + re.escape(heading) + '(?=\\s|$)',
+                              header).start()
+            if len(row) < start:
+                row += ' ' * (start - len(row))
+            elif row:
+                row += ' '
+            row += value
+        return row
+
+    def show_vdisks(self, args):
+        now = self.now()
+        rule = '-' * len(self.vdiskheader)
+        out = self.vdiskheader + '\n  Health Recommendation\n' + rule + '\n'
+        names = sorted(self.vdisks)
+        if args:
+            names = [n for n in names if n == args[0]]
+            if not names:
+                return self.error('The specified vdisk was not found. (%s)' % args[0])
+        for vdisk in names:
+            status, job, pct = self.vdiskjob(vdisk, now)
+            health = 'OK'
+            if status != 'FTOL':
+                health = 'Degraded'
+            out += self.format_row(self.vdiskheader, [
+                ('Name', vdisk), ('Size', self.vdisksize(vdisk)), ('Free', '0B'),
+                ('Own', 'A'), ('Pref', 'A'), ('RAID', self.vdisks[vdisk]['raid']),
+                ('Disks', str(len(self.vdisks[vdisk]['members']))), ('Spr', '0'),
+                ('Chk', 'N/A'), ('Status', status), ('Jobs', job),
+                ('Job%', pct is not None and '%d%%' % pct or ''),
+                ('Serial', self.vdisks[vdisk]['serial']), ('Drive', 'Disabled'),
+                ('Spin', '0'), ('Health', health)]).rstrip() + '\n'
+        return out + '\n' + rule + '\n' + self.trailer()
+
+    diskheader = ('Location Serial Number        Vendor   Rev  How Used   Type   Size     '
+                  'Rate*(Gb/s) SP Health')
+
+    def show_disks(self, args):
+        locations = sorted(self.disks, key=lambda l: [int(x) for x in l.split('.')])
+        if len(args) >= 2 and args[0] == 'vdisk':
+            if args[1] not in self.vdisks:
+                return self.error('The specified vdisk was not found. (%s)' % args[1])
+            locations = [l for l in locations if self.disks[l]['use'] == 'VDISK'
+                         and self.disks[l]['vdisk'] == args[1]]
+        rule = '-' * (len(self.diskheader) + 10)
+        out = (self.diskheader + '\n  Health Reason\n  Health Recommendation\n'
+               + rule + '\n')
+        for location in locations:
+            d = self.disks[location]
+            health = 'OK'
+            if d['use'] == 'LEFTOVR':
+                health = 'Degraded'
+            out += self.format_row(self.diskheader, [
+                ('Location', location), ('Serial', d['serial']), ('Vendor', 'HGST'),
+                ('Rev', 'A3D0'), ('How', d['use']), ('Type', 'SAS'),
+                ('Size', '%.1fGB' % self.config['disksize']), ('Rate*(Gb/s)', '6.0'),
+                ('Health', health)]).rstrip() + '\n'
+        return (out + rule + '\nInfo: * Rates may vary. This is normal behavior. ('
+                + self.timestr() + ')\n\n' + self.trailer())
+
+    ##### statistics
+    def job_rates(self):
+        """Return {location: (MB/s, 'read' or 'write')} and {vdisk: MB/s}
+        of the running RCON and CPYBK jobs"""
+        disks = {}; vdisks = {}
+        mb = self.config['disksize'] * 1000
+        for r in self.rebuilds:
+            if r['phase'] == 'rcon':
+                rate = mb / self.rcontime(r)
+                target = r['spare']
+                sources = [l for l in self.vdisks[r['vdisk']]['members']
+                           if l != r['spare']]
+            elif r['phase'] == 'cpybk':
+                rate = mb / self.cpybktime()
+                target = r['failed']
+                sources = [r['spare']]
+            elif r['phase'] in ('vrsc', 'vrfy'):
+                members = self.vdisks[r['vdisk']]['members']
+                rate = self.scrubmbs() / len(members)
+                vdisks[r['vdisk']] = vdisks.get(r['vdisk'], 0.0) + self.scrubmbs()
+                for l in members:
+                    disks[l] = (disks.get(l, (0.0,))[0] + rate, 'read')
+                continue
+            else:
+                continue
+            vdisks[r['vdisk']] = vdisks.get(r['vdisk'], 0.0) + rate
+            disks[target] = (disks.get(target, (0.0,))[0] + rate, 'write')
+            for l in sources:
+                disks[l] = (disks.get(l, (0.0,))[0] + rate / len(sources), 'read')
+        return disks, vdisks
+
+    def statsrows(self, header, rows):
+        rule = '-' * len(header)
+        return (header + '\n' + rule + '\n'
+                + ''.join([self.format_row(header, row).rstrip() + '\n'
+                           for row in rows])
+                + rule + '\n' + self.trailer())
+
+    controllerstatsheader = ('Durable ID     CPU Load   Power On Time (Secs)   Bytes per second   '
+                             'IOPS             Number of Reads  Number of Writes  Reset Time')
+
+    def show_controller_statistics(self, args):
+        disks, vdisks = self.job_rates()
+        busy = sum(vdisks.values()) * 2   # read and written
+        rows = []
+        #the jobs run on controller A (it owns every vdisk)
+        for ctl, mbs, jobs in [('A', busy, len(vdisks)), ('B', 0.0, 0)]:
+            cpu = min(99, 3 + 15 * jobs)
+            rows.append([('Durable ID', 'controller_' + ctl), ('CPU Load', str(cpu)),
+                         ('Power On Time', str(int(self.now() - self.arraystart))),
+                         ('Bytes per second', '%.1fMB' % mbs),
+                         ('IOPS', str(int(mbs * 4))), ('Reset Time', self.timestr(self.arraystart))])
+        return self.statsrows(self.controllerstatsheader, rows)
+
+    vdiskstatsheader = ('Name  Serial Number                        Bytes per second   IOPS             '
+                        'Number of Reads  Number of Writes  Reset Time')
+
+    def show_vdisk_statistics(self, args):
+        disks, vdisks = self.job_rates()
+        rows = []
+        for vdisk in sorted(self.vdisks):
+            mbs = vdisks.get(vdisk, 0.0) * 2
+            rows.append([('Name', vdisk), ('Serial', self.vdisks[vdisk]['serial']),
+                         ('Bytes per second', '%.1fMB' % mbs), ('IOPS', str(int(mbs * 4))),
+                         ('Reset Time', self.timestr(self.arraystart))])
+        return self.statsrows(self.vdiskstatsheader, rows)
+
+    diskstatsheader = ('Durable ID   Serial Number    Bytes per second   IOPS             '
+                       'Queue Depth  Number of Reads  Number of Writes  Reset Time')
+
+    def show_disk_statistics(self, args):
+        disks, vdisks = self.job_rates()
+        rows = []
+        for location in sorted(self.disks, key=lambda l: [int(x) for x in l.split('.')]):
+            enclosure, slot = location.split('.')
+            mbs = disks.get(location, (0.0,))[0]
+            rows.append([('Durable ID', 'disk_%02d.%02d' % (int(enclosure), int(slot))),
+                         ('Serial', self.disks[location]['serial']),
+                         ('Bytes per second', '%.1fMB' % mbs), ('IOPS', str(int(mbs * 4))),
+                         ('Queue Depth', mbs and '4' or '0'),
+                         ('Reset Time', self.timestr(self.arraystart))])
+        return self.statsrows(self.diskstatsheader, rows)
+
+    hostportstatsheader = ('Durable ID   Bytes per second   IOPS             Number of Reads  '
+                           'Number of Writes  Queue Depth  Reset Time')
+
+    def show_host_port_statistics(self, args):
+        disks, vdisks = self.job_rates()
+        mbs = self.config['hostmbs']
+        if vdisks:
+            mbs *= 1 - self.priorities[self.priority][1]
+        rows = []
+        for port in ['A1', 'A2', 'B1', 'B2']:
+            rows.append([('Durable ID', 'hostport_' + port),
+                         ('Bytes per second', '%.1fMB' % (mbs / 4)),
+                         ('IOPS', str(int(mbs / 4 * 16))),
+                         ('Queue Depth', mbs and '8' or '0'),
+                         ('Reset Time', self.timestr(self.arraystart))])
+        return self.statsrows(self.hostportstatsheader, rows)
+
+    ##### job parameters
+    def show_job_parameters(self, args):
+        return ('Job Parameters\n--------------\nAuto Stall Recovery: Enabled\n'
+                'Priority: {0}\n\n'.format(self.priority.capitalize())
+                + self.trailer())
+
+    def set_job_parameters(self, args):
+        if len(args) < 2 or args[0] != 'priority' \
+                or args[1] not in ('high', 'medium', 'low'):
+            return self.error('The parameter is not valid. (%s)' % ' '.join(args))
+        self.priority = args[1]
+        return self.trailer()
+
+    def show_events(self, args):
+        num = len(self.events)
+        if len(args) >= 2 and args[0] == 'last':
+            num = int(args[1])
+        lines = self.events[-num:] if num else []
+        lines.reverse()
+        return ''.join([line + '\n' for line in lines]) + self.trailer()
+
+    def down_disk(self, args):
+        location = args[0]
+        disk = self.disks.get(location)
+        if disk is None or disk['use'] != 'VDISK':
+            return self.error('The specified disk is not part of a vdisk. (%s)' % location)
+        vdisk = disk['vdisk']
+        raid = self.vdisks[vdisk]['raid']
+        missing = len([r for r in self.rebuilds if r['vdisk'] == vdisk
+                       and r['phase'] in ('pending', 'rcon')])
+        if missing >= {'RAID6': 2}.get(raid, 1):
+            return self.error('The vdisk would go offline. (%s)' % location)
+        spares = sorted([l for l, d in self.disks.items() if d['use'] == 'GLOBAL SP'],
+                        key=lambda l: [int(x) for x in l.split('.')])
+        if not spares:
+            return self.error('No spare is available. (%s)' % location)
+        spare = spares[0]
+        t = self.now()
+        disk['use'] = 'LEFTOVR'
+        members = self.vdisks[vdisk]['members']
+        members[members.index(location)] = spare
+        self.disks[spare].update({'use': 'VDISK', 'vdisk': vdisk})
+        self.log(t, 8, 'WARNING', 'A disk that was part of a vdisk is down. '
+                 + self.diskparams(location))
+        self.log(t, 9, 'INFORMATIONAL', 'A spare disk was used in a vdisk to bring it '
+                 'back to a fault-tolerant state. ' + self.vdiskparams(vdisk)
+                 + ' ' + self.diskparams(spare))
+        self.rebuilds.append({'vdisk': vdisk, 'failed': location, 'spare': spare,
+                              'phase': 'pending', 'start': t,
+                              'at': t + self.config['rcondelay']})
+        return ('Info: Disk {0} was placed in a down state. ({0})\n'.format(location)
+                + self.trailer('Command completed successfully. ({0}) - Disk {0} '
+                               'was placed in a down state.'.format(location)))
+
+    def start_utility(self, args, phase, name):
+        """scrub vdisk <vdisk> or verify vdisk <vdisk>"""
+        if len(args) < 2 or args[0] != 'vdisk' or args[1] not in self.vdisks:
+            return self.error('The specified vdisk was not found. (%s)' % ' '.join(args[1:]))
+        vdisk = args[1]
+        if [r for r in self.rebuilds if r['vdisk'] == vdisk]:
+            return self.error('The vdisk has a utility running. (%s)' % vdisk)
+        if len([r for r in self.rebuilds if r['phase'] in ('vrsc', 'vrfy')]) \
+                >= self.config['utilities']:
+            return self.error('The maximum number of utilities are running. (%s)' % vdisk)
+        t = self.now()
+        mb = size_mb(self.vdisksize(vdisk))
+        self.rebuilds.append({'vdisk': vdisk, 'failed': None, 'spare': None,
+                              'phase': phase, 'start': t,
+                              'at': t + mb / self.scrubmbs()})
+        code = {'vrsc': 206, 'vrfy': 20}[phase]
+        self.log(t, code, 'INFORMATIONAL', 'Vdisk {0} started. '.format(name)
+                 + self.vdiskparams(vdisk))
+        return self.trailer('Command completed successfully. - {0} was started on '
+                            'vdisk {1}.'.format(name.capitalize(), vdisk))
+
+    def clear_metadata(self, args):
+        location = args[0]
+        disk = self.disks.get(location)
+        if disk is None or disk['use'] != 'LEFTOVR':
+            return self.error('The specified disk is not a leftover disk. ({0})\n'
+                              ' - Metadata was not cleared for one or more disks.'
+                              .format(location))
+        disk.update({'use': 'AVAIL', 'vdisk': ''})
+        t = self.now()
+        for r in self.rebuilds:
+            if r['failed'] == location and r['phase'] == 'rebuilt':
+                r['phase'] = 'cpybkpending'
+                r['at'] = t + self.config['cpybkdelay']
+        enclosure, slot = location.split('.')
+        #no Success: trailer, as on GL145R006
+        return ('Info: Updating disk list...\n'
+                'Info: Disk disk_{0:02d}.{1:02d} metadata was cleared. ({2})\n'
+                .format(int(enclosure), int(slot), self.timestr()))
+
+    commands = [
+        ('show version', show_version),
+        ('show system', show_system),
+        ('show vdisks', show_vdisks),
+        ('show disks', show_disks),
+        ('show events', show_events),
+        ('show controller-statistics', show_controller_statistics),
+        ('show vdisk-statistics', show_vdisk_statistics),
+        ('show disk-statistics', show_disk_statistics),
+        ('show host-port-statistics', show_host_port_statistics),
+        ('show job-parameters', show_job_parameters),
+        ('set job-parameters', set_job_parameters),
+        ('down disk', down_disk),
+        ('clear disk-metadata', clear_metadata),
+        ('scrub vdisk', lambda self, args: self.start_utility(['vdisk'] + args,
+                                                              'vrsc', 'scrub')),
+        ('verify vdisk', lambda self, args: self.start_utility(['vdisk'] + args,
+                                                               'vrfy', 'verify')),
+        ('set cli-parameters', lambda self, args: self.trailer()),
+    ]
+
+    def command(self, rawcmd):
+        """Run one CLI command, return its output"""
+        self.advance()
+        words = rawcmd.split()
+        for name, fn in self.commands:
+            n = len(name.split())
+            if words[:n] == name.split():
+                return fn(self, words[n:])
+        return self.error('The command is not recognized. (%s)' % rawcmd)
+
+    ##### SMcli (NetApp E-Series)
+    #The same array seen through SMcli: each vdisk is a volume group
+    #holding one volume (<vdisk>_1), drive <enclosure>.<slot> is
+    #[<tray>,<slot>] and the event log is written as MEL records.
+    smclijobs = {'RCON': 'Reconstruction', 'CPYBK': 'Copyback'}
+    #DotHill event code -> MEL description, None to leave the event out
+    smclievents = {8: 'Drive failed', 9: 'Hot spare in use',
+                   37: 'Reconstruction started',
+                   18: 'Reconstruction completed',
+                   499: 'Copyback started', 500: 'Copyback completed'}
+    revent = re.compile('(\\S+ \\S+) \\[(\\d+)\\] #A(\\d+): .*? (?:INFORMATIONAL|WARNING|ERROR) '
+                        '(.*)$')
+    rdrive = re.compile('\\[(\\d+),(\\d+)\\]')
+
+    def smcli_summary(self, args):
+        return ('STORAGE ARRAY SUMMARY--------------------------\n'
+                '   Storage array name:        {0}\n'
+                '   Chassis serial number:     {1}\n'
+                '   Board ID:                  5600\n'
+                '   Current package version:   08.20.24.00\n\n'
+                .format(self.name, self.serial))
+
+    def smcli_set_time(self, args):
+        #the controller clocks are set from this host
+        self.advance()
+        self.arraystart = self.realstart = time.time()
+        return ''
+
+    def smcli_drives(self, args):
+        out = 'DRIVES------------------------------\n\n'
+        for location in sorted(self.disks, key=lambda l: [int(x) for x in l.split('.')]):
+            d = self.disks[location]
+            status, mode, group = 'Optimal', 'Unassigned', 'None'
+            if d['use'] == 'VDISK':
+                mode, group = 'Assigned', d['vdisk']
+            elif d['use'] == 'GLOBAL SP':
+                mode = 'Hot Spare Standby'
+            elif d['use'] == 'LEFTOVR':
+                status = 'Failed'
+            enclosure, slot = location.split('.')
+            out += ('   Drive at Tray {0}, Slot {1}\n'
+                    '      Status:                 {2}\n'
+                    '      Mode:                   {3}\n'
+                    '      Raw capacity:           {4:,.3f} GB\n'
+                    '      Volume group:           {5}\n'
+                    '      Serial number:          {6}\n\n'
+                    .format(enclosure, slot, status, mode,
+                            self.config['disksize'], group, d['serial']))
+        return out
+
+    def volumepriority(self, volume):
+        return getattr(self, 'volumepriorities', {}).get(volume, self.priority)
+
+    def smcli_volumes(self, args):
+        out = 'STANDARD VOLUMES------------------------------\n\n'
+        for vdisk in sorted(self.vdisks):
+            status = self.vdiskjob(vdisk, self.now())[0]
+            out += ('   Volume name: {0}_1\n'
+                    '      Volume status:          {1}\n'
+                    '      Capacity:               {2:,.3f} GB\n'
+                    '      Volume group:           {0}\n'
+                    '      RAID level:             {3}\n'
+                    '      Modification priority:  {4}\n\n'
+                    .format(vdisk, status == 'FTOL' and 'Optimal' or 'Degraded',
+                            size_mb(self.vdisksize(vdisk)) / 1e3,
+                            self.vdisks[vdisk]['raid'][4:],
+                            self.volumepriority(vdisk + '_1').capitalize()))
+        return out
+
+    def smcli_operations(self, args):
+        now = self.now()
+        out = 'LOGICAL DEVICES  OPERATION       STATUS         TIME REMAINING\n'
+        for vdisk in sorted(self.vdisks):
+            status, job, pct = self.vdiskjob(vdisk, now)
+            if job in self.smclijobs:
+                out += '{0:<16} {1:<15} {2:<14} 00:10 hr:min\n'.format(
+                    vdisk + '_1', self.smclijobs[job], '%d%% Completed' % pct)
+        return out + '\n'
+
+    def smcli_location(self, args):
+        m = self.rdrive.search(' '.join(args))
+        location = m and '{0}.{1}'.format(int(m.group(1)), int(m.group(2)))
+        if location not in self.disks:
+            raise RuntimeError('The drive does not exist.')
+        return location
+
+    def smcli_fail_drive(self, args):
+        if 'operationalState=failed' not in args:
+            raise RuntimeError('Syntax error: ' + ' '.join(args))
+        output = self.down_disk([self.smcli_location(args)])
+        if output.startswith('Error'):
+            raise RuntimeError('The operation cannot complete because the drive '
+                             'is not assigned to a volume group.')
+        return ''
+
+    def smcli_revive_drive(self, args):
+        output = self.clear_metadata([self.smcli_location(args)])
+        if output.startswith('Error'):
+            raise RuntimeError('The operation cannot complete because the drive '
+                             'has not failed.')
+        return ''
+
+    def smcli_set_priority(self, args):
+        #set allVolumes|volume ["<name>"] modificationPriority=<priority>
+        #The jobs run at the priority set last.
+        m = re.match('(?:\\["?([^"\\]]+)"?\\] )?modificationPriority=(\\w+)$',
+                     ' '.join(args))
+        if not m or m.group(2).lower() not in self.priorities:
+            raise RuntimeError('Syntax error: ' + ' '.join(args))
+        volumes = [v + '_1' for v in self.vdisks]
+        if m.group(1):
+            if m.group(1) not in volumes:
+                raise RuntimeError('The volume does not exist.')
+            volumes = [m.group(1)]
+        self.volumepriorities = dict([(v + '_1', self.volumepriority(v + '_1'))
+                                      for v in self.vdisks])
+        for volume in volumes:
+            self.volumepriorities[volume] = m.group(2).lower()
+        self.priority = m.group(2).lower()
+        return ''
+
+    def smcli_save_events(self, args):
+        #save storageArray allEvents file="<path>" count=<n>, newest first
+        m = re.search('file="([^"]+)"', ' '.join(args))
+        if not m:
+            raise RuntimeError('Syntax error: ' + ' '.join(args))
+        count = re.search('count=(\\d+)', ' '.join(args))
+        lines = self.events[-int(count.group(1)):] if count else self.events
+        records = []
+        for line in reversed(lines):
+            e = self.revent.match(line)
+            description = e and self.smclievents.get(int(e.group(2)))
+            message = e and e.group(4) or ''
+            if not description or 'is the source disk' in message \
+                    or 'restored to being a spare' in message:
+                continue
+            mdisk = re.search('enclosure: (\\d+), slot: (\\d+)', message)
+            mvdisk = re.search('vdisk: (\\w+)', message)
+            if mdisk and not description.startswith('Reconstruction'):
+                component = 'Drive', 'Tray {0}, Slot {1}'.format(*mdisk.groups())
+            else:
+                component = 'Volume group', 'Volume group: ' + mvdisk.group(1)
+            eventtime = datetime.datetime.strptime(e.group(1), timeformat)
+            records.append('Date/Time: {0}\n'
+                           'Sequence number: {1}\n'
+                           'Event type: {2:04X}\n'
+                           'Description: {3}\n'
+                           'Component type: {4}\n'
+                           'Component location: {5}\n'
+                           'Logged by: Controller in slot A\n\n'
+                           .format(eventtime.strftime('%m/%d/%y %I:%M:%S %p'),
+                                   e.group(3), int(e.group(2)), description,
+                                   component[0], component[1]))
+        with open(m.group(1), 'w') as f:
+            f.write(''.join(records))
+        return ''
+
+    smclicommands = [
+        ('set storageArray time', smcli_set_time),
+        ('show storageArray summary', smcli_summary),
+        ('show storageArray longRunningOperations', smcli_operations),
+        ('show allDrives', smcli_drives),
+        ('show allVolumes', smcli_volumes),
+        ('set drive', smcli_fail_drive),
+        ('revive drive', smcli_revive_drive),
+        ('set allVolumes', smcli_set_priority),
+        ('set volume', smcli_set_priority),
+        ('save storageArray allEvents', smcli_save_events),
+    ]
+
+    def smcli(self, script):
+        """Run an SMcli script (commands ending in ;), return its output"""
+        #As SMcli, the script stops at the first command that fails, after
+        #running the ones before it.
+        self.advance()
+        out = 'Executing script...\n\n'
+        for rawcmd in [c.strip() for c in script.split(';') if c.strip()]:
+            words = rawcmd.split()
+            for name, fn in self.smclicommands:
+                n = len(name.split())
+                if words[:n] == name.split():
+                    break
+            else:
+                return out + 'Error 2 - Syntax error: {0}\n\nSMcli failed.\n'\
+                    .format(rawcmd)
+            try:
+                out += fn(self, words[n:])
+            except RuntimeError, e:
+                return out + 'Error 1 - {0}\n\nSMcli failed.\n'.format(e)
+        return out + 'Script execution complete.\n\nSMcli completed successfully.\n'
+###End of Class SimArray###
+
+
+################################################################################
+def size_mb(size):
+    """899.2GB -> 899200.0"""
+    return float(size[:-2]) * {'MB': 1.0, 'GB': 1e3, 'TB': 1e6}[size[-2:]]
+
+
+def statefile(name):
+    return os.path.join(statedir, name + '.json')
+
+
+def run_stored(name, rawcmd, smcli=False):
+    """Run rawcmd (an SMcli script if smcli) on the array state kept in
+    statedir, return its output"""
+    #Both controllers' CLI sessions can be open at once, so the state file
+    #is locked from load to save.
+    if not os.path.isdir(statedir):
+        os.makedirs(statedir)
+    with open(statefile(name) + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(statefile(name)):
+            with open(statefile(name), 'r') as f:
+                array = SimArray(name, state=json.load(f))
+        else:
+            array = SimArray(name, config=config_from_env())
+        output = (smcli and array.smcli or array.command)(rawcmd)
+        with open(statefile(name) + '.tmp', 'w') as f:
+            json.dump(array.todict(), f)
+        os.rename(statefile(name) + '.tmp', statefile(name))
+    return (array, output)
+
+
+def config_from_env():
+    """Config overrides from DOTHILLSIM_<SETTING> environment variables"""
+    config = {}
+    for key, value in defaultconfig.items():
+        env = os.environ.get('DOTHILLSIM_' + key.upper())
+        if env is not None and not isinstance(value, list):
+            config[key] = type(value)(env)
+    return config
+
+
+def split_target(target):
+    """damc002-31 -> ('damc002-3', 1)"""
+    return (target[:-1], int(target[-1]))
+
+
+################################################################################
+class SimTransport:
+    """In-process stand-in for an array controller CLI session.
+    """
+    #Arrays are created on first use from SimTransport.config and live as
+    #long as the process.
+    config = {}
+    arrays = {}
+
+    def __init__(self, name, controller):
+        self.name = name
+        self.controller = controller
+
+    def send(self, rawcmd):
+        import dothilldmandr
+        if self.name not in self.arrays:
+            self.arrays[self.name] = SimArray(self.name, self.config)
+        array = self.arrays[self.name]
+        if array.config['cmdlatency']:
+            time.sleep(array.config['cmdlatency'])
+        if self.controller in array.config['failed']:
+            raise dothilldmandr.SessionError("simulated failure of controller %d"
+                                             % self.controller)
+        return array.command(rawcmd)
+
+    def close(self):
+        pass
+###End of Class SimTransport###
+
+
+################################################################################
+def rshfa_main(argv):
+    """dothillsim.py -V dh <array><controller> [command ...]"""
+    if len(argv) < 3 or argv[0] != '-V':
+        sys.stderr.write('usage: dothillsim.py -V dh <array><controller> [command]\n')
+        return 2
+    name, controller = split_target(argv[2])
+    rawcmd = ' '.join(argv[3:])
+
+    def answer(rawcmd):
+        array, output = run_stored(name, rawcmd)
+        if array.config['cmdlatency']:
+            time.sleep(array.config['cmdlatency'])
+        if controller in array.config['failed']:
+            sys.stdout.write('rsh: connect to %s: Connection refused\n' % argv[2])
+            return False
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        return True
+
+    if rawcmd:
+        return 0 if answer(rawcmd) else 1
+    #interactive CLI session: a banner, then a "# " prompt before each command
+    sys.stdout.write('DotHill CLI session to {0}\n# '.format(argv[2]))
+    sys.stdout.flush()
+    while True:
+        line = sys.stdin.readline()
+        if not line or line.strip() == 'exit':
+            return 0
+        if line.strip() and not answer(line.strip()):
+            return 1
+        sys.stdout.write('# ')
+        sys.stdout.flush()
+
+
+def smcli_main(argv):
+    """dothillsim.py <array>1 <array>2 -c '<script>'"""
+    if len(argv) < 3 or argv[-2] != '-c':
+        sys.stderr.write("usage: dothillsim.py <array>1 <array>2 -c '<script>'\n")
+        return 2
+    targets = [split_target(t) for t in argv[:-2]]
+    array, output = run_stored(targets[0][0], argv[-1], smcli=True)
+    if array.config['cmdlatency']:
+        time.sleep(array.config['cmdlatency'])
+    if not [c for n, c in targets if c not in array.config['failed']]:
+        #SMcli tries each controller given
+        output = ('Executing script...\n\nUnable to communicate with the '
+                  'storage array.\n\nSMcli failed.\n')
+    sys.stdout.write(output)
+    return 0 if output.endswith('SMcli completed successfully.\n') else 1
+
+
+def main():
+    global statedir
+
+    if len(sys.argv) > 1 and sys.argv[1] == '-V':
+        sys.exit(rshfa_main(sys.argv[1:]))
+    if len(sys.argv) > 2 and sys.argv[-2] == '-c':
+        sys.exit(smcli_main(sys.argv[1:]))
+
+    usage = "%prog --init <array> [options] | --show <array> | -V dh <array><controller> [command] | <array>1 <array>2 -c '<script>'"
+    parser = OptionParser(usage, version="%prog 0.1")
+    parser.add_option("--init", dest="init",
+                      help="create (or reset) a simulated array")
+    parser.add_option("--show", dest="show",
+                      help="print a simulated array's state")
+    parser.add_option("--statedir", dest="statedir", default=statedir,
+                      help="directory for array state, default=%default (or $DOTHILLSIM_DIR)")
+    parser.add_option("-x", "--compress", type="float", dest="compress",
+                      default=defaultconfig['compress'],
+                      help="array seconds per real second, default=%default")
+    for key in ['vdisks', 'disksper', 'spares', 'utilities']:
+        parser.add_option("--" + key, type="int", dest=key, default=defaultconfig[key],
+                          help="default=%default")
+    for key in ['disksize', 'rcontime', 'cpybktime', 'rcondelay', 'cpybkdelay',
+                'overlap', 'cmdlatency', 'hostmbs', 'scrubmbs']:
+        parser.add_option("--" + key, type="float", dest=key, default=defaultconfig[key],
+                          help="default=%default")
+    parser.add_option("--raid", dest="raid", default=defaultconfig['raid'],
+                      help="RAID1, RAID5, RAID6 or RAID10, default=%default")
+    parser.add_option("--fail", type="int", action="append", dest="failed", default=[],
+                      help="controller (1 or 2) that doesn't answer")
+    (options, args) = parser.parse_args()
+    statedir = options.statedir
+
+    if options.init:
+        if not os.path.isdir(statedir):
+            os.makedirs(statedir)
+        config = dict([(k, getattr(options, k)) for k in defaultconfig])
+        array = SimArray(options.init, config)
+        with open(statefile(options.init), 'w') as f:
+            json.dump(array.todict(), f)
+        print "Created {0} in {1}: {2} {3} vdisks of {4} disks, {5} spares, "\
+              "compression {6}".format(options.init, statedir, config['vdisks'],
+                                       config['raid'], config['disksper'],
+                                       config['spares'], config['compress'])
+    elif options.show:
+        array, output = run_stored(options.show, 'show vdisks')
+        print output
+        for r in array.rebuilds:
+            print r
+        print "Array time: " + array.timestr()
+    else:
+        parser.print_help()
+
+
+################################################################################
+if __name__ == "__main__":
+    main()
@@ -43,6 +43,7 @@
 #Jun 21 11:16:46 pit31 Teradata[28598]: INFO: Teradata: 2900 # 16/06/21 11:16:46 Logons are enabled
 
 
+import sys
 import datetime
 import re
 from optparse import OptionParser
@@ -77,6 +78,14 @@ rx = re.compile('#TPA START: "recond -S"') #start of down
 rup = re.compile('Logons are enabled')     #end of any
 rrr = re.compile('Restart reason is:\s+(?P<reason>[\w\s]*)')  #warm, force, or cold
 rf = re.compile('#RESET START: "recond -L"')  #force
+rps = re.compile('PDE state(?: is|:)\s*(?P<state>[A-Z]+/[A-Z]+)')  #PDE state change
+#vproc state change, the state it goes to (the last state named)
+vprocstates = 'ONLINE|RUN|OFFLINE|UTILITY|NEWPROC|FATAL|NONODE'
+rvp = re.compile('[Vv]proc\s+(?P<vproc>\d+)\D.*'
+                 '\\b(?P<state>' + vprocstates + ')\\b')
+rvpup = re.compile('[Vv]proc\s+(?P<vproc>\d+)\D.*'
+                   '\\b(?P<state>ONLINE|RUN)\\b'
+                   '(?!.*\\b(?:' + vprocstates + ')\\b)')  #vproc coming up
 
 
 months = {
@@ -143,6 +152,161 @@ def time_from_str(timestr, logformat=True):
     return thetime
 
 
+class RestartTimeline():
+    """Milestones of one restart in the system log, up to Logons are enabled
+
+    Phase boundaries are the restart start, the first PDE START state (or
+    the recond -L reset of a forced restart), the first vproc coming up
+    (ONLINE or RUN), the PDE RUN state and Logons are enabled.  A boundary
+    missing from the log folds its phase into the one before.
+    """
+    phases = ["Shutdown", "PDE start", "Vproc startup", "DBS recovery"]
+    #(milestone, pattern, phase boundary it marks), first match wins
+    patterns = [
+        ("logons", rup, 4),
+        ("start", rr, 0),
+        ("start", rx, 0),
+        ("reason", rrr, None),
+        ("reset", rf, 1),
+        ("pdestate", rps, None),
+        ("vproc", rvpup, 2),
+        ("vprocstate", rvp, None),  #shutdown transitions, OFFLINE, FATAL...
+    ]
+    #boundary -> the boundary that must be seen before it; any earlier one
+    #will do for the others
+    after = {2: 1}
+
+    def __init__(self, kind=""):
+        self.kind = kind  #restart type, e.g. "Warm restart"
+        self.milestones = []  #(time, milestone, detail)
+        self.bounds = [None] * (len(self.phases) + 1)
+
+    def add(self, line):
+        """Record line if it's a milestone, return True at Logons are enabled"""
+        for (name, pattern, bound) in self.patterns:
+            m = pattern.search(line)
+            if m:
+                break
+        else:
+            return False
+
+        entrytime = time_from_str(line)
+        if name == "pdestate":
+            detail = m.group('state')
+            if detail.startswith("START"):
+                bound = 1
+            elif detail.startswith("RUN"):
+                bound = 3
+        elif name in ("vproc", "vprocstate"):
+            detail = "vproc {0} {1}".format(m.group('vproc'), m.group('state'))
+        elif name == "reason":
+            detail = m.group('reason').strip()
+        else:
+            detail = m.group(0).strip("#")
+        self.milestones.append((entrytime, name, detail))
+        #Boundaries are taken in order: each one after the restart start
+        #counts only once the one it needs (after) or an earlier one has
+        #been seen, and none counts once a later one has, so a stray line
+        #(e.g. a vproc left from the previous restart) can't set one out of
+        #order. One missing from the log is skipped.
+        if bound is not None and self.bounds[bound] is None \
+                and self.ready(bound) \
+                and not [t for t in self.bounds[bound + 1:] if t is not None]:
+            self.bounds[bound] = entrytime
+        return name == "logons"
+
+    def ready(self, bound):
+        """True if the boundaries bound needs before it have been seen"""
+        if bound == 0:
+            return True
+        if bound in self.after:
+            return self.bounds[self.after[bound]] is not None
+        return [t for t in self.bounds[:bound] if t is not None] != []
+
+    def durations(self):
+        """Return the phase durations (None if not seen) and the total"""
+        durations = []
+        for i in range(len(self.phases)):
+            end = None
+            for b in self.bounds[i + 1:]:
+                if b is not None:
+                    end = b
+                    break
+            if self.bounds[i] is None or end is None:
+                durations.append(None)
+            else:
+                durations.append(end - self.bounds[i])
+        if self.bounds[0] is None or self.bounds[-1] is None:
+            total = None
+        else:
+            total = self.bounds[-1] - self.bounds[0]
+        return (durations, total)
+
+    def last(self, name):
+        """Return the time of the last milestone called name, or None"""
+        for (entrytime, milestone, detail) in reversed(self.milestones):
+            if milestone == name:
+                return entrytime
+        return None
+
+    def print_milestones(self):
+        start = self.bounds[0] or self.milestones[0][0]
+        for (entrytime, name, detail) in self.milestones:
+            print "  +{0:>8}  {1:9} {2}".format(entrytime - start, name, detail)
+
+###End of Class RestartTimeline###
+
+
+def fmt_et(et):
+    """Format a timedelta without microseconds, - if unknown"""
+    if et is None:
+        return "-"
+    return str(et).split(".")[0]
+
+
+def print_phase_header():
+    print "{0:16}{1:>4}".format("Restart", "N"),
+    for phase in RestartTimeline.phases + ["Logons enabled"]:
+        print "{0:>15}".format(phase),
+    print
+
+
+def print_phases(timeline, label=None):
+    """Print one restart's phase durations"""
+    (durations, total) = timeline.durations()
+    print "{0:16}{1:>4}".format(label or timeline.kind, 1),
+    for et in durations + [total]:
+        print "{0:>15}".format(fmt_et(et)),
+    print
+
+
+def print_phase_averages(timelines):
+    """Print the average duration of each phase per restart type"""
+    kinds = []
+    for t in timelines:
+        if t.kind not in kinds:
+            kinds.append(t.kind)
+    if not kinds:
+        return
+
+    print "\nRestart phase averages:"
+    print_phase_header()
+    for kind in kinds:
+        rows = [t.durations() for t in timelines if t.kind == kind]
+        print "{0:16}{1:>4}".format(kind, len(rows)),
+        for i in range(len(RestartTimeline.phases) + 1):
+            if i < len(RestartTimeline.phases):
+                ets = [d[i] for (d, total) in rows if d[i] is not None]
+            else:
+                ets = [total for (d, total) in rows if total is not None]
+            if ets:
+                avg = sum(ets, datetime.timedelta(0)) / len(ets)
+            else:
+                avg = None
+            print "{0:>15}".format(fmt_et(avg)),
+        print
+
+
 def get_restart_times(logname, begintime, endtime, 
                       checkwarm, checkforce, checkdown, checkcold):
     """Find restarts in a log file"""
@@ -176,6 +340,7 @@ def get_restart_times(logname, begintime, endtime,
         downrestart_total_et = datetime.timedelta(0)
         coldrestart_total_et = datetime.timedelta(0)
         forcerestart_total_et = datetime.timedelta(0)
+        timelines = []
 
         while not stopfound:
             isdownrestart = False
@@ -196,6 +361,8 @@ def get_restart_times(logname, begintime, endtime,
                 mx = rx.search(line)   # down restart
                 if mr or mx:
                     begintime = entrytime
+                    timeline = RestartTimeline()
+                    timeline.add(line)
                     if verbose or debug: 
                         print "Found restart:"
                         print line
@@ -213,6 +380,7 @@ def get_restart_times(logname, begintime, endtime,
             #get the restart reason in the next line unless it's a down restart
             if not isdownrestart:
                 for line in f:
+                    timeline.add(line)
                     mrr = rrr.search(line)
                     if mrr:
                         reason = mrr.group('reason') 
@@ -225,6 +393,7 @@ def get_restart_times(logname, begintime, endtime,
             #go until end of test (logons enabled)
             for line in f: 
                 if debug: print "Look for end of test:", line
+                timeline.add(line)
 
                 mf = rf.search(line) #recond -L
                 mup = rup.search(line)  #Logons are enabled
@@ -255,6 +424,8 @@ def get_restart_times(logname, begintime, endtime,
                     downcount += 1
                     print "Down restart {0}".format(downcount)
                     downrestart_total_et += elapsedtime
+                    timeline.kind = "Down restart"
+                    timelines.append(timeline)
                     print "Start: {0}, End: {1}, ET: {2}\n"\
                           .format(begintime, enabledtime, elapsedtime)
             elif isforcerestart:
@@ -262,6 +433,8 @@ def get_restart_times(logname, begintime, endtime,
                     forcecount += 1
                     print "Force restart {0}".format(forcecount)
                     forcerestart_total_et += elapsedtime
+                    timeline.kind = "Force restart"
+                    timelines.append(timeline)
                     print "Start: {0}, End: {1}, ET: {2}"\
                           .format(begintime, enabledtime, elapsedtime)
                     print "Reason:", reason
@@ -270,6 +443,8 @@ def get_restart_times(logname, begintime, endtime,
                     coldcount += 1
                     print "Cold restart {0}".format(coldcount)
                     coldrestart_total_et += elapsedtime
+                    timeline.kind = "Cold restart"
+                    timelines.append(timeline)
                     print "Start: {0}, End: {1}, ET: {2}\n"\
                           .format(begintime, enabledtime, elapsedtime)
                     #print "Reason:", reason, "\n"
@@ -278,10 +453,18 @@ def get_restart_times(logname, begintime, endtime,
                     warmcount += 1
                     print "Warm restart {0}".format(warmcount)
                     warmrestart_total_et += elapsedtime
+                    timeline.kind = "Warm restart"
+                    timelines.append(timeline)
                     print "Start: {0}, End: {1}, ET: {2}"\
                           .format(begintime, enabledtime, elapsedtime)
                     print "Reason:", reason
 
+            if timelines and timelines[-1] is timeline:
+                print_phase_header()
+                print_phases(timeline)
+                if verbose: timeline.print_milestones()
+                print
+
         ### end while not stopfound
         if debug: print "Done going through log"
         if verbose: print
@@ -303,6 +486,7 @@ def get_restart_times(logname, begintime, endtime,
             print "Down restart average of {0} tests: {1}"\
               .format(downcount, str(downrestart_total_et/downcount).split(".")[0])
 
+        print_phase_averages(timelines)
 
         return
 
@@ -310,6 +494,38 @@ def get_restart_times(logname, begintime, endtime,
 ############################################################################
 
 ############################################################################
+#A warm restart whose shutdown logs vproc state changes before PDE START:
+#they mustn't count as vproc startup. (line, expected boundary it sets)
+selftestlog = [
+    ("Jun 20 11:00:00 pit31 Teradata[25784]: DEGRADED: Teradata: 10198 "
+     "#Force a TPA restart.", 0),
+    ("Jun 20 11:00:05 pit31 Teradata[25784]: vproc 3 state change to OFFLINE",
+     None),
+    ("Jun 20 11:00:20 pit31 Teradata[1201]: PDE state is START/RECONCILE", 1),
+    ("Jun 20 11:00:40 pit31 Teradata[1201]: Vproc 0 state ONLINE", 2),
+    ("Jun 20 11:01:00 pit31 Teradata[1201]: PDE state is RUN/STARTED", 3),
+    ("Jun 20 11:01:47 pit31 Teradata[32017]: INFO: Teradata: 2900 "
+     "# 16/06/20 11:01:47 Logons are enabled", 4),
+]
+
+
+def selftest():
+    """Check the phase boundaries RestartTimeline finds in selftestlog,
+    return True if they are right"""
+    timeline = RestartTimeline("Warm restart")
+    expected = [None] * len(timeline.bounds)
+    for (line, bound) in selftestlog:
+        timeline.add(line)
+        if bound is not None:
+            expected[bound] = time_from_str(line)
+    ok = timeline.bounds == expected
+    print "Phase boundaries: {0}".format(ok and "ok" or "wrong")
+    if not ok:
+        for (found, want) in zip(timeline.bounds, expected):
+            print "  {0}  expected {1}".format(found, want)
+    return ok
+
+
 def main():
     global debug
     global verbose
@@ -340,10 +556,15 @@ def main():
     parser.add_option("-c", "--coldrestart", 
                       action="store_true", dest="checkcold", default=False,
                       help="look for cold restarts")
+    parser.add_option("--selftest",
+                      action="store_true", dest="selftest", default=False,
+                      help="check the phase boundaries found in a built-in sample restart and exit")
     (options, args) = parser.parse_args()
 
     debug = options.debug
     verbose = options.verbose
+    if options.selftest:
+        sys.exit(not selftest() and 1 or 0)
     logname = options.logname
     if options.begintimestr:
         begintime = time_from_str(options.begintimestr, False)
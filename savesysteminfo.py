@@ -268,6 +268,33 @@ def psh_hostname(copy = True):
     if copy: fo.close()
 
 
+def psh_lines(cmd):
+    """Run cmd on every node with psh, return {hostname: [output lines]}"""
+    #Requires nodeip2hostname map to exist (from psh_hostname)
+    #Each node's output follows a header line with its ip address:
+    #<---------------------  39.48.8.2  -------------------------------->
+    rheader = re.compile('<-+\s+(?P<ip>\d+.\d+.\d+.\d+)\s+-+>')
+
+    if not quiet: print("cmd: psh " + cmd)
+    #no local shell, so cmd reaches psh (and the node's shell) as is
+    p = Popen(['psh', cmd], stdout=PIPE, stderr=PIPE, cwd=outdir)
+    stdout, stderr = p.communicate()
+    for line in stderr.splitlines():
+        eprint(line)
+
+    nodelines = {}
+    lines = None
+    for line in stdout.splitlines():
+        if verbose: print(line)
+        mheader = rheader.search(line)
+        if mheader:
+            ip = mheader.group('ip')
+            lines = nodelines.setdefault(nodeip2hostname.get(ip, ip), [])
+        elif lines is not None:
+            lines.append(line)
+    return nodelines
+
+
 def psh_i_s(copy = True):
     """Get psh info sys, get cn, cliqreplist, nodelist"""
     #Requires nodeip2hostname map to exist (from hostname)